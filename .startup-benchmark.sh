@@ -0,0 +1,22 @@
+#!/bin/bash
+# prints the average time in seconds a cold `./bldr` takes to list tasks and run the trivial tasks.
+# none of these should import a task module, see `taskrunner.lazy_task`.
+# usage: ./.startup-benchmark.sh [runs]
+
+set -e
+
+source venv/bin/activate
+
+runs=${1:-10}
+
+for task in "-l" "ping" "echo:hello"; do
+    BLDR_DAEMON=0 python - "$task" "$runs" <<'PY'
+import sys, time, subprocess
+task, runs = sys.argv[1], int(sys.argv[2])
+with open('/dev/null', 'w') as devnull:
+    start = time.time()
+    for _ in range(runs):
+        subprocess.check_call([sys.executable, 'src/taskrunner.py', task], stdout=devnull, stderr=devnull)
+print("%-12s %.3fs" % (task, (time.time() - start) / runs))
+PY
+done
@@ -1,6 +1,7 @@
 from buildercore import core
 import utils
-from decorators import requires_aws_stack, echo_output
+from decorators import requires_aws_stack
+from buildercore.decorators import echo_output
 import logging
 LOG = logging.getLogger(__name__)
 
@@ -2,12 +2,14 @@
 
 The nodes inside a stack are divided into two groups: blue and green. Actions are performed separately on the two groups while they are detached from the load balancer. Obviously, requires a load balancer.
 
+The wave variant generalises this to K groups of a fixed size, see `WaveConcurrency`.
+
 nodes_params is a data structure (dictionary) .
 TODO: make nodes_params a named tuple"""
 import logging
 from .core import boto_client, parallel_work
 from .cloudformation import read_output
-from .utils import call_while
+from .utils import call_while, ensure
 
 LOG = logging.getLogger(__name__)
 
@@ -45,13 +47,7 @@ class BlueGreenConcurrency(object):
     def divide_by_color(self, nodes_params):
         is_blue = lambda node: node % 2 == 1
         is_green = lambda node: node % 2 == 0
-
-        def subset(is_subset):
-            subset = nodes_params.copy()
-            subset['nodes'] = {id: node for (id, node) in nodes_params['nodes'].items() if is_subset(node)}
-            subset['public_ips'] = {id: ip for (id, ip) in nodes_params['public_ips'].items() if id in subset['nodes'].keys()}
-            return subset
-        return subset(is_blue), subset(is_green)
+        return self._subset(nodes_params, is_blue), self._subset(nodes_params, is_green)
 
     def wait_all_in_service(self, elb_name):
         def condition():
@@ -123,11 +119,87 @@ class BlueGreenConcurrency(object):
         )['InstanceStates']
         return {result['InstanceId']: result['State'] == 'InService' for result in health}
 
+    def _subset(self, nodes_params, is_subset):
+        "returns a copy of `nodes_params` restricted to the nodes whose number satisfies `is_subset`"
+        subset = nodes_params.copy()
+        subset['nodes'] = {id: node for (id, node) in nodes_params['nodes'].items() if is_subset(node)}
+        subset['public_ips'] = {id: ip for (id, ip) in nodes_params['public_ips'].items() if id in subset['nodes'].keys()}
+        return subset
+
     def _instances(self, nodes_params):
         return [{'InstanceId': instance_id} for instance_id in self._instance_ids(nodes_params)]
 
     def _instance_ids(self, nodes_params):
         return list(nodes_params['nodes'].keys())
 
+class WaveConcurrency(BlueGreenConcurrency):
+    """Performs actions over a load-balanced stack in consecutive waves of `wave_size` nodes.
+
+    Only one wave is detached from the load balancer at any time, except for the overlap in which
+    wave i is waiting to become healthy while wave i+1 is being drained: both conditions are polled together.
+    Waves only overlap when some other node remains in service. Waves are never larger than half the nodes,
+    so with `wave_size` of half the nodes this degenerates into a blue-green deployment.
+
+    A stack with a single node has no other node to serve traffic: like blue-green, it is out of service
+    for the whole of its wave."""
+
+    def __init__(self, region, wave_size=None):
+        super(WaveConcurrency, self).__init__(region)
+        ensure(wave_size is None or int(wave_size) > 0, "wave size must be a positive integer, not %r" % wave_size, ValueError)
+        self.wave_size = int(wave_size) if wave_size else None
+
+    def __call__(self, single_node_work, nodes_params):
+        elb_name = self.find_load_balancer(nodes_params['stackname'])
+        self.wait_all_in_service(elb_name)
+        waves = self.divide_in_waves(nodes_params)
+        if len(nodes_params['nodes']) == 1:
+            LOG.warning("%s has a single node, it will be out of service while it's being worked on", elb_name)
+
+        self.deregister(elb_name, waves[0])
+        self.wait_deregistered_all(elb_name, waves[0])
+        for i, wave in enumerate(waves):
+            LOG.info("Wave %s/%s on %s: %s", i + 1, len(waves), elb_name, self._instance_ids(wave))
+            parallel_work(single_node_work, wave)
+            self.register(elb_name, wave)
+            if i + 1 < len(waves):
+                next_wave = waves[i + 1]
+                if len(wave['nodes']) + len(next_wave['nodes']) < len(nodes_params['nodes']):
+                    # drain the next wave while the current one is becoming healthy
+                    self.deregister(elb_name, next_wave)
+                    self.wait_registered_and_deregistered_all(elb_name, wave, next_wave)
+                else:
+                    # no other node would be serving, the current wave must be healthy first
+                    self.wait_registered_all(elb_name, wave)
+                    self.deregister(elb_name, next_wave)
+                    self.wait_deregistered_all(elb_name, next_wave)
+
+        self.wait_registered_all(elb_name, nodes_params)
+
+    def divide_in_waves(self, nodes_params):
+        "returns a list of subsets of `nodes_params`, each containing at most `wave_size` nodes ordered by node number"
+        node_numbers = sorted(nodes_params['nodes'].values())
+        # default to a quarter of the nodes. as consecutive waves overlap, up to half the nodes may be out of service at once
+        wave_size = self.wave_size or max(1, len(node_numbers) // 4)
+        # a single wave of every node would take the whole stack out of service
+        max_wave_size = max(1, len(node_numbers) // 2)
+        if wave_size > max_wave_size:
+            LOG.warning("wave size %s is too large for %s nodes, using %s", wave_size, len(node_numbers), max_wave_size)
+            wave_size = max_wave_size
+        waves = [node_numbers[i:i + wave_size] for i in range(0, len(node_numbers), wave_size)]
+        return [self._subset(nodes_params, lambda node, wave=wave: node in wave) for wave in waves]
+
+    def wait_registered_and_deregistered_all(self, elb_name, registering, deregistering):
+        LOG.info("Waiting for registration of all on %s: %s and deregistration of all: %s", elb_name, self._instance_ids(registering), self._instance_ids(deregistering))
+        both = registering.copy()
+        both['nodes'] = dict(registering['nodes'], **deregistering['nodes'])
+        registering_ids = self._instance_ids(registering)
+
+        def condition():
+            registered = self._registered(elb_name, both)
+            LOG.info("InService: %s", registered)
+            return [id for (id, in_service) in registered.items() if in_service != (id in registering_ids)]
+
+        call_while(condition, interval=5, timeout=600)
+
 class SomeOutOfServiceInstances(RuntimeError):
     pass
@@ -8,7 +8,7 @@ import os, json, re
 from os.path import join
 from collections import OrderedDict
 from datetime import datetime
-from . import utils, config, bvars, core, context_handler, project, cloudformation, terraform, sns as snsmod, command
+from . import utils, config, core, context_handler, project, cloudformation, terraform, sns as snsmod, command, inventory, nodestate
 from .context_handler import only_if as updates
 from .core import stack_all_ec2_nodes, project_data_for_stackname, stack_conn
 from .utils import first, ensure, subdict, yaml_dumps, lmap
@@ -73,6 +73,7 @@ def create_stack(stackname):
     try:
         context = context_handler.load_context(stackname)
         cloudformation.bootstrap(stackname, context)
+        inventory.expire(core.find_region(stackname))
         terraform.bootstrap(stackname, context)
         # setup various resources after creation, where necessary
         setup_ec2(stackname, context)
@@ -359,19 +360,30 @@ def template_info(stackname):
 
     return subdict(data, keepers.values())
 
-def write_environment_info(stackname, overwrite=False):
+def write_environment_info(stackname, overwrite=False, info=None, node_state=None):
     """Looks for /etc/cfn-info.json and writes one if not found.
     Must be called with an active stack connection.
 
     This gives Salt the outputs available at stack creation, but that were not
     available at template compilation time.
+
+    `info` is the result of `template_info`, fetched if not given. Pass it when
+    writing to many nodes of the same stack. `node_state` is the node's
+    `nodestate.snapshot`. When given, an existing file is only overwritten if
+    its contents would change. When not given, the node is only read if
+    `overwrite` is False.
     """
-    if not remote_file_exists("/etc/cfn-info.json") or overwrite:
-        LOG.info('no cfn outputs found or overwrite=True, writing /etc/cfn-info.json ...')
-        infr_config = utils.json_dumps(template_info(stackname))
-        return fab_put_data(infr_config, "/etc/cfn-info.json", use_sudo=True)
-    LOG.debug('cfn outputs found, skipping')
-    return []
+    if not overwrite:
+        node_state = node_state or nodestate.snapshot(['cfn-info-md5'])
+        if node_state['cfn-info-md5'] is not None:
+            LOG.debug('cfn outputs found, skipping')
+            return []
+    infr_config = utils.json_dumps(info or template_info(stackname))
+    if node_state and node_state['cfn-info-md5'] == nodestate.md5(infr_config):
+        LOG.debug('cfn outputs unchanged, skipping')
+        return []
+    LOG.info('no cfn outputs found or overwrite=True, writing /etc/cfn-info.json ...')
+    return nodestate.write_files([(nodestate.CFN_INFO_PATH, infr_config)], backup=False)
 
 #
 #
@@ -483,24 +495,39 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
     fkeys = ['formula-repo', 'formula-dependencies', 'private-repo', 'configuration-repo']
     fdata = subdict(context['project'], fkeys)
 
-    def _update_ec2_node():
-        # write out environment config (/etc/cfn-info.json) so Salt can read CFN outputs
-        write_environment_info(stackname, overwrite=True)
+    # facts shared by every node are looked up once, before connecting to the nodes.
+    # nodes may be updated concurrently in child processes that wouldn't share cached results
+    info = template_info(stackname)
+    default_master_ip = master(region, 'PrivateIpAddress')
+
+    # bit of a hack, but project config merging doesn't apply to top-level values
+    # in this case we look for an alternate salt version under a project's 'ec2' section
+    salt_version = context['project']['salt']
+    alt_salt_version = context['ec2'].get('salt')
 
-        # bit of a hack, but project config merging doesn't apply to top-level values
-        # in this case we look for an alternate salt version under a project's 'ec2' section
-        salt_version = context['project']['salt']
-        alt_salt_version = context['ec2'].get('salt')
+    # and we only use it if we're going masterless
+    if alt_salt_version and is_masterless:
+        salt_version = alt_salt_version
 
-        # and we only use it if we're going masterless
-        if alt_salt_version and is_masterless:
-            salt_version = alt_salt_version
+    install_master_flag = str(is_master or is_masterless).lower() # ll: 'true'
 
-        install_master_flag = str(is_master or is_masterless).lower() # ll: 'true'
+    # order is important.
+    formula_list = ' '.join(fdata.get('formula-dependencies', []) + [fdata['formula-repo']]) if is_masterless else None
+    all_formulas = project.known_formulas() if is_master else None
+
+    def _update_ec2_node():
+        # a single remote command reads the build vars and the checksum of /etc/cfn-info.json
+        node_state = nodestate.snapshot(['build-vars', 'cfn-info-md5'])
+
+        # write out environment config (/etc/cfn-info.json) so Salt can read CFN outputs
+        write_environment_info(stackname, overwrite=True, info=info, node_state=node_state)
 
-        build_vars = bvars.read_from_current_host()
+        # missing or unreadable build vars have always stopped the update, `bvars.read_from_current_host` raised.
+        # `buildvars.fix` replaces them
+        build_vars = node_state['build-vars']
+        ensure(build_vars is not None, "build vars not found on a node of %s. use `./bldr buildvars.fix` to attempt to fix this." % stackname)
         minion_id = build_vars.get('nodename', stackname)
-        master_ip = build_vars.get('ec2', {}).get('master_ip', master(region, 'PrivateIpAddress'))
+        master_ip = build_vars.get('ec2', {}).get('master_ip', default_master_ip)
         grains = {
             'project': context['project_name'],
         }
@@ -508,8 +535,6 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
         run_script('bootstrap.sh', salt_version, minion_id, install_master_flag, master_ip, **environment_vars)
 
         if is_masterless:
-            # order is important.
-            formula_list = ' '.join(fdata.get('formula-dependencies', []) + [fdata['formula-repo']])
             # to init the builder-private formula, the masterless instance needs
             # the master-builder key
             upload_master_builder_key(master_builder_key)
@@ -534,7 +559,6 @@ def update_ec2_stack(stackname, context, concurrency=None, formula_revisions=Non
             # it is possible to be a masterless master server
             builder_private_repo = fdata['private-repo']
             builder_configuration_repo = fdata['configuration-repo']
-            all_formulas = project.known_formulas()
             run_script('init-master.sh', stackname, builder_private_repo, builder_configuration_repo, ' '.join(all_formulas))
             master_configuration_template = download_master_configuration(stackname)
             master_configuration = expand_master_configuration(master_configuration_template, all_formulas)
@@ -594,6 +618,8 @@ def destroy(stackname):
     context = context_handler.load_context(stackname)
     terraform.destroy(stackname, context)
     cloudformation.destroy(stackname, context)
+    inventory.expire(core.find_region(stackname))
+    core.forget_stack_region(stackname)
 
     # don't do this. requires master server access and would prevent regular users deleting stacks
     # remove_minion_key(stackname)
@@ -19,11 +19,11 @@ We want to add an external volume to an EC2 instance to increase available space
 import logging
 import os, json
 import re
+import inspect, hashlib, sys
 from collections import OrderedDict, namedtuple
 from functools import partial
-import botocore
 import netaddr
-from . import utils, cloudformation, terraform, core, project, context_handler
+from . import utils, config, cloudformation, terraform, core, project, context_handler, threadbare
 from .utils import ensure, lmap, deepcopy, subdict
 
 LOG = logging.getLogger(__name__)
@@ -49,6 +49,87 @@ FASTLY_AWS_REGION_SHIELDS = {
     'sa-east-1': 'gru-br-sa', # São Paulo: São Paulo
 }
 
+# the project data read by each context wrangler and the context keys it writes.
+# when regenerating a context incrementally, wranglers whose project data hasn't changed aren't run again and their
+# results are copied from the existing context. wranglers not listed here are always run. see `_regenerate_context`.
+WRANGLER_DEPENDENCIES = {
+    'build_context_rds': (['aws.rds', 'aws.subnet-cidr'],
+                          ['netmask', 'rds_username', 'rds_password', 'rds_dbname', 'rds_instance_id', 'rds_params', 'rds']),
+    'build_context_aws': (['aws.region', 'aws.account-id', 'aws.vpc-id', 'aws.subnet-id', 'aws.subnet-cidr',
+                           'aws.availability-zone', 'aws.redundant-subnet-id', 'aws.redundant-subnet-cidr',
+                           'aws.redundant-availability-zone'],
+                          ['aws']),
+    'build_context_ec2': (['aws.ec2', 'aws.type', 'aws.ports', 'aws.ext'], ['ec2', 'ext']),
+    'build_context_elb': (['aws.elb', 'aws.subnet-id', 'aws.redundant-subnet-id'], ['elb']),
+    'build_context_cloudfront': (['aws.cloudfront'], ['cloudfront']),
+    'build_context_sns_sqs': (['aws.sns', 'aws.sqs'], ['sns', 'sqs']),
+    'build_context_s3': (['aws.s3'], ['s3']),
+    'build_context_fastly': (['domain', 'aws.region', 'aws.fastly'], ['fastly']),
+    'build_context_gcs': (['aws.gcs'], ['gcs']),
+    'build_context_bigquery': (['gcp.bigquery'], ['bigquery']),
+    'build_context_eks': (['aws.eks'], ['eks']),
+    'build_context_subdomains': (['domain', 'aws.subdomains'], ['subdomains']),
+    'build_context_elasticache': (['aws.elasticache'], ['elasticache']),
+    'build_context_vault': (['aws.vault'], ['vault']),
+}
+
+# context keys that change with every build and are not inputs to any wrangler
+_VOLATILE_CONTEXT_KEYS = ['author', 'date_rendered']
+
+_CODE_DIGEST = []
+
+def _digest(string):
+    return hashlib.md5(string.encode('utf-8')).hexdigest()
+
+def _code_digest():
+    """a change to the code of the wranglers or of anything they call, like `set_master_address` or
+    `core.rds_dbname`, invalidates all of their previous results"""
+    if not _CODE_DIGEST:
+        _CODE_DIGEST.append(_digest("".join(inspect.getsource(module) for module in [sys.modules[__name__], core, utils])))
+    return _CODE_DIGEST[0]
+
+def _wrangler_name(wrangler):
+    return getattr(wrangler, 'func', wrangler).__name__
+
+def _wrangler_inputs(wrangler, project_data, base_context):
+    """returns a fingerprint of everything the given wrangler depends on: the code, the project data it reads and the
+    context it's given before any other wrangler has run, or None if its dependencies aren't known"""
+    name = _wrangler_name(wrangler)
+    if name not in WRANGLER_DEPENDENCIES:
+        return None
+    paths, _ = WRANGLER_DEPENDENCIES[name]
+    inputs = {
+        'code': _code_digest(),
+        'project': {path: utils.lookup(project_data, path, None) for path in paths},
+        'context': {key: val for key, val in base_context.items() if key not in _VOLATILE_CONTEXT_KEYS},
+    }
+    return _digest(utils.json_dumps(inputs, dangerous=True, sort_keys=True))
+
+def _context_digest(context):
+    return _digest(utils.json_dumps(utils.exsubdict(context, _VOLATILE_CONTEXT_KEYS), dangerous=True, sort_keys=True))
+
+def wrangler_inputs_file(stackname):
+    "path to the file recording the inputs of each wrangler the last time the stack's context was regenerated"
+    return os.path.join(config.CONTEXT_DIR, stackname + ".json.wrangler-inputs")
+
+def read_wrangler_inputs(stackname, context):
+    """returns the inputs recorded when `context` was regenerated, see `write_wrangler_inputs`.
+    nothing is returned when the context has changed since, for example by `master.remaster` or on another machine."""
+    path = wrangler_inputs_file(stackname)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fh:
+        record = json.load(fh)
+    if record.get('context') != _context_digest(context):
+        return {}
+    return record.get('inputs', {})
+
+def write_wrangler_inputs(stackname, context, inputs):
+    "records the inputs of each wrangler that built `context`. they are only kept locally, never in the context itself"
+    utils.mkdir_p(config.CONTEXT_DIR)
+    with open(wrangler_inputs_file(stackname), 'w') as fh:
+        json.dump({'context': _context_digest(context), 'inputs': inputs}, fh)
+
 def parameterize(context):
     def wrapper(string):
         return string.format(**{'instance': context['instance_id']})
@@ -63,6 +144,12 @@ def shuffle(lst):
 def build_context(pname, **more_context):
     """wrangles parameters into a dictionary (context) that can be given to
     whatever renders the final template"""
+    return _build_context(pname, **more_context)[0]
+
+def _build_context(pname, previous_inputs=None, **more_context):
+    """like `build_context` but also returns the inputs of each wrangler, see `_wrangler_inputs`.
+    wranglers whose inputs are the same as in `previous_inputs` aren't run again, their results are copied
+    from the existing context."""
 
     supported_projects = project.project_list()
     ensure(pname in supported_projects, "Unknown project %r. Known projects: %s" % (pname, supported_projects))
@@ -154,14 +241,26 @@ def build_context(pname, **more_context):
     ]
 
     # exceptions to the rule ...
-    wrangler_list = [project_wrangler] + wrangler_list
+    # `project_wrangler` is always run and everything else depends on it
+    context = project_wrangler(deepcopy(project_data), deepcopy(context))
+    base_context = deepcopy(context)
 
+    previous_inputs = previous_inputs or {}
+    wrangler_inputs = {}
     for wrangler in wrangler_list:
+        name = _wrangler_name(wrangler)
+        inputs = _wrangler_inputs(wrangler, project_data, base_context)
+        if inputs:
+            wrangler_inputs[name] = inputs
+        if inputs and previous_inputs.get(name) == inputs:
+            _, keys = WRANGLER_DEPENDENCIES[name]
+            context.update({key: deepcopy(existing_context[key]) for key in keys if key in existing_context})
+            continue
         # using `deepcopy` so functions can't modify the context in-place or
         # reference a bit of project_data and then change it
         context = wrangler(deepcopy(project_data), deepcopy(context))
 
-    return context
+    return context, wrangler_inputs
 
 def build_context_aws(pdata, context):
     if 'aws' not in pdata:
@@ -558,6 +657,28 @@ UPDATABLE_TITLE_PATTERNS = ['^CloudFront.*', '^ElasticLoadBalancer.*', '^EC2Inst
 REMOVABLE_TITLE_PATTERNS = ['^CloudFront.*', '^CnameDNS\\d+$', 'FastlyDNS\\d+$', '^ExtDNS$', '^ExtDNS1$', '^ExtraStorage.+$', '^MountPoint.+$', '^.+Queue$', '^EC2Instance.+$', '^IntDNS.*$', '^ElastiCache.*$', '^.+Topic$', '^AttachedDB$', '^AttachedDBSubnet$', '^VPCSecurityGroup$', '^KeyName$']
 EC2_NOT_UPDATABLE_PROPERTIES = ['ImageId', 'Tags', 'UserData']
 
+# a title matches a list of patterns if it matches any of them. `re.match` only matches at the start of the title
+_UPDATABLE_TITLE_REGEX = re.compile("|".join("(?:%s)" % pattern for pattern in UPDATABLE_TITLE_PATTERNS))
+_REMOVABLE_TITLE_REGEX = re.compile("|".join("(?:%s)" % pattern for pattern in REMOVABLE_TITLE_PATTERNS))
+
+# {title: (updatable?, removable?), ...}
+_TITLE_CLASSES = {}
+
+def _classify_title(title):
+    "returns a pair of (updatable?, removable?) for the given resource or output title"
+    try:
+        return _TITLE_CLASSES[title]
+    except KeyError:
+        classes = (_UPDATABLE_TITLE_REGEX.match(title) is not None, _REMOVABLE_TITLE_REGEX.match(title) is not None)
+        _TITLE_CLASSES[title] = classes
+        return classes
+
+def _title_is_updatable(title):
+    return _classify_title(title)[0]
+
+def _title_is_removable(title):
+    return _classify_title(title)[1]
+
 # CloudFormation is nicely chopped up into:
 # * what to add
 # * what to modify
@@ -592,7 +713,14 @@ def template_delta(context):
 
     Some the existing resources are treated as immutable and not put in the delta. Most that support non-destructive updates like CloudFront are instead included"""
     old_template = cloudformation.read_template(context['stackname'])
-    template = json.loads(cloudformation.render_template(context))
+    return Delta.from_cloudformation_and_terraform(
+        cloudformation_delta(context, old_template),
+        terraform.generate_delta(context)
+    )
+
+def cloudformation_delta(context, old_template):
+    "renders the CloudFormation template of the given context and returns a `CloudFormationDelta` against `old_template`"
+    template = cloudformation.render_template_data(context)
 
     def _related_to_ec2(output):
         if 'Value' in output:
@@ -602,12 +730,6 @@ def template_delta(context):
                 return 'EC2Instance' in output['Value']['Fn::GetAtt'][0]
         return False
 
-    def _title_is_updatable(title):
-        return len([p for p in UPDATABLE_TITLE_PATTERNS if re.match(p, title)]) > 0
-
-    def _title_is_removable(title):
-        return len([p for p in REMOVABLE_TITLE_PATTERNS if re.match(p, title)]) > 0
-
     # TODO: investigate if this is still necessary
     # start backward compatibility code
     # back for when EC2Instance was the title rather than EC2Instance1
@@ -632,14 +754,14 @@ def template_delta(context):
             LOG.warn("section %r not present in old template but is present in new: %s" % (section, title))
             return False # can we handle this better?
 
-        title_in_old = dict(old_template[section][title])
-        title_in_new = dict(template[section][title])
+        title_in_old = old_template[section][title]
+        title_in_new = template[section][title]
         # ignore UserData changes, it's not useful to update them and cause
         # a needless reboot
-        if 'Type' in title_in_old:
-            if title_in_old['Type'] == 'AWS::EC2::Instance':
-                for property_name in EC2_NOT_UPDATABLE_PROPERTIES:
-                    title_in_new['Properties'][property_name] = title_in_old['Properties'][property_name]
+        if title_in_old.get('Type') == 'AWS::EC2::Instance':
+            for property_name in EC2_NOT_UPDATABLE_PROPERTIES:
+                title_in_new['Properties'][property_name] = title_in_old['Properties'][property_name]
+        # dict comparison is native and stops at the first difference
         return title_in_old != title_in_new
 
     def legacy_title(title):
@@ -676,43 +798,35 @@ def template_delta(context):
     delta_minus_outputs = {o: v for o, v in old_template.get('Outputs', {}).items() if o not in template.get('Outputs', {})}
     delta_minus_parameters = {p: v for p, v in old_template.get('Parameters', {}).items() if p not in template.get('Parameters', {})}
 
-    return Delta.from_cloudformation_and_terraform(
-        cloudformation.CloudFormationDelta(
-            {
-                'Resources': delta_plus_resources,
-                'Outputs': delta_plus_outputs,
-                'Parameters': delta_plus_parameters,
-            },
-            {
-                'Resources': delta_edit_resources,
-                'Outputs': delta_edit_outputs,
-            },
-            {
-                'Resources': delta_minus_resources,
-                'Outputs': delta_minus_outputs,
-                'Parameters': delta_minus_parameters,
-            }
-        ),
-        terraform.generate_delta(context)
+    return cloudformation.CloudFormationDelta(
+        {
+            'Resources': delta_plus_resources,
+            'Outputs': delta_plus_outputs,
+            'Parameters': delta_plus_parameters,
+        },
+        {
+            'Resources': delta_edit_resources,
+            'Outputs': delta_edit_outputs,
+        },
+        {
+            'Resources': delta_minus_resources,
+            'Outputs': delta_minus_outputs,
+            'Parameters': delta_minus_parameters,
+        }
     )
 
 def _current_cloudformation_template(stackname):
     "retrieves a template from the CloudFormation API, using it as the source of truth"
-    cfn = core.boto_conn(stackname, 'cloudformation', client=True)
-    try:
-        return cfn.get_template(StackName=stackname)['TemplateBody']
-    except botocore.exceptions.ClientError as e:
-        if e.response.get('Error', {}).get('Code') == 'ValidationError':
-            # CloudFormation template is not used for this stackname
-            return cloudformation.EMPTY_TEMPLATE
-        raise
+    return cloudformation.current_template(stackname)
 
 def download_cloudformation_template(stackname):
-    cloudformation.write_template(stackname, json.dumps(_current_cloudformation_template(stackname)))
+    "downloads the current template of the stack unless the local copy is already up to date"
+    cloudformation.download_template(stackname)
 
-def regenerate_stack(stackname, **more_context):
-    current_context = context_handler.load_context(stackname)
-    download_cloudformation_template(stackname)
+def _regenerate_context(stackname, current_context, incremental=False, **more_context):
+    """rebuilds the context of an existing stack. when `incremental` is True only the parts of the context whose
+    project data has changed since it was last regenerated incrementally on this machine are rebuilt,
+    see `WRANGLER_DEPENDENCIES`"""
     (pname, instance_id) = core.parse_stackname(stackname)
     more_context['stackname'] = stackname # TODO: purge this crap
     # lsh@2019-09-27: usage of `instance_id` here is wrong. `instance_id` looks like "foobar" in "journal--foobar"
@@ -723,6 +837,91 @@ def regenerate_stack(stackname, **more_context):
     #more_context['alt-config'] = instance_id
     #more_context['alt-config'] = current_context.get('alt-config', instance_id)
     more_context['alt-config'] = current_context['alt-config']
-    context = build_context(pname, existing_context=current_context, **more_context)
+    if not incremental:
+        return build_context(pname, existing_context=current_context, **more_context)
+    previous_inputs = read_wrangler_inputs(stackname, current_context)
+    context, inputs = _build_context(pname, previous_inputs, existing_context=current_context, **more_context)
+    write_wrangler_inputs(stackname, context, inputs)
+    return context
+
+def regenerate_stack(stackname, **more_context):
+    current_context = context_handler.load_context(stackname)
+    download_cloudformation_template(stackname)
+    context = _regenerate_context(stackname, current_context, **more_context)
     delta = template_delta(context)
     return context, delta, current_context
+
+def _delta_summary(delta):
+    "returns the titles added, edited and removed by a `CloudFormationDelta`, grouped by section"
+    return {
+        change: {section: sorted(titles) for section, titles in getattr(delta, change).items()}
+        for change in ['plus', 'edit', 'minus']
+    }
+
+def stack_delta_summary(stackname, incremental=False):
+    """regenerates the stack's CloudFormation template like `regenerate_stack` and returns a summary of the delta.
+    the current template is read from CloudFormation directly rather than downloaded to `.cfn/`.
+    the stack's context may still be downloaded to `.cfn/` by `context_handler.load_context` and, when `incremental`,
+    the inputs of its wranglers are recorded there, see `write_wrangler_inputs`."""
+    try:
+        current_context = context_handler.load_context(stackname)
+        context = _regenerate_context(stackname, current_context, incremental=incremental)
+        delta = cloudformation_delta(context, _current_cloudformation_template(stackname))
+        return dict(_delta_summary(delta), stackname=stackname, changed=delta.non_empty, error=None)
+    except Exception as err:
+        LOG.exception("failed to generate the delta of %r", stackname)
+        return {'stackname': stackname, 'changed': None, 'error': str(err)}
+
+def _summarise_stacks(summary_fn, stackname_list, concurrency):
+    """calls `summary_fn` with each of the given stacks, up to `concurrency` stacks at once in child processes.
+    `summary_fn` must return a dict with a 'stackname' key and handle its own errors."""
+    ensure(concurrency > 0, "concurrency must be a positive integer, not %r" % concurrency)
+    if concurrency == 1:
+        return lmap(summary_fn, stackname_list)
+
+    def worker():
+        return summary_fn(threadbare.state.ENV['stackname'])
+
+    summaries = {}
+    for i in range(0, len(stackname_list), concurrency):
+        batch = stackname_list[i:i + concurrency]
+        for summary in threadbare.execute.execute(threadbare.execute.parallel(worker), param_key='stackname', param_values=batch):
+            if isinstance(summary, dict):
+                summaries[summary['stackname']] = summary
+
+    def summary(stackname):
+        # the child process was interrupted by something `summary_fn` doesn't handle, like a KeyboardInterrupt
+        return summaries.get(stackname) or {'stackname': stackname, 'changed': None, 'error': "no result"}
+    return lmap(summary, stackname_list)
+
+def stacks_delta_summary(stackname_list, concurrency=4, incremental=False):
+    """returns a summary of the delta of each of the given stacks, see `stack_delta_summary`.
+    up to `concurrency` stacks are processed at once in child processes as template generation is CPU bound."""
+    return _summarise_stacks(partial(stack_delta_summary, incremental=incremental), stackname_list, concurrency)
+
+def stack_terraform_plan(stackname):
+    """regenerates the stack's Terraform template like `regenerate_stack` and returns the changes Terraform plans to make.
+    the template and plan are written to the stack's own directory under `.cfn/terraform/`, nothing is applied."""
+    try:
+        current_context = context_handler.load_context(stackname)
+        context = _regenerate_context(stackname, current_context)
+        delta = terraform.generate_delta(context)
+        if delta is None:
+            # no Terraform managed services
+            return {'stackname': stackname, 'changed': False, 'plus': {}, 'edit': {}, 'minus': {}, 'error': None}
+        return {
+            'stackname': stackname,
+            'changed': delta.non_empty if delta.plus is not None else None,
+            'plus': delta.plus,
+            'edit': delta.edit,
+            'minus': delta.minus,
+            'error': None,
+        }
+    except Exception as err:
+        LOG.exception("failed to plan the Terraform changes of %r", stackname)
+        return {'stackname': stackname, 'changed': None, 'error': str(err)}
+
+def stacks_terraform_plan(stackname_list, concurrency=4):
+    """returns the changes Terraform plans to make to each of the given stacks, see `stack_terraform_plan`.
+    up to `concurrency` stacks are planned at once in child processes, each in its own working directory."""
+    return _summarise_stacks(stack_terraform_plan, stackname_list, concurrency)
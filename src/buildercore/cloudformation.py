@@ -3,11 +3,12 @@ from contextlib import contextmanager
 import logging
 import json
 import os
+import uuid
 from pprint import pformat
 from functools import partial
 import backoff
 import botocore
-from . import config, core, keypair, trop
+from . import config, core, keypair, trop, s3
 from .utils import call_while, ensure
 
 LOG = logging.getLogger(__name__)
@@ -18,12 +19,54 @@ def render_template(context):
     ensure('aws' in context, msg, ValueError)
     return trop.render(context)
 
+def render_template_data(context):
+    "like `render_template` but returns the template as a python data structure"
+    pname = context['project_name']
+    msg = 'could not render a CloudFormation template for %r' % pname
+    ensure('aws' in context, msg, ValueError)
+    return trop.render_data(context)
+
 def _give_up_backoff(e):
     return e.response['Error']['Code'] != 'Throttling'
 
 def _log_backoff(event):
     LOG.warn("Backing off in validating project %s", event['args'][0])
 
+def minify(template):
+    "returns the given template (a JSON string or python data structure) as JSON without any whitespace"
+    if not isinstance(template, dict):
+        template = json.loads(template)
+    return json.dumps(template, separators=(',', ':'))
+
+def s3_template_key(name):
+    return config.TEMPLATE_PREFIX + name + ".json"
+
+def template_argument(name, template):
+    """returns the keyword argument to pass the given template to CloudFormation with.
+    the template is minified and sent inline as the `TemplateBody` unless it is still too large, in which case it's
+    uploaded to the builder bucket and passed as a `TemplateURL`"""
+    body = minify(template)
+    if len(body.encode('utf-8')) <= config.TEMPLATE_BODY_MAX_SIZE:
+        return {'TemplateBody': body}
+    key = s3_template_key(name)
+    LOG.info("template of %s is too large to be sent inline (%s bytes), uploading it", name, len(body.encode('utf-8')))
+    s3.write(key, body, overwrite=True)
+    return {'TemplateURL': s3.url(key)}
+
+def template_size(stackname):
+    "returns a report on the size of the local copy of the stack's template"
+    template = read_template(stackname)
+    pretty = json.dumps(template, indent=4, sort_keys=True) # as rendered by `trop.render`
+    minified = minify(template)
+    return {
+        'stackname': stackname,
+        'resources': len(template.get('Resources', {})),
+        'size': len(pretty.encode('utf-8')),
+        'minified-size': len(minified.encode('utf-8')),
+        'max-inline-size': config.TEMPLATE_BODY_MAX_SIZE,
+        'inline': len(minified.encode('utf-8')) <= config.TEMPLATE_BODY_MAX_SIZE,
+    }
+
 @backoff.on_exception(backoff.expo, botocore.exceptions.ClientError, on_backoff=_log_backoff, giveup=_give_up_backoff, max_time=30)
 def validate_template(pname, rendered_template):
     "remote cloudformation template checks."
@@ -32,7 +75,14 @@ def validate_template(pname, rendered_template):
         return
 
     conn = core.boto_conn(pname, 'cloudformation', client=True)
-    return conn.validate_template(TemplateBody=rendered_template)
+    # templates of the same project may be validated concurrently, a large one is uploaded under a key of its own
+    name = "%s--validation--%s" % (pname, uuid.uuid4().hex)
+    argument = template_argument(name, rendered_template)
+    try:
+        return conn.validate_template(**argument)
+    finally:
+        if 'TemplateURL' in argument:
+            s3.delete(s3_template_key(name))
 
 class CloudFormationDelta(namedtuple('Delta', ['plus', 'edit', 'minus'])):
     """represents a delta between and old and new CloudFormation generated template, showing which resources are being added, updated, or removed
@@ -104,7 +154,7 @@ def bootstrap(stackname, context):
     with stack_creation(stackname, on_start=on_start, on_error=on_error):
         conn = core.boto_conn(stackname, 'cloudformation')
         # http://boto3.readthedocs.io/en/latest/reference/services/cloudformation.html#CloudFormation.ServiceResource.create_stack
-        conn.create_stack(StackName=stackname, TemplateBody=stack_body, Parameters=parameters)
+        conn.create_stack(StackName=stackname, Parameters=parameters, **template_argument(stackname, stack_body))
         _wait_until_in_progress(stackname)
 
 class StackTakingALongTimeToComplete(RuntimeError):
@@ -128,13 +178,61 @@ def _wait_until_in_progress(stackname):
     ensure(final_stack.stack_status in core.ACTIVE_CFN_STATUS,
            "Failed to create stack: %s.\nEvents: %s" % (final_stack.stack_status, pformat(events)))
 
+def _template_path(stackname):
+    return os.path.join(config.STACK_DIR, stackname + ".json")
+
+def _version_path(stackname):
+    "file recording the version of the stack the local copy of its template was downloaded from"
+    return os.path.join(config.STACK_DIR, stackname + ".last-updated")
+
+def stack_version(data):
+    "returns the time the stack was last updated (or created) from its `DescribeStacks` data. changes whenever the template does"
+    return str(data.get('LastUpdatedTime') or data['CreationTime'])
+
+def downloaded_version(stackname):
+    "returns the version of the stack the local copy of its template was downloaded from, or None if it wasn't downloaded"
+    path = _version_path(stackname)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fh:
+        return fh.read().strip() or None
+
+def current_template(stackname):
+    "retrieves a template from the CloudFormation API, using it as the source of truth"
+    cfn = core.boto_conn(stackname, 'cloudformation', client=True)
+    try:
+        return cfn.get_template(StackName=stackname)['TemplateBody']
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'ValidationError':
+            # CloudFormation template is not used for this stackname
+            return EMPTY_TEMPLATE
+        raise
+
+def download_template(stackname):
+    """writes the current template of the stack to the stacks directory and returns its path.
+    the template is only fetched when the stack has been updated since the local copy was downloaded."""
+    stack = core.describe_stack(stackname, allow_missing=True)
+    version = stack_version(stack.meta.data) if stack else None
+    output_fname = _template_path(stackname)
+    if version and version == downloaded_version(stackname) and os.path.exists(output_fname):
+        LOG.info("template of %s unchanged since %s, not downloading it", stackname, version)
+        return output_fname
+    write_template(stackname, json.dumps(current_template(stackname)))
+    if version:
+        with open(_version_path(stackname), 'w') as fh:
+            fh.write(version)
+    return output_fname
+
 def read_template(stackname):
-    "returns the contents of a cloudformation template as a python data structure"
-    output_fname = os.path.join(config.STACK_DIR, stackname + ".json")
-    # TODO: use a context manager to close the file afterwards
-    return json.load(open(output_fname, 'r'))
+    "returns the contents of a cloudformation template as a python data structure, downloading it if there is no local copy"
+    output_fname = _template_path(stackname)
+    if not os.path.exists(output_fname):
+        download_template(stackname)
+    with open(output_fname, 'r') as fh:
+        return json.load(fh)
 
 def read_output(stackname, key):
+    "returns the value of an output of the stack. outputs come with the `DescribeStacks` data used to version templates"
     data = core.describe_stack(stackname).meta.data # boto3
     ensure('Outputs' in data, "Outputs missing: %s" % data)
     selected_outputs = [o for o in data['Outputs'] if o['OutputKey'] == key]
@@ -168,10 +266,13 @@ def _merge_delta(stackname, delta):
     return template
 
 def write_template(stackname, contents):
-    "writes a json version of the python cloudformation template to the stacks directory"
-    output_fname = os.path.join(config.STACK_DIR, stackname + ".json")
-    # TODO: use a context manager to close the file afterwards
-    open(output_fname, 'w').write(contents)
+    """writes a json version of the python cloudformation template to the stacks directory.
+    the local copy no longer matches a version of the stack and will be downloaded again by `download_template`"""
+    output_fname = _template_path(stackname)
+    with open(output_fname, 'w') as fh:
+        fh.write(contents)
+    if os.path.exists(_version_path(stackname)):
+        os.unlink(_version_path(stackname))
     return output_fname
 
 def update_template(stackname, delta):
@@ -190,7 +291,7 @@ def _update_template(stackname, template):
     try:
         conn = core.describe_stack(stackname)
         print(json.dumps(template, indent=4))
-        conn.update(TemplateBody=json.dumps(template), Parameters=parameters)
+        conn.update(Parameters=parameters, **template_argument(stackname, template))
     except botocore.exceptions.ClientError as ex:
         # ex.response ll: {'ResponseMetadata': {'RetryAttempts': 0, 'HTTPStatusCode': 400, 'RequestId': 'dc28fd8f-4456-11e8-8851-d9346a742012', 'HTTPHeaders': {'x-amzn-requestid': 'dc28fd8f-4456-11e8-8851-d9346a742012', 'date': 'Fri, 20 Apr 2018 04:54:08 GMT', 'content-length': '288', 'content-type': 'text/xml', 'connection': 'close'}}, 'Error': {'Message': 'No updates are to be performed.', 'Code': 'ValidationError', 'Type': 'Sender'}}
         if ex.response['Error']['Message'] == 'No updates are to be performed.':
@@ -218,6 +319,8 @@ def destroy(stackname, context):
                 raise # not sure what happened, but we're not handling it here. die.
         call_while(partial(is_deleting, stackname), timeout=3600, update_msg='Waiting for CloudFormation to finish deleting stack ...')
         _delete_stack_file(stackname)
+        # deleting a template that was never uploaded is not an error
+        s3.delete(s3_template_key(stackname))
         keypair.delete_keypair(stackname) # deletes the keypair wherever it can find it (locally, remotely)
 
     except botocore.exceptions.ClientError as ex:
@@ -241,6 +344,6 @@ def destroy(stackname, context):
 
 
 def _delete_stack_file(stackname):
-    path = os.path.join(config.STACK_DIR, stackname + ".json")
-    if os.path.exists(path):
-        os.unlink(path)
+    for path in [_template_path(stackname), _version_path(stackname)]:
+        if os.path.exists(path):
+            os.unlink(path)
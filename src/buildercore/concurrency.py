@@ -1,4 +1,5 @@
 from . import bluegreen, context_handler
+from .utils import ensure, isint
 
 # TODO: move as buildercore.concurrency.concurrency_for
 def concurrency_for(stackname, concurrency_name):
@@ -7,13 +8,19 @@ def concurrency_for(stackname, concurrency_name):
     Concurrency can be:
     - serial: one at a time
     - parallel: all together
-    - blue-green: 50% at a time"""
+    - blue-green: 50% at a time
+    - wave: 25% at a time, or N at a time with 'wave-N' (at most 50%)"""
 
-    concurrency_names = ['serial', 'parallel', 'blue-green']
+    concurrency_names = ['serial', 'parallel', 'blue-green', 'wave', 'wave-N']
 
     if concurrency_name == 'blue-green':
         context = context_handler.load_context(stackname)
         return bluegreen.BlueGreenConcurrency(context['aws']['region'])
+    if concurrency_name == 'wave' or (concurrency_name or '').startswith('wave-'):
+        wave_size = concurrency_name[len('wave-'):] or None
+        ensure(wave_size is None or isint(wave_size), "Concurrency %s has an invalid wave size. Use e.g. 'wave-2'" % concurrency_name, ValueError)
+        context = context_handler.load_context(stackname)
+        return bluegreen.WaveConcurrency(context['aws']['region'], wave_size=wave_size)
     if concurrency_name == 'serial' or concurrency_name == 'parallel':
         # maybe return a fabric object in the future
         return concurrency_name
@@ -40,11 +40,16 @@ KEYPAIR_DIR = join(CFN, "keypairs") # ll: ./.cfn/keypairs
 # the .cfn dir was for cloudformation stuff, but we keep keypairs in there too, so this can't hurt
 # perhaps a namechange from .cfn to .state or something later
 TERRAFORM_DIR = join(CFN, "terraform")
+INVENTORY_FILE = join(CFN, "inventory.sqlite3")
 
 STACK_PATH = join(PROJECT_PATH, STACK_DIR) # "/.../.cfn/stacks/"
 CONTEXT_PATH = join(PROJECT_PATH, CONTEXT_DIR) # "/.../.cfn/contexts/"
 KEYPAIR_PATH = join(PROJECT_PATH, KEYPAIR_DIR) # "/.../.cfn/keypairs/"
 SCRIPTS_PATH = join(PROJECT_PATH, SCRIPTS_DIR) # "/.../scripts/"
+INVENTORY_PATH = join(PROJECT_PATH, INVENTORY_FILE) # "/.../.cfn/inventory.sqlite3"
+
+# the local inventory of stacks and instances is refreshed when it is older than this many seconds
+INVENTORY_MAX_AGE = int(os.environ.get('BLDR_INVENTORY_MAX_AGE', 300))
 
 # create all necessary paths and ensure they are writable
 lmap(utils.mkdir_p, [TEMP_PATH, STACK_PATH, CONTEXT_PATH, SCRIPTS_PATH, KEYPAIR_PATH])
@@ -103,6 +108,12 @@ else:
     BUILDER_TIMEOUT = 600
 KEYPAIR_PREFIX = 'keypairs/'
 CONTEXT_PREFIX = 'contexts/'
+TEMPLATE_PREFIX = 'templates/'
+
+# CloudFormation templates larger than this (in bytes) can't be sent inline with a request and are uploaded to the
+# builder bucket first
+# https://docs.aws.amazon.com/AWSCloudFormation/latest/UserGuide/cloudformation-limits.html
+TEMPLATE_BODY_MAX_SIZE = 51200
 
 PACKER_BOX_PREFIX = "elifesciences" # the 'elifesciences' in 'elifesciences/basebox'
 PACKER_BOX_BUCKET = "builder-boxes"
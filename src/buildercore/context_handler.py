@@ -12,7 +12,7 @@
 
 import os, json
 from os.path import join
-from . import config, s3
+from . import config, s3, utils
 
 import logging
 LOG = logging.getLogger(__name__)
@@ -23,13 +23,36 @@ def s3_context_key(stackname):
 def local_context_file(stackname):
     return join(config.CONTEXT_DIR, stackname + ".json")
 
+def local_etag_file(stackname):
+    "path to the file storing the S3 ETag of the local copy of the context"
+    return local_context_file(stackname) + ".etag"
+
+# stackname => parsed context. populated at most once per process per stack.
+_CONTEXT_CACHE = {}
+# stacknames whose local copy is known to match S3, see `sync_all`
+_SYNCED = set()
+
+def clear_context_cache(stackname=None):
+    "forget the memoized context for `stackname` or for all stacks, forcing it to be revalidated against S3"
+    if stackname:
+        _CONTEXT_CACHE.pop(stackname, None)
+        _SYNCED.discard(stackname)
+    else:
+        _CONTEXT_CACHE.clear()
+        _SYNCED.clear()
+
 def load_context(stackname):
     """Returns the store context data structure for 'stackname'.
-    Downloads from S3 if missing on the local builder instance"""
-    path = local_context_file(stackname)
-    if not download_from_s3(stackname, refresh=True):
-        raise MissingContextFile("We are missing the context file for %s, even on S3. Does the stack exist?" % stackname)
-    contents = json.load(open(path, 'r'))
+    Downloads from S3 if missing or stale on the local builder instance.
+
+    S3 is checked at most once per process, subsequent calls return a copy of the memoized context."""
+    if stackname not in _CONTEXT_CACHE:
+        path = local_context_file(stackname)
+        if not download_from_s3(stackname, refresh=stackname not in _SYNCED):
+            raise MissingContextFile("We are missing the context file for %s, even on S3. Does the stack exist?" % stackname)
+        with open(path, 'r') as fh:
+            _CONTEXT_CACHE[stackname] = json.load(fh)
+    contents = utils.deepcopy(_CONTEXT_CACHE[stackname])
 
     # fallback: if no `aws` key is there, copy from legacy `project.aws` key
     if contents.get('project', {}).get('aws'):
@@ -43,37 +66,104 @@ def write_context(stackname, context):
     write_context_to_s3(stackname)
 
 def write_context_locally(stackname, contents):
+    clear_context_cache(stackname)
+    _delete_etag(stackname)
     open(local_context_file(stackname), 'w').write(contents)
 
 def write_context_to_s3(stackname):
     path = local_context_file(stackname)
     key = s3_context_key(stackname)
-    s3.write(key, open(path, 'rb'), overwrite=True)
+    etag = s3.write(key, open(path, 'rb'), overwrite=True)
+    # the local copy is now identical to the remote one, so the next load will be a cheap conditional GET
+    _write_etag(stackname, etag)
 
 def delete_context(stackname):
     delete_context_locally(stackname)
     delete_context_from_s3(stackname)
 
 def delete_context_from_s3(stackname):
+    clear_context_cache(stackname)
     key = s3_context_key(stackname)
     return s3.delete(key)
 
 def delete_context_locally(stackname):
+    clear_context_cache(stackname)
+    _delete_etag(stackname)
     path = local_context_file(stackname)
     if os.path.exists(path):
         os.unlink(path)
 
+def _read_etag(stackname):
+    "returns the ETag of the local copy of the context, if both exist"
+    path = local_etag_file(stackname)
+    if os.path.exists(path) and os.path.exists(local_context_file(stackname)):
+        with open(path, 'r') as fh:
+            return fh.read().strip() or None
+    return None
+
+def _write_etag(stackname, etag):
+    if etag:
+        with open(local_etag_file(stackname), 'w') as fh:
+            fh.write(etag)
+    else:
+        _delete_etag(stackname)
+
+def _delete_etag(stackname):
+    path = local_etag_file(stackname)
+    if os.path.exists(path):
+        os.unlink(path)
+
 def download_from_s3(stackname, refresh=False):
+    """ensures the local copy of the context for `stackname` exists.
+    if `refresh` is True an existing local copy is revalidated against S3 with a conditional GET
+    and only downloaded again if it has changed.
+    returns False if the context doesn't exist on S3"""
     key = s3_context_key(stackname)
-    if not s3.exists(key):
-        return False
-
     expected_path = local_context_file(stackname)
-    if os.path.exists(expected_path) and refresh:
-        os.unlink(expected_path)
-    s3.download(key, expected_path)
+    etag = _read_etag(stackname)
+    if etag and not refresh:
+        return True
+    new_etag = s3.download_if_changed(key, expected_path, etag)
+    if not new_etag:
+        _delete_etag(stackname)
+        return False
+    _write_etag(stackname, new_etag)
     return True
 
+def _downloaded_stacknames():
+    "returns the stacknames of the local contexts that were downloaded from S3, see `_write_etag`"
+    if not os.path.exists(config.CONTEXT_DIR):
+        return []
+    suffix = ".json.etag"
+    return [filename[:-len(suffix)] for filename in os.listdir(config.CONTEXT_DIR) if filename.endswith(suffix)]
+
+def sync_all(max_workers=10):
+    """mirrors all contexts on S3 into the local context directory.
+    the `contexts/` prefix is listed once and only contexts whose ETag differs from the local copy are downloaded, concurrently.
+    local copies of contexts that are no longer on S3 are deleted, their stacks no longer exist.
+    returns the list of stacknames whose local context was updated or deleted"""
+    def key_stackname(key):
+        return key[len(config.CONTEXT_PREFIX):-len(".json")]
+
+    remote = {key_stackname(obj.key): obj.e_tag for obj in s3.listing(config.CONTEXT_PREFIX) if obj.key.endswith(".json")}
+    stale = [stackname for stackname, etag in remote.items() if _read_etag(stackname) != etag]
+    LOG.info("%s contexts found on S3, %s need downloading", len(remote), len(stale))
+
+    def download(stackname):
+        clear_context_cache(stackname)
+        _write_etag(stackname, s3.download_if_changed(s3_context_key(stackname), local_context_file(stackname), _read_etag(stackname)))
+
+    utils.pmap(download, stale, max_workers)
+
+    # contexts without an ETag were never downloaded, they may not have been uploaded yet
+    removed = [stackname for stackname in _downloaded_stacknames() if stackname not in remote]
+    for stackname in removed:
+        LOG.info("context %s no longer exists on S3, deleting the local copy", stackname)
+        delete_context_locally(stackname)
+    # every local copy now matches S3 and won't be revalidated by `load_context` for the rest of this process
+    _SYNCED.update(remote.keys())
+    return sorted(stale + removed)
+
 def only_if(*servicenames):
     """Decorator that only executes an update function if the context contains a particular servicename that would need it"""
     def decorate_with_only_if(fn):
@@ -3,13 +3,14 @@ that is built upon by the more specialised parts of builder.
 
 suggestions for a better name than 'core' welcome."""
 
-import os, glob, json, re
+import os, glob, json, re, threading
 from os.path import join
-from . import utils, config, project, decorators # BE SUPER CAREFUL OF CIRCULAR DEPENDENCIES
+from . import utils, config, project, decorators, instrumentation # BE SUPER CAREFUL OF CIRCULAR DEPENDENCIES
 from .decorators import testme
 from .utils import ensure, first, lookup, lmap, lfilter, unique, isstr
 import boto3
 import botocore
+from botocore.config import Config as BotoConfig
 from contextlib import contextmanager
 from .command import settings, execute, parallel, serial, env, CommandException, NetworkError
 from slugify import slugify
@@ -93,8 +94,64 @@ def all_sns_subscriptions(region, stackname=None):
 #
 #
 
+def _boto_config():
+    "returns the botocore configuration shared by all clients and resources"
+    kwargs = {
+        'max_pool_connections': 25, # default is 10, too few for threaded work like `context_handler.sync_all`
+        'connect_timeout': 10,
+        'read_timeout': 60,
+    }
+    try:
+        # client-side rate limiting when throttled, available since botocore 1.15
+        return BotoConfig(retries={'mode': 'adaptive', 'max_attempts': 10}, **kwargs)
+    except botocore.exceptions.InvalidRetryConfigurationError:
+        return BotoConfig(retries={'max_attempts': 10}, **kwargs)
+
+BOTO_CONFIG = _boto_config()
+
+# clients are thread safe and shared, resources are not and are kept per-thread.
+# both are discarded if the process forks (multiprocessing) as their connection pools can't be shared,
+# unless the child adopts them, see `adopt_boto_conns`.
+_BOTO_LOCK = threading.RLock()
+_BOTO_CONNS = {'pid': None, 'clients': {}, 'resources': threading.local()}
+
+def _boto_conns():
+    if _BOTO_CONNS['pid'] != os.getpid():
+        clear_boto_conns()
+    return _BOTO_CONNS
+
+def clear_boto_conns():
+    "discards all pooled boto3 clients and resources"
+    with _BOTO_LOCK:
+        _BOTO_CONNS.update({'pid': os.getpid(), 'clients': {}, 'resources': threading.local()})
+
+def close_boto_pools():
+    """closes the HTTP connections pooled by the boto3 clients and this thread's resources, keeping the clients and
+    resources themselves. new connections are opened as needed. see `adopt_boto_conns`"""
+    with _BOTO_LOCK:
+        clients = list(_boto_conns()['clients'].values())
+        resources = getattr(_BOTO_CONNS['resources'], 'conns', {}).values()
+        for client in clients + [resource.meta.client for resource in resources]:
+            client._endpoint.http_session.close()
+
+def adopt_boto_conns():
+    """keeps the boto3 clients and resources of the parent process in a child it has just forked.
+    the parent must have called `close_boto_pools` before forking and the child must have a single thread"""
+    with _BOTO_LOCK:
+        _BOTO_CONNS['pid'] = os.getpid()
+
 def boto_resource(service, region):
-    return boto3.resource(service, region_name=region)
+    local = _boto_conns()['resources']
+    if not hasattr(local, 'conns'):
+        local.conns = {}
+    resources = local.conns
+    key = (service, region)
+    if key not in resources:
+        # the default boto3 session isn't thread safe
+        with _BOTO_LOCK:
+            resources[key] = boto3.resource(service, region_name=region, config=BOTO_CONFIG)
+            instrumentation.register(resources[key].meta.client)
+    return resources[key]
 
 def boto_client(service, region=None):
     """the boto3 service client is a lower-level construct compared to the boto3 resource client.
@@ -103,7 +160,13 @@ def boto_client(service, region=None):
     exceptions = ['route53']
     if service not in exceptions:
         ensure(region, "'region' is a required parameter for all services except: %s" % (', '.join(exceptions),))
-    return boto3.client(service, region_name=region)
+    clients = _boto_conns()['clients']
+    key = (service, region)
+    if key not in clients:
+        with _BOTO_LOCK:
+            if key not in clients:
+                clients[key] = instrumentation.register(boto3.client(service, region_name=region, config=BOTO_CONFIG))
+    return clients[key]
 
 def boto_conn(pname_or_stackname, service, client=False):
     fn = project_data_for_stackname if '--' in pname_or_stackname else project.project_data
@@ -574,15 +637,17 @@ def steady_aws_stacks(region, *args, **kwargs):
     return _aws_stacks(region, STEADY_CFN_STATUS, *args, **kwargs)
 
 def active_aws_project_stacks(pname):
-    "returns all active stacks for a given project name"
+    "returns all active stacks for a given project name. answered from the local inventory of stacks"
+    from . import inventory # imports core
     pdata = project.project_data(pname)
     region = pdata['aws']['region']
+    return inventory.project_stacks(pname, region, ACTIVE_CFN_STATUS)
 
-    def fn(triple):
-        stackname = first(triple)
-        if stackname_parseable(stackname):
-            return project_name_from_stackname(stackname) == pname
-    return lfilter(fn, active_aws_stacks(region))
+def stack_node_ip(stackname, node=1, public=False):
+    """returns the private (or public) IP address of the given node of a stack or None if it isn't running.
+    answered from the local inventory of instances, connections to the node should use `stack_data`"""
+    from . import inventory # imports core
+    return inventory.node_ip(stackname, node, find_region(stackname), public)
 
 # TODO: consider removing `only_parseable` parameter.
 def stack_names(stack_list, only_parseable=True):
@@ -607,23 +672,75 @@ class MultipleRegionsError(EnvironmentError):
     def regions(self):
         return self._regions
 
+def configured_regions():
+    "returns the list of regions used by all projects"
+    all_projects = project.project_map()
+    all_regions = [lookup(p, 'aws.region', None) for p in all_projects.values()]
+    return unique(filter(None, all_regions)) # remove any Nones, make unique, make a list
+
+# {stackname: region, ...} of stacks whose region has been found this process
+_STACK_REGIONS = {}
+
+def _live_stack_region(stackname, region_list):
+    "looks for the stack in all of the given regions at once. returns the region the stack exists in or None"
+    def describe(region):
+        try:
+            boto_client('cloudformation', region).describe_stacks(StackName=stackname)
+            return region
+        except botocore.exceptions.ClientError as err:
+            if err.response['Error']['Message'].endswith('does not exist'):
+                return None
+            raise
+    return first(lfilter(None, utils.pmap(describe, region_list)))
+
+def stack_region(stackname):
+    """returns the region the given stack resides in.
+
+    the region in the stack's local context is preferred to project data, as updates to project data do not
+    immediately affect existing stacks. failing that and when projects use more than one region, the stack is
+    looked for in every region at once. the result is remembered in the local inventory.
+    stacks that can't be found (yet) are in the region given by their project data"""
+    if stackname in _STACK_REGIONS:
+        return _STACK_REGIONS[stackname]
+    from . import context_handler, inventory # both import core
+
+    region = None
+    path = context_handler.local_context_file(stackname)
+    if os.path.exists(path):
+        with open(path, 'r') as fh:
+            region = lookup(json.load(fh), 'aws.region', None)
+
+    if not region:
+        region_list = configured_regions()
+        if len(region_list) > 1:
+            region = inventory.stack_region(stackname)
+            if not region:
+                region = _live_stack_region(stackname, region_list)
+                if region:
+                    inventory.remember_stack_region(stackname, region)
+
+    if not region:
+        return project_data_for_stackname(stackname)['aws']['region']
+    _STACK_REGIONS[stackname] = region
+    return region
+
+def forget_stack_region(stackname):
+    "forgets the region of the given stack, for example once the stack is destroyed and its name may be re-used"
+    from . import inventory # imports core
+    _STACK_REGIONS.pop(stackname, None)
+    inventory.forget_stack_region(stackname)
+
 def find_region(stackname=None):
     """used when we haven't got a stack and need to know about stacks in a particular region.
-    if a stack is provided, it uses the one provided in it's configuration.
+    if a stack is provided, it uses the region the stack resides in, see `stack_region`.
     otherwise, generates a list of used regions from project data
 
     if more than one region available, it will raise an MultipleRegionsError.
     until we have some means of supporting multiple regions, this is the best solution"""
     if stackname:
-        # TODO: should use context, not project data
-        # as updates in project data do not immediately affect existing stacks
-        # which reside in a region
-        pdata = project_data_for_stackname(stackname)
-        return pdata['aws']['region']
+        return stack_region(stackname)
 
-    all_projects = project.project_map()
-    all_regions = [lookup(p, 'aws.region', None) for p in all_projects.values()]
-    region_list = unique(filter(None, all_regions)) # remove any Nones, make unique, make a list
+    region_list = configured_regions()
     if not region_list:
         raise EnvironmentError("no regions available at all!")
     if len(region_list) > 1:
@@ -1,5 +1,7 @@
 import json, inspect
 from functools import wraps
+from pprint import pformat
+from .utils import remove_ordereddict, errcho, isstr
 import logging
 
 LOG = logging.getLogger(__name__)
@@ -54,3 +56,16 @@ def spy(fn):
         LOG.info("func %r returned with value:\n%s", fn.__name__, json.dumps(retval, indent=4))
         return retval
     return wrapper
+
+def echo_output(func):
+    "pretty-prints the return value of the task(s) being run to stdout"
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        res = func(*args, **kwargs)
+        errcho('output:') # printing to stderr avoids corrupting structured data
+        if isstr(res):
+            print(res)
+        else:
+            print(pformat(remove_ordereddict(res)))
+        return res
+    return _wrapper
@@ -5,6 +5,7 @@ No dependencies on Terraform should be in this module"""
 from collections import namedtuple
 import re
 import os
+from .utils import read_file
 
 class FastlyVCL:
     @classmethod
@@ -23,28 +24,48 @@ class FastlyVCL:
     def __repr__(self):
         return "FastlyVCL(%s)" % repr(self._lines)
 
+    def insert(self, section, hook, statements):
+        return FastlyVCLBuilder(self).insert(section, hook, statements).build()
+
+class FastlyVCLBuilder:
+    """accumulates insertions into a VCL and assembles them in a single pass.
+
+    The section markers are found once. The result is the same as calling `FastlyVCL.insert` for each insertion
+    in turn: every insertion is placed next to its marker, pushing earlier insertions away from it."""
+
+    def __init__(self, vcl):
+        self._vcl = vcl
+        self._markers = [(i, line) for i, line in enumerate(vcl._lines) if re.match(r"^ *#FASTLY ", line)]
+        self._before = {}
+        self._after = {}
+
     def insert(self, section, hook, statements):
         section_start = self._find_section_start(section)
-        lines = list(self._lines)
+        block = ['  %s' % s for s in statements]
         if hook == 'after':
-            lines[section_start + 1:section_start + 1] = ['  %s' % s for s in statements]
-            lines.insert(section_start + 1, '')
+            self._after.setdefault(section_start, []).insert(0, block)
         if hook == 'before':
-            lines.insert(section_start, '')
-            lines[section_start:section_start] = ['  %s' % s for s in statements]
+            self._before.setdefault(section_start, []).append(block)
+        return self
+
+    def build(self):
+        lines = []
+        for i, line in enumerate(self._vcl._lines):
+            for block in self._before.get(i, []):
+                lines.extend(block)
+                lines.append('')
+            lines.append(line)
+            for block in self._after.get(i, []):
+                lines.append('')
+                lines.extend(block)
         return FastlyVCL(lines)
 
     def _find_section_start(self, section):
         lookup = r"^( *)#FASTLY %s" % section
-        section_start = None
-        for i, line in enumerate(self._lines):
-            m = re.match(lookup, line)
-            if m:
-                section_start = i
-                break
-        if section_start is None:
-            raise FastlyCustomVCLGenerationError("Cannot match %s into main VCL template:\n\n%s" % (lookup, str(self)))
-        return section_start
+        for i, line in self._markers:
+            if re.match(lookup, line):
+                return i
+        raise FastlyCustomVCLGenerationError("Cannot match %s into main VCL template:\n\n%s" % (lookup, str(self._vcl)))
 
 class FastlyVCLInclusion(namedtuple('FastlyVCLInclusion', ['name', 'type', 'hook'])):
     def insert_include(self, main_vcl):
@@ -78,69 +99,36 @@ class FastlyCustomVCLGenerationError(Exception):
 
 _directory = os.path.join(os.path.dirname(__file__), 'fastly', 'vcl')
 def _read_vcl_file(name):
-    with open(os.path.join(_directory, name)) as fp:
-        return fp.read()
+    return read_file(os.path.join(_directory, name))
+
+# VCL files are only read when a stack using them is rendered
 
-# taken from https://docs.fastly.com/guides/vcl/mixing-and-matching-fastly-vcl-with-custom-vcl#fastlys-vcl-boilerplate
-# Fastly expands #FASTLY macros into generated VCL
-MAIN_VCL_TEMPLATE = FastlyVCL.from_string(_read_vcl_file('main.vcl'))
+def main_vcl_template():
+    """taken from https://docs.fastly.com/guides/vcl/mixing-and-matching-fastly-vcl-with-custom-vcl#fastlys-vcl-boilerplate
+    Fastly expands #FASTLY macros into generated VCL"""
+    return FastlyVCL.from_string(_read_vcl_file('main.vcl'))
 
+# name: (type, hook) of the snippets in vcl/<name>.vcl
 VCL_SNIPPETS = {
-    'original-host': FastlyVCLSnippet(
-        name='original-host',
-        content=_read_vcl_file('original-host.vcl'),
-        type='recv',
-        hook='before'
-    ),
-    'gzip-by-content-type-suffix': FastlyVCLSnippet(
-        name='gzip-by-content-type-suffix',
-        content=_read_vcl_file('gzip-by-content-type-suffix.vcl'),
-        type='fetch',
-        hook='after'
-    ),
-    'office-webdav-200': FastlyVCLSnippet(
-        name='office-webdav-200',
-        content=_read_vcl_file('office-webdav-200.vcl'),
-        type='recv',
-        hook='after'
-    ),
-    'ping-status': FastlyVCLSnippet(
-        name='ping-status',
-        content=_read_vcl_file('ping-status.vcl'),
-        type='recv',
-        hook='after'
-    ),
-    'strip-non-journal-cookies': FastlyVCLSnippet(
-        name='strip-non-journal-cookies',
-        content=_read_vcl_file('strip-non-journal-cookies.vcl'),
-        type='recv',
-        hook='after'
-    ),
-    'journal-google-scholar': FastlyVCLSnippet(
-        name='journal-google-scholar',
-        content=_read_vcl_file('journal-google-scholar.vcl'),
-        type='recv',
-        hook='after'
-    ),
-    'journal-google-scholar-vary': FastlyVCLSnippet(
-        name='journal-google-scholar-vary',
-        content=_read_vcl_file('journal-google-scholar-vary.vcl'),
-        type='deliver',
-        hook='after'
-    ),
+    'original-host': ('recv', 'before'),
+    'gzip-by-content-type-suffix': ('fetch', 'after'),
+    'office-webdav-200': ('recv', 'after'),
+    'ping-status': ('recv', 'after'),
+    'strip-non-journal-cookies': ('recv', 'after'),
+    'journal-google-scholar': ('recv', 'after'),
+    'journal-google-scholar-vary': ('deliver', 'after'),
 }
 
+def vcl_snippet(name):
+    type_, hook = VCL_SNIPPETS[name]
+    return FastlyVCLSnippet(name=name, content=_read_vcl_file('%s.vcl' % name), type=type_, hook=hook)
+
+# name: (class, type, hook) of the templates in vcl/<name>.vcl.tpl
 VCL_TEMPLATES = {
-    'error-page': FastlyVCLTemplate(
-        name='error-page',
-        content=_read_vcl_file('error-page.vcl.tpl'),
-        type='error',
-        hook='after'
-    ),
-    'journal-submit': FastlyVCLSnippet(
-        name='journal-submit',
-        content=_read_vcl_file('journal-submit.vcl.tpl'),
-        type='recv',
-        hook='before'
-    ),
+    'error-page': (FastlyVCLTemplate, 'error', 'after'),
+    'journal-submit': (FastlyVCLSnippet, 'recv', 'before'),
 }
+
+def vcl_template(name):
+    cls, type_, hook = VCL_TEMPLATES[name]
+    return cls(name=name, content=_read_vcl_file('%s.vcl.tpl' % name), type=type_, hook=hook)
@@ -0,0 +1,139 @@
+"""Records statistics about the AWS API calls made by this process.
+
+Every client created through `core.boto_client` and `core.boto_resource` is registered
+with botocore's `before-call`, `after-call` and `needs-retry` events. For each
+operation (e.g. 'ec2.DescribeInstances') we count calls, errors, retries and throttles
+and keep a histogram of latencies.
+
+See `taskrunner.exec_task` for the summary emitted when a task exits."""
+
+import json, threading, time
+from .utils import lmap, errcho
+import logging
+
+LOG = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets. the last bucket is unbounded.
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# error codes returned by AWS when we're making too many requests
+# https://docs.aws.amazon.com/general/latest/gr/api-retries.html
+THROTTLING_ERRORS = [
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'SlowDown',
+    'PriorRequestNotComplete',
+]
+
+# HTTP status codes that aren't 2xx but aren't errors either.
+# '304 Not Modified' is the expected response to a conditional GET of an unchanged object, see `s3.download_if_changed`
+NOT_ERRORS = [304]
+
+_START_KEY = 'builder-instrumentation-start'
+_LOCK = threading.Lock()
+_STATS = {}
+
+def _operation(model):
+    "returns a name like 'ec2.DescribeInstances' for the given botocore OperationModel"
+    return "%s.%s" % (model.service_model.endpoint_prefix, model.name)
+
+def _stat(operation):
+    if operation not in _STATS:
+        _STATS[operation] = {
+            'operation': operation,
+            'calls': 0,
+            'errors': 0,
+            'retries': 0,
+            'throttles': 0,
+            'total-time': 0.0,
+            'max-time': 0.0,
+            'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+        }
+    return _STATS[operation]
+
+def _bucket(elapsed):
+    for i, upper_bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= upper_bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+def _error_code(parsed):
+    return ((parsed or {}).get('Error') or {}).get('Code')
+
+def _before_call(model, context, **kwargs):
+    context[_START_KEY] = time.time()
+
+def _after_call(model, parsed, context, http_response=None, **kwargs):
+    now = time.time()
+    # the start time is missing when another `before-call` handler short-circuited the request (e.g. botocore's Stubber)
+    elapsed = now - context.get(_START_KEY, now)
+    with _LOCK:
+        stat = _stat(_operation(model))
+        stat['calls'] += 1
+        stat['total-time'] += elapsed
+        stat['max-time'] = max(stat['max-time'], elapsed)
+        stat['histogram'][_bucket(elapsed)] += 1
+        stat['retries'] += (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if http_response is not None and http_response.status_code >= 300 and http_response.status_code not in NOT_ERRORS:
+            stat['errors'] += 1
+
+def _needs_retry(response=None, operation=None, **kwargs):
+    "called after every attempt. never influences the retry decision (returns None)"
+    if response and operation and _error_code(response[1]) in THROTTLING_ERRORS:
+        with _LOCK:
+            _stat(_operation(operation))['throttles'] += 1
+
+def register(client):
+    "registers the instrumentation handlers with the given boto3 client. registering a client twice has no effect"
+    events = client.meta.events
+    events.register('before-call', _before_call, unique_id='builder-instrumentation-before-call')
+    events.register('after-call', _after_call, unique_id='builder-instrumentation-after-call')
+    events.register('needs-retry', _needs_retry, unique_id='builder-instrumentation-needs-retry')
+    return client
+
+def reset():
+    "discards all statistics recorded so far"
+    with _LOCK:
+        _STATS.clear()
+
+def stats():
+    "returns a list of per-operation statistics, the operations taking the most time first"
+    with _LOCK:
+        results = [dict(stat, histogram=list(stat['histogram'])) for stat in _STATS.values()]
+    for stat in results:
+        stat['mean-time'] = stat['total-time'] / stat['calls'] if stat['calls'] else 0.0
+    return sorted(results, key=lambda stat: stat['total-time'], reverse=True)
+
+def summary():
+    "returns the recorded statistics as a human readable table, or None if no calls were made"
+    results = stats()
+    if not results:
+        return None
+    header = "%-50s %6s %6s %7s %9s %9s %9s" % ('operation', 'calls', 'errors', 'retries', 'throttles', 'total(s)', 'max(s)')
+
+    def row(stat):
+        return "%-50s %6d %6d %7d %9d %9.2f %9.2f" % (
+            stat['operation'], stat['calls'], stat['errors'], stat['retries'], stat['throttles'], stat['total-time'], stat['max-time'])
+    return "\n".join([header] + lmap(row, results))
+
+def summary_json():
+    "returns the recorded statistics as a JSON string"
+    return json.dumps({
+        'latency-buckets': LATENCY_BUCKETS,
+        'operations': stats(),
+    }, indent=4)
+
+def report(as_json=False):
+    "logs a summary of the AWS API calls made so far, if any, at DEBUG. `as_json` writes them to stderr as JSON instead"
+    if as_json:
+        errcho(summary_json())
+        return
+    table = summary()
+    if table:
+        LOG.debug("AWS API calls:\n%s", table)
@@ -0,0 +1,214 @@
+"""A local inventory of stacks and EC2 instances, stored in a SQLite database under `.cfn/`.
+
+Answering questions like 'which stacks does project X have' or 'what is the IP of node 2' shouldn't need the AWS
+API every time. The inventory is refreshed when it's older than `config.INVENTORY_MAX_AGE` seconds and the refresh
+is incremental:
+
+* a single `ListStacks` lists every stack. Only stacks whose status or `LastUpdatedTime` changed are written.
+* a single `DescribeInstanceStatus` lists the state of every instance. Only new instances and instances whose state
+  changed are described again, as that's when their IP addresses change.
+
+The inventory is for finding things, not for acting upon them. Anything that modifies a stack or connects to an
+instance should continue to use the AWS API directly. Contexts are kept up to date separately, see
+`context_handler.download_from_s3`."""
+
+import os, json, time, sqlite3
+from contextlib import closing
+from . import config, core, utils
+from .utils import lmap, first, json_dumps
+import logging
+
+LOG = logging.getLogger(__name__)
+
+# instances are described in batches of this many ids
+DESCRIBE_BATCH_SIZE = 100
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS refreshes (region TEXT PRIMARY KEY, refreshed_at REAL NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS stacks (
+        region TEXT NOT NULL,
+        stackname TEXT NOT NULL,
+        status TEXT NOT NULL,
+        last_updated TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (region, stackname))""",
+    """CREATE TABLE IF NOT EXISTS instances (
+        region TEXT NOT NULL,
+        instance_id TEXT NOT NULL,
+        stackname TEXT,
+        node INTEGER,
+        state TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (region, instance_id))""",
+    "CREATE INDEX IF NOT EXISTS instances_stackname ON instances (stackname)",
+    "CREATE TABLE IF NOT EXISTS stack_regions (stackname TEXT PRIMARY KEY, region TEXT NOT NULL)",
+]
+
+def connect(path=None):
+    "returns a connection to the inventory database, creating it if necessary"
+    path = path or config.INVENTORY_PATH
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    # concurrent builder processes wait for each other's writes rather than failing
+    conn = sqlite3.connect(path, timeout=30)
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+    return conn
+
+def _last_updated(summary):
+    "stacks that have never been updated have no `LastUpdatedTime`"
+    return str(summary.get('LastUpdatedTime') or summary['CreationTime'])
+
+#
+# refresh
+#
+
+def refresh_stacks(conn, region):
+    """lists the stacks in the region and updates the inventory with those that have changed.
+    returns the names of the stacks that were added, changed or removed"""
+    paginator = core.boto_client('cloudformation', region).get_paginator('list_stacks')
+    summaries = utils.shallow_flatten([page['StackSummaries'] for page in paginator.paginate()])
+    # stack names are re-used once a stack is deleted. deleted stacks are listed for 90 days
+    summaries = {summary['StackName']: summary for summary in summaries if summary['StackStatus'] != 'DELETE_COMPLETE'}
+
+    known = {stackname: (status, last_updated) for stackname, status, last_updated in conn.execute(
+        "SELECT stackname, status, last_updated FROM stacks WHERE region = ?", (region,))}
+
+    changed = [summary for stackname, summary in summaries.items()
+               if known.get(stackname) != (summary['StackStatus'], _last_updated(summary))]
+    removed = [stackname for stackname in known if stackname not in summaries]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO stacks VALUES (?, ?, ?, ?, ?)", [
+            (region, summary['StackName'], summary['StackStatus'], _last_updated(summary), json_dumps(summary))
+            for summary in changed])
+        conn.executemany("DELETE FROM stacks WHERE region = ? AND stackname = ?",
+                         [(region, stackname) for stackname in removed])
+    return sorted([summary['StackName'] for summary in changed] + removed)
+
+def _instance_row(region, data):
+    tags = core.tags2dict(data.get('Tags', []))
+    node = tags.get('Node')
+    return (region, data['InstanceId'], tags.get('aws:cloudformation:stack-name'), int(node) if node else None,
+            data['State']['Name'], json_dumps(data))
+
+def refresh_instances(conn, region):
+    """lists the state of every instance in the region and describes those that are new or have changed state.
+    returns the ids of the instances that were added, changed or removed"""
+    client = core.boto_client('ec2', region)
+    paginator = client.get_paginator('describe_instance_status')
+    statuses = utils.shallow_flatten([page['InstanceStatuses'] for page in paginator.paginate(IncludeAllInstances=True)])
+    states = {status['InstanceId']: status['InstanceState']['Name'] for status in statuses}
+
+    known = dict(conn.execute("SELECT instance_id, state FROM instances WHERE region = ?", (region,)))
+    changed = sorted(instance_id for instance_id, state in states.items() if known.get(instance_id) != state)
+    removed = [instance_id for instance_id in known if instance_id not in states]
+
+    described = []
+    paginator = client.get_paginator('describe_instances')
+    for i in range(0, len(changed), DESCRIBE_BATCH_SIZE):
+        pages = paginator.paginate(InstanceIds=changed[i:i + DESCRIBE_BATCH_SIZE])
+        reservations = utils.shallow_flatten([page['Reservations'] for page in pages])
+        described.extend(utils.shallow_flatten([reservation['Instances'] for reservation in reservations]))
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?, ?)",
+                         [_instance_row(region, data) for data in described])
+        conn.executemany("DELETE FROM instances WHERE region = ? AND instance_id = ?",
+                         [(region, instance_id) for instance_id in removed])
+    return changed + removed
+
+def refresh(region, max_age=None, path=None):
+    """refreshes the inventory of the given region if it was last refreshed more than `max_age` seconds ago.
+    a `max_age` of 0 always refreshes. returns True if the inventory was refreshed"""
+    max_age = config.INVENTORY_MAX_AGE if max_age is None else max_age
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT refreshed_at FROM refreshes WHERE region = ?", (region,)).fetchone()
+        if row and time.time() - first(row) < max_age:
+            return False
+        refreshed_at = time.time()
+        changed_stacks = refresh_stacks(conn, region)
+        changed_instances = refresh_instances(conn, region)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?)", (region, refreshed_at))
+        LOG.info("refreshed inventory of %s: %s stacks and %s instances changed", region, len(changed_stacks), len(changed_instances))
+        return True
+
+def expire(region, path=None):
+    "marks the inventory of the given region as out of date. the next query will refresh it"
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM refreshes WHERE region = ?", (region,))
+
+def clear(path=None):
+    "empties the inventory. the next query will refresh it"
+    with closing(connect(path)) as conn, conn:
+        for table in ['refreshes', 'stacks', 'instances', 'stack_regions']:
+            conn.execute("DELETE FROM %s" % table)
+
+#
+# queries
+#
+
+def _query(region, sql, params, max_age=None, path=None):
+    refresh(region, max_age, path)
+    with closing(connect(path)) as conn:
+        return conn.execute(sql, params).fetchall()
+
+def stacks(region, status=None, max_age=None, path=None):
+    "returns a list of (stackname, status, data) triples like `core.active_aws_stacks`, optionally filtered by status"
+    status = status or []
+    sql = "SELECT stackname, status, data FROM stacks WHERE region = ?"
+    if status:
+        sql += " AND status IN (%s)" % ", ".join("?" * len(status))
+    sql += " ORDER BY stackname"
+    rows = _query(region, sql, [region] + list(status), max_age, path)
+    return [(stackname, stack_status, json.loads(data)) for stackname, stack_status, data in rows]
+
+def active_stack_names(region, max_age=None, path=None):
+    "returns the names of all active stacks, like `core.active_stack_names`"
+    return core.stack_names(stacks(region, core.ACTIVE_CFN_STATUS, max_age, path))
+
+def project_stacks(pname, region, status=None, max_age=None, path=None):
+    "returns a list of (stackname, status, data) triples for stacks belonging to the given project"
+    def belongs(triple):
+        stackname = first(triple)
+        return core.stackname_parseable(stackname) and core.project_name_from_stackname(stackname) == pname
+    return list(filter(belongs, stacks(region, status, max_age, path)))
+
+def stack_instances(stackname, region, state='running', max_age=None, path=None):
+    """returns a list of EC2 instance data for the given stack, like `core.stack_data`. Ordered by node (1 to N).
+    `state` may be a single state, states separated by a pipe like 'running|stopped', or None for all states"""
+    sql = "SELECT data FROM instances WHERE region = ? AND stackname = ?"
+    params = [region, stackname]
+    if state:
+        states = state.split('|')
+        sql += " AND state IN (%s)" % ", ".join("?" * len(states))
+        params += states
+    sql += " ORDER BY node"
+    return lmap(lambda row: json.loads(first(row)), _query(region, sql, params, max_age, path))
+
+def node_ip(stackname, node, region, public=False, max_age=None, path=None):
+    "returns the private (or public) IP address of the given node of a stack or None if it isn't running"
+    for data in stack_instances(stackname, region, max_age=max_age, path=path):
+        if int(core.tags2dict(data.get('Tags', [])).get('Node', 1)) == int(node):
+            return data.get('PublicIpAddress' if public else 'PrivateIpAddress')
+    return None
+
+#
+# stack regions, see `core.stack_region`
+#
+
+def stack_region(stackname, path=None):
+    "returns the region the given stack was last found in or None if it hasn't been found. never refreshes the inventory"
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT region FROM stack_regions WHERE stackname = ?", (stackname,)).fetchone() \
+            or conn.execute("SELECT region FROM stacks WHERE stackname = ?", (stackname,)).fetchone()
+    return first(row) if row else None
+
+def remember_stack_region(stackname, region, path=None):
+    with closing(connect(path)) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO stack_regions VALUES (?, ?)", (stackname, region))
+
+def forget_stack_region(stackname, path=None):
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM stack_regions WHERE stackname = ?", (stackname,))
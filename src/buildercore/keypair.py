@@ -24,8 +24,8 @@ def write_keypair_to_s3(stackname):
     key = s3_keypair_key(stackname)
     with open(path, 'r') as fp:
         pem_contents = fp.read()
-    s3.write(key, pem_contents)
-    return s3.exists(key)
+    # the ETag is only returned once the object has been written
+    return s3.write(key, pem_contents) is not None
 
 def delete_keypair_from_s3(stackname):
     key = s3_keypair_key(stackname)
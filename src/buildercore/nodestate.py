@@ -0,0 +1,116 @@
+"""Reads and writes the files builder keeps on an ec2 node using as few remote commands as possible.
+
+Each remote command is a separate SSH session and `sudo`. Downloading a root owned file
+like /etc/build-vars.json.b64 takes several of them (copy, download, remove) and so does
+uploading one. Instead:
+
+* `snapshot` runs a single script that prints everything builder wants to know about the node.
+* `write_files` runs a single script that writes a batch of files, each replaced atomically.
+
+Both must be called with an active stack connection, like `command.remote_sudo`."""
+
+import base64, hashlib
+from . import utils
+from .bvars import decode_bvars
+from .command import remote_sudo, hide
+import logging
+
+LOG = logging.getLogger(__name__)
+
+BUILD_VARS_PATH = '/etc/build-vars.json.b64'
+CFN_INFO_PATH = '/etc/cfn-info.json'
+
+# every line of the snapshot is prefixed with this, anything else written to the terminal is ignored
+MARKER = 'builder-node-state'
+
+# the commands of the snapshot script that print each key of the snapshot, see `snapshot`
+SNAPSHOT_COMMANDS = [
+    ('build-vars', '''echo "%(marker)s build-vars $(tr -d '\\n' 2> /dev/null < %(build_vars)s)"'''),
+    ('cfn-info-md5', '''echo "%(marker)s cfn-info $(md5sum %(cfn_info)s 2> /dev/null | cut -d' ' -f1)"'''),
+]
+
+def snapshot_script(keys=None):
+    "returns the script that prints the given keys of the snapshot, all of them by default"
+    commands = [command for key, command in SNAPSHOT_COMMANDS if keys is None or key in keys]
+    return "\n".join(commands) % {'marker': MARKER, 'build_vars': BUILD_VARS_PATH, 'cfn_info': CFN_INFO_PATH} + "\n"
+
+SNAPSHOT_SCRIPT = snapshot_script()
+
+# the script is passed on the command line, see `_run_script`. Linux limits a single argument to 128KiB
+MAX_SCRIPT_SIZE = 100 * 1024
+
+def md5(contents):
+    "returns the md5 hex digest of the given string, as `md5sum` would print it for a file with those contents"
+    return hashlib.md5(contents.encode('utf-8')).hexdigest()
+
+def _b64(contents):
+    return base64.b64encode(contents.encode('utf-8')).decode('ascii')
+
+def _run_script(script):
+    """runs the given bash script as root with a single remote command. returns the lines it printed.
+    the script is base64 encoded so it survives the quoting and escaping of the remote command intact."""
+    command = "echo %s | base64 --decode | bash" % _b64(script)
+    utils.ensure(len(command) < MAX_SCRIPT_SIZE, "script is too large to run as a single command: %s bytes" % len(command))
+    with hide('output'):
+        result = remote_sudo(command)
+    # lines may end with a carriage return when a pseudo-terminal is used
+    return [line.strip() for line in result['stdout']]
+
+def parse_snapshot(lines):
+    """parses the lines printed by `SNAPSHOT_SCRIPT`, see `snapshot`.
+    build vars that can't be decoded are logged and treated as missing"""
+    state = {
+        'build-vars': None,
+        'cfn-info-md5': None,
+    }
+    for line in lines:
+        bits = line.split(' ')
+        if bits[0] != MARKER or len(bits) < 2:
+            continue
+        key, values = bits[1], [value for value in bits[2:] if value]
+        if not values:
+            continue
+        if key == 'build-vars':
+            try:
+                state['build-vars'] = decode_bvars(values[0])
+            except (ValueError, TypeError) as err:
+                # not base64, not ascii or not json. python 2 raises a TypeError for bad base64.
+                # `buildvars.fix` replaces them
+                LOG.warning("failed to decode the build vars on the node: %s", err)
+        elif key == 'cfn-info':
+            state['cfn-info-md5'] = values[0]
+    return state
+
+def snapshot(keys=None):
+    """returns the state of the CURRENTLY CONNECTED node as a map with the keys:
+
+    * 'build-vars': the decoded build variables or None if the node has none
+    * 'cfn-info-md5': the md5 of /etc/cfn-info.json or None if it doesn't exist
+
+    only the given `keys` are read, the others are left empty."""
+    return parse_snapshot(_run_script(snapshot_script(keys)))
+
+def write_files_script(file_list, backup=True, suffix=None):
+    """returns a bash script that writes each (path, contents) pair in `file_list`.
+    every file is written to a temporary file alongside it before any is moved into place"""
+    suffix = suffix or utils.ymd(fmt='%Y%m%d%H%M%S')
+    lines = ['set -e']
+    for path, contents in file_list:
+        lines.append("echo %s | base64 --decode > '%s.builder-tmp'" % (_b64(contents), path))
+    for path, _ in file_list:
+        lines.append("if [ -f '%s' ]; then" % path)
+        if backup:
+            lines.append("    cp '%s' '/tmp/%s.%s'" % (path, path.rsplit('/', 1)[-1], suffix))
+        # preserve the ownership and permissions of the file being replaced
+        lines.append("    chown --reference='%s' '%s.builder-tmp'" % (path, path))
+        lines.append("    chmod --reference='%s' '%s.builder-tmp'" % (path, path))
+        lines.append("fi")
+        lines.append("mv '%s.builder-tmp' '%s'" % (path, path))
+    return "\n".join(lines) + "\n"
+
+def write_files(file_list, backup=True):
+    """writes each (path, contents) pair in `file_list` to the CURRENTLY CONNECTED node with a single remote command.
+    each file is replaced atomically. existing files are first copied to /tmp/ if `backup` is True"""
+    LOG.info("writing %s", ", ".join(path for path, _ in file_list))
+    _run_script(write_files_script(file_list, backup))
+    return [path for path, _ in file_list]
@@ -1,73 +1,124 @@
 import os
 from botocore.exceptions import ClientError
-from . import config, core
-from .utils import isstr, ensure
+from boto3.s3.transfer import TransferConfig
+from . import config, core, utils
+from .utils import isstr, ensure, lmap
 from kids.cache import cache as cached
 from io import IOBase
 import logging
 
 LOG = logging.getLogger(__name__)
 
+# the maximum number of keys accepted by a single DeleteObjects request
+# http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Client.delete_objects
+DELETE_BATCH_SIZE = 1000
+
+# objects larger than this are transferred in concurrent multipart chunks
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024, # 8MB, boto3's default
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+)
+
 @cached
 def builder_bucket():
     "returns connection to the bucket where builder stores templates and credentials."
+    nom, region = config.BUILDER_BUCKET, config.BUILDER_REGION
+    resource = core.boto_resource('s3', region)
     try:
-        nom, region = config.BUILDER_BUCKET, config.BUILDER_REGION
-        resource = core.boto_resource('s3', region)
-        bucket = resource.Bucket(nom)
-        ensure(bucket in resource.buckets.all(), "bucket %r in region %r does not exist" % (nom, region))
-        return bucket
+        # a single HEAD request rather than listing every bucket in the account
+        resource.meta.client.head_bucket(Bucket=nom)
+        return resource.Bucket(nom)
     except ClientError as err:
+        ensure(err.response['Error']['Code'] not in ['404', 'NoSuchBucket'], "bucket %r in region %r does not exist" % (nom, region))
         LOG.error("unhandled error attempting to find S3 bucket %r in region %r", nom, region,
                   extra={'bucket': nom, 'region': region, 'error': str(err)})
         raise
 
+def _client():
+    "returns the low-level client of the builder bucket. unlike resources, clients are safe to share between threads"
+    return builder_bucket().meta.client
+
+def _not_found(err):
+    return err.response['Error']['Code'] in ['404', 'NoSuchKey']
+
 def exists(key):
     "predicate, returns True if given key in configured bucket+region exists"
     try:
-        builder_bucket().Object(key).load()
+        _client().head_object(Bucket=config.BUILDER_BUCKET, Key=key)
         return True
     except ClientError as err:
-        if err.response['Error']['Code'] == '404':
+        if _not_found(err):
             return False
         raise
 
 def write(key, something, overwrite=False):
-    "stream is a file-like object"
-    if exists(key) and not overwrite:
+    """stream is a file-like object.
+    returns the ETag of the written object.
+
+    the existence check is only made when `overwrite` is False."""
+    if not overwrite and exists(key):
         raise KeyError("key %r exists and overwrite==False. refusing to overwrite." % key)
-    k = builder_bucket().Object(key)
     LOG.info("writing key %r", key, extra={'key': key})
 
-    # http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Object.put
+    # http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Client.put_object
     if isstr(something):
-        k.put(Body=something.encode()) # bytes
+        body = something.encode() # bytes
     elif isinstance(something, IOBase):
         # this seek() here is interesting
         # the check in isstr above is actually moving it's pointer
+        something.seek(0, os.SEEK_END)
+        size = something.tell()
         something.seek(0)
-        k.put(Body=something) # py3 file
+        if size >= TRANSFER_CONFIG.multipart_threshold:
+            # large files are uploaded in parts. the upload doesn't return the ETag of the resulting object
+            _client().upload_fileobj(something, config.BUILDER_BUCKET, key, Config=TRANSFER_CONFIG)
+            return _client().head_object(Bucket=config.BUILDER_BUCKET, Key=key)['ETag']
+        body = something # py3 file
     # TODO: py2 warning
     elif isinstance(something, file):
-        k.put(Body=something) # py2 file
+        body = something # py2 file
     else:
         raise ValueError("boto can't handle value of type %r, just strings and files" % type(something))
+    return _client().put_object(Bucket=config.BUILDER_BUCKET, Key=key, Body=body)['ETag']
 
-def delete(key):
-    "deletes a single key from the builder bucket"
+def write_many(key_something_pairs, overwrite=False, max_workers=10):
+    "writes many keys concurrently. accepts a list of (key, something) pairs, see `write`. returns a list of ETags"
+    return utils.pmap(lambda pair: write(pair[0], pair[1], overwrite), key_something_pairs, max_workers)
+
+def url(key):
+    "returns the URL of the given key in the builder bucket"
+    return "https://%s.s3.amazonaws.com/%s" % (config.BUILDER_BUCKET, key)
+
+def validate_key(key):
     # legacy prefixes
     protected = ['boxes/', 'cfn/', 'private/']
     if not all([not key.startswith(prefix) for prefix in protected]):
         msg = "you tried to delete a key with a protected prefix"
         LOG.warn(msg, extra={'key': key, 'protected': protected})
         raise ValueError(msg)
-    if not exists(key):
-        return True
+
+def delete(key):
+    "deletes a single key from the builder bucket"
+    validate_key(key)
     LOG.info("deleting key %s", key, extra={'key': key})
-    k = builder_bucket().Object(key)
-    k.delete()
-    # http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Object.wait_until_not_exists
-    k.wait_until_not_exists()
+    # deleting a missing key is not an error and S3 offers strong read-after-write consistency,
+    # so neither an existence check beforehand nor a waiter afterwards is necessary.
+    _client().delete_object(Bucket=config.BUILDER_BUCKET, Key=key)
+    return True
+
+def delete_many(key_list):
+    "deletes many keys from the builder bucket using as few requests as possible"
+    lmap(validate_key, key_list)
+    for i in range(0, len(key_list), DELETE_BATCH_SIZE):
+        batch = key_list[i:i + DELETE_BATCH_SIZE]
+        LOG.info("deleting %s keys", len(batch), extra={'keys': batch})
+        response = _client().delete_objects(
+            Bucket=config.BUILDER_BUCKET,
+            Delete={'Objects': lmap(lambda key: {'Key': key}, batch), 'Quiet': True}
+        )
+        errors = response.get('Errors', [])
+        ensure(not errors, "failed to delete %s keys: %s" % (len(errors), errors))
     return True
 
 def validate_prefix(prefix):
@@ -81,10 +132,7 @@ def validate_prefix(prefix):
 
 def delete_contents(prefix):
     validate_prefix(prefix)
-    # TODO: optimisation here: http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Bucket.delete_objects
-    for key in builder_bucket().objects.filter(Prefix=prefix):
-        LOG.info("deleting key %s", key, extra={'key': key})
-        key.delete() # not delete(key) ?
+    return delete_many(simple_listing(prefix))
 
 def listing(prefix):
     "returns a list of Key objects starting with given prefix rooted in the builder bucket"
@@ -97,7 +145,38 @@ def simple_listing(prefix):
 def download(key, output_path, overwrite=False):
     if not overwrite:
         ensure(not os.path.exists(output_path), "given output path exists, will not overwrite: %r" % output_path)
-    ensure(exists(key), "key %r not found in bucket %r" % (key, config.BUILDER_BUCKET))
     LOG.info("downloading key %s", key, extra={'key': key})
-    builder_bucket().Object(key).download_file(output_path)
+    try:
+        _client().download_file(config.BUILDER_BUCKET, key, output_path, Config=TRANSFER_CONFIG)
+    except ClientError as err:
+        if _not_found(err):
+            ensure(False, "key %r not found in bucket %r" % (key, config.BUILDER_BUCKET))
+        raise
     return output_path
+
+def download_many(key_path_pairs, overwrite=False, max_workers=10):
+    "downloads many keys concurrently. accepts a list of (key, output_path) pairs, see `download`. returns a list of output paths"
+    return utils.pmap(lambda pair: download(pair[0], pair[1], overwrite), key_path_pairs, max_workers)
+
+def download_if_changed(key, output_path, etag=None):
+    """downloads `key` to `output_path` unless the object on S3 still has the given `etag`.
+    a single conditional GET is issued (If-None-Match).
+    returns the ETag of the object, or None if the key doesn't exist"""
+    kwargs = {'IfNoneMatch': etag} if etag else {}
+    try:
+        response = _client().get_object(Bucket=config.BUILDER_BUCKET, Key=key, **kwargs)
+    except ClientError as err:
+        code = err.response['Error']['Code']
+        if code in ['304', 'NotModified']:
+            LOG.debug("key %s not modified", key, extra={'key': key})
+            return etag
+        if _not_found(err):
+            return None
+        raise
+    LOG.info("downloading key %s", key, extra={'key': key})
+    # write to a temporary file first so an interrupted download never leaves a partial file behind
+    partial_path = output_path + ".partial"
+    with open(partial_path, 'wb') as fh:
+        fh.write(response['Body'].read())
+    os.rename(partial_path, output_path)
+    return response['ETag']
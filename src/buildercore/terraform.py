@@ -1,11 +1,15 @@
 from collections import namedtuple, OrderedDict
-import os, re, shutil, json
+import os, re, shutil, json, hashlib, fcntl
+from contextlib import contextmanager
 from os.path import join
 from python_terraform import Terraform, IsFlagged, IsNotFlagged
 from .config import BUILDER_BUCKET, BUILDER_REGION, TERRAFORM_DIR, PROJECT_PATH
 from .context_handler import only_if, load_context
-from .utils import ensure, mkdir_p
+from .utils import ensure, mkdir_p, read_file
 from . import aws, fastly
+import logging
+
+LOG = logging.getLogger(__name__)
 
 MANAGED_SERVICES = ['fastly', 'gcs', 'bigquery', 'eks']
 only_if_managed_services_are_present = only_if(*MANAGED_SERVICES)
@@ -17,6 +21,12 @@ HELM_CHART_VERSION_EXTERNAL_DNS = '2.6.1'
 HELM_CHART_VERSION_RAW = '0.2.3',
 HELM_APP_VERSION_EXTERNAL_DNS = '0.5.16'
 
+# providers downloaded by `terraform init` are shared by every stack
+# https://www.terraform.io/docs/commands/cli-config.html#provider-plugin-cache
+PLUGIN_CACHE_DIR = join(TERRAFORM_DIR, 'plugin-cache')
+# written to a stack's .terraform/ directory after a successful `terraform init`
+INIT_HASH_FILE = 'builder-init.hash'
+
 RESOURCE_TYPE_FASTLY = 'fastly_service_v1'
 RESOURCE_NAME_FASTLY = 'fastly-cdn'
 
@@ -302,7 +312,7 @@ def render_fastly(context, template):
             'vcl',
             {
                 'name': snippet_name,
-                'content': _generate_vcl_file(context['stackname'], fastly.VCL_SNIPPETS[snippet_name].content, snippet_name),
+                'content': _generate_vcl_file(context['stackname'], fastly.vcl_snippet(snippet_name).content, snippet_name),
             }) for snippet_name in vcl_constant_snippets]
 
         # templated snippets
@@ -316,11 +326,12 @@ def render_fastly(context, template):
             }) for snippet_name in vcl_templated_snippets]
 
         # main
-        linked_main_vcl = fastly.MAIN_VCL_TEMPLATE
-        inclusions = [fastly.VCL_SNIPPETS[name].as_inclusion() for name in vcl_constant_snippets] + list(vcl_templated_snippets.values())
+        main_vcl = fastly.FastlyVCLBuilder(fastly.main_vcl_template())
+        inclusions = [fastly.vcl_snippet(name).as_inclusion() for name in vcl_constant_snippets] + list(vcl_templated_snippets.values())
         inclusions.reverse()
         for i in inclusions:
-            linked_main_vcl = i.insert_include(linked_main_vcl)
+            i.insert_include(main_vcl)
+        linked_main_vcl = main_vcl.build()
 
         template.populate_resource_element(
             RESOURCE_TYPE_FASTLY,
@@ -391,7 +402,7 @@ def render_fastly(context, template):
 
 def _render_fastly_vcl_templates(context, template, vcl_templated_snippets):
     for name, variables in context['fastly']['vcl-templates'].items():
-        vcl_template = fastly.VCL_TEMPLATES[name]
+        vcl_template = fastly.vcl_template(name)
         vcl_template_file = _generate_vcl_file(
             context['stackname'],
             vcl_template.content,
@@ -413,7 +424,7 @@ def _render_fastly_vcl_templates(context, template, vcl_templated_snippets):
 
 def _render_fastly_errors(context, template, vcl_templated_snippets):
     if context['fastly']['errors']:
-        error_vcl_template = fastly.VCL_TEMPLATES['error-page']
+        error_vcl_template = fastly.vcl_template('error-page')
         error_vcl_template_file = _generate_vcl_file(
             context['stackname'],
             error_vcl_template.content,
@@ -542,6 +553,14 @@ def render_gcs(context, template):
 
     return template.to_dict()
 
+def _copy_if_changed(source, destination):
+    "copies `source` to `destination` unless `destination` already has the same contents. returns True if it was copied"
+    contents = read_file(source)
+    if os.path.exists(destination) and read_file(destination) == contents:
+        return False
+    shutil.copyfile(source, destination)
+    return True
+
 def render_bigquery(context, template):
     if not context['bigquery']:
         return {}
@@ -587,7 +606,7 @@ def render_bigquery(context, template):
             schema_file = os.path.basename(schema)
             terraform_working_dir = join(TERRAFORM_DIR, stackname)
             mkdir_p(terraform_working_dir)
-            shutil.copyfile(schema_path, join(terraform_working_dir, schema_file))
+            _copy_if_changed(schema_path, join(terraform_working_dir, schema_file))
             schema_ref = '${file("%s")}' % schema_file
 
         table_block = {
@@ -1101,14 +1120,59 @@ class TerraformTemplate():
         return result
 
 
-class TerraformDelta(namedtuple('TerraformDelta', ['plan_output'])):
+class TerraformDelta(namedtuple('TerraformDelta', ['plan_output', 'plus', 'edit', 'minus'])):
     """represents a delta between and old and new Terraform generated template, showing which resources are being added, updated, or removed.
 
+    `plan_output` is the human readable plan. `plus`, `edit` and `minus` map resource addresses to their new values,
+    their changed attributes and their old values respectively. They are None if the plan couldn't be read as JSON.
+
     Extends the namedtuple-generated class to add custom methods."""
 
+    @classmethod
+    def from_plan(cls, plan_output, plan_data):
+        "builds a delta from the output of `terraform show -json` for a plan file"
+        plus, edit, minus = {}, {}, {}
+        for resource_change in plan_data.get('resource_changes', []):
+            address, change = resource_change['address'], resource_change['change']
+            actions = change['actions']
+            if actions == ['create']:
+                plus[address] = _planned_values(change)
+            elif actions == ['delete']:
+                minus[address] = change['before']
+            elif 'update' in actions or 'delete' in actions:
+                # replacements are 'delete' and 'create' in either order
+                edit[address] = _changed_attributes(change['before'] or {}, _planned_values(change))
+        return cls(plan_output, plus, edit, minus)
+
+    @property
+    def non_empty(self):
+        return any([self.plus, self.edit, self.minus])
+
     def __str__(self):
         return self.plan_output
 
+# `plus`, `edit` and `minus` are optional
+TerraformDelta.__new__.__defaults__ = (None, None, None)
+
+# the value of attributes that will only be known once the plan is applied
+UNKNOWN_VALUE = '(known after apply)'
+
+def _planned_values(change):
+    "returns the attributes a resource will have after the change, marking those not yet known"
+    after = dict(change['after'] or {})
+    for attribute, unknown in (change.get('after_unknown') or {}).items():
+        if unknown is True:
+            after[attribute] = UNKNOWN_VALUE
+    return after
+
+def _changed_attributes(before, after):
+    "returns a map of attribute to {'before': ..., 'after': ...} for the attributes whose value changes"
+    return {
+        attribute: {'before': before.get(attribute), 'after': after.get(attribute)}
+        for attribute in sorted(set(before.keys()) | set(after.keys()))
+        if before.get(attribute) != after.get(attribute)
+    }
+
 def generate_delta(new_context):
     # simplification: unless Fastly is involved, the TerraformDelta will be empty
     # this should eventually be removed, for example after test_buildercore_cfngen tests have been ported to test_buildercore_cloudformation
@@ -1127,24 +1191,30 @@ def bootstrap(stackname, context):
     update(stackname, context)
 
 def plan(context):
+    """plans the changes to the stack's Terraform managed resources, refreshing their state once.
+    the plan is saved to 'out.plan' and read back as JSON, which doesn't contact any remote service."""
     terraform = init(context['stackname'], context)
+    plan_filename = 'out.plan'
 
-    def _generate_plan():
-        terraform.plan(input=False, no_color=IsFlagged, capture_output=False, raise_on_error=True, detailed_exitcode=IsNotFlagged, out='out.plan')
-        return 'out.plan'
-
-    def _explain_plan(plan_filename):
-        return_code, stdout, stderr = terraform.plan(plan_filename, input=False, no_color=IsFlagged, raise_on_error=True, detailed_exitcode=IsNotFlagged)
-        ensure(return_code == 0, "Exit code of `terraform plan out.plan` should be 0, not %s" % return_code)
-        # TODO: may not be empty if TF_LOG is used
-        ensure(stderr == '', "Stderr of `terraform plan out.plan` should be empty:\n%s" % stderr)
-        return _clean_stdout(stdout)
+    return_code, stdout, stderr = terraform.plan(input=False, no_color=IsFlagged, raise_on_error=True, detailed_exitcode=IsNotFlagged, out=plan_filename)
+    ensure(return_code == 0, "Exit code of `terraform plan` should be 0, not %s" % return_code)
+    # TODO: may not be empty if TF_LOG is used
+    ensure(stderr == '', "Stderr of `terraform plan` should be empty:\n%s" % stderr)
+    plan_output = _clean_stdout(stdout)
 
-    return TerraformDelta(_explain_plan(_generate_plan()))
+    # `show -json` requires Terraform 0.12 or later
+    return_code, stdout, stderr = terraform.cmd('show', plan_filename, json=IsFlagged, no_color=IsFlagged)
+    if return_code != 0:
+        LOG.warning("failed to read %s of %s as JSON, only the plan output is available: %s", plan_filename, context['stackname'], stderr)
+        return TerraformDelta(plan_output)
+    return TerraformDelta.from_plan(plan_output, json.loads(stdout))
 
 def _clean_stdout(stdout):
+    # printed while the state is refreshed, before the plan itself
+    stdout = re.sub(re.compile(r"^.*: Refreshing state\.\.\..*$", re.MULTILINE), "", stdout)
     stdout = re.sub(re.compile(r"The plan command .* as an argument.", re.MULTILINE | re.DOTALL), "", stdout)
     stdout = re.sub(re.compile(r"Note: .* is subsequently run.", re.MULTILINE | re.DOTALL), "", stdout)
+    stdout = re.sub(re.compile(r"This plan was saved to: .* terraform apply \"[^\"]*\"", re.MULTILINE | re.DOTALL), "", stdout)
     stdout = re.sub(re.compile(r"\n+", re.MULTILINE), "\n", stdout)
     return stdout
 
@@ -1233,9 +1303,63 @@ def init(stackname, context):
                     },
                 }
         fp.write(json.dumps(providers))
-    terraform.init(input=False, capture_output=False, raise_on_error=True)
+
+    init_hash = _init_hash(stackname)
+    if _is_initialised(working_dir, init_hash):
+        LOG.info("terraform configuration of %s unchanged, skipping `terraform init`", stackname)
+        return terraform
+
+    mkdir_p(os.path.abspath(PLUGIN_CACHE_DIR))
+    # terraform is run from the stack's directory, the cache must be an absolute path
+    os.environ.setdefault('TF_PLUGIN_CACHE_DIR', os.path.abspath(PLUGIN_CACHE_DIR))
+    with _plugin_cache_lock():
+        terraform.init(input=False, capture_output=False, raise_on_error=True)
+    mkdir_p(join(working_dir, '.terraform'))
+    with open(join(working_dir, '.terraform', INIT_HASH_FILE), 'w') as fp:
+        fp.write(init_hash)
     return terraform
 
+@contextmanager
+def _plugin_cache_lock():
+    """terraform doesn't support concurrent writes to the plugin cache.
+    stacks initialised at the same time, see `cfngen.stacks_terraform_plan`, take turns"""
+    with open(join(PLUGIN_CACHE_DIR, '.lock'), 'w') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+def _required_providers(stackname):
+    "returns the names of the providers whose resources and data sources are used by the generated template, if any"
+    path = _file_path_for_generation(stackname, 'generated')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as fp:
+        template = json.load(fp)
+    types = list(template.get('resource', {}).keys()) + list(template.get('data', {}).keys())
+    return sorted(set(type_.split('_')[0] for type_ in types))
+
+def _init_hash(stackname):
+    """returns a hash of everything `terraform init` depends on: the backend, the provider configuration and the
+    providers used by the generated template"""
+    digest = hashlib.md5()
+    for name in ['backend', 'providers']:
+        with _open(stackname, name, mode='r') as fp:
+            digest.update(fp.read().encode('utf-8'))
+    digest.update(json.dumps(_required_providers(stackname)).encode('utf-8'))
+    return digest.hexdigest()
+
+def _is_initialised(working_dir, init_hash):
+    "returns True if `terraform init` was successfully run in `working_dir` with the same configuration"
+    terraform_dir = join(working_dir, '.terraform')
+    hash_path = join(terraform_dir, INIT_HASH_FILE)
+    # the backend configuration and the providers must also still be present
+    if not all(os.path.exists(path) for path in [hash_path, join(terraform_dir, 'terraform.tfstate'), join(terraform_dir, 'plugins')]):
+        return False
+    with open(hash_path, 'r') as fp:
+        return fp.read() == init_hash
+
 def update_template(stackname):
     context = load_context(stackname)
     update(stackname, context)
@@ -11,12 +11,13 @@ it to the correct file etc."""
 
 from collections import OrderedDict
 from os.path import join
+import copy, json
 from . import config, utils, bvars, aws
 from .config import ConfigurationError
 from troposphere import GetAtt, Output, Ref, Template, ec2, rds, sns, sqs, Base64, route53, Parameter, Tags
 from troposphere import s3, cloudfront, elasticloadbalancing as elb, elasticache
 from functools import partial
-from .utils import ensure, subdict, lmap, isstr, deepcopy
+from .utils import ensure, subdict, lmap, isstr
 import logging
 
 LOG = logging.getLogger(__name__)
@@ -170,8 +171,9 @@ def mkoutput(title, desc, val):
 
 def build_vars(context, node):
     """returns a subset of given context data with some extra node information
-    that will be encoded and stored on the ec2 instance at /etc/build-vars.json.b64"""
-    buildvars = deepcopy(context)
+    that will be encoded and stored on the ec2 instance at /etc/build-vars.json.b64.
+    only the top level is copied, the values are shared with `context`"""
+    buildvars = copy.copy(context)
 
     # preseve some of the project data. all of it is too much
     keepers = [
@@ -464,11 +466,8 @@ def render_ec2(context, template):
         if node in suppressed:
             continue
 
-        overridden_context = deepcopy(context)
-        overridden_ec2 = overridden_component(context, 'ec2', index=node, allowed=['type', 'ext'], interesting=['type'])
-        overridden_context['ec2'] = overridden_ec2
-
-        instance = ec2instance(overridden_context, node)
+        node_context = overridden_context(context, 'ec2', index=node, allowed=['type', 'ext'], interesting=['type'])
+        instance = ec2instance(node_context, node)
         ec2_instances[node] = instance
         template.add_resource(instance)
 
@@ -972,14 +971,12 @@ def render_ext(context, template, cluster_size, actual_ec2_instances):
         # backward compatibility: ext is still specified outside of ec2 rather than as a sub-key
         context['ec2']['ext'] = context['ext']
         for node in range(1, cluster_size + 1):
-            overrides = context['ec2'].get('overrides', {}).get(node, {})
-            overridden_context = deepcopy(context)
-            overridden_context['ext'].update(overrides.get('ext', {}))
             # TODO: extract `allowed` variable
-            node_context = overridden_component(context, 'ec2', index=node, allowed=['type', 'ext'])
-            render_ext_volume(overridden_context, node_context.get('ext', {}), template, actual_ec2_instances, node)
+            node_ec2 = overridden_component(context, 'ec2', index=node, allowed=['type', 'ext'])
+            render_ext_volume(context, node_ec2.get('ext', {}), template, actual_ec2_instances, node)
 
-def render(context):
+def _render_template(context):
+    "returns the Troposphere `Template` for the given context"
     template = Template()
 
     ec2_instances = render_ec2(context, template) if context['ec2'] else {}
@@ -1001,7 +998,16 @@ def render(context):
     context['fastly'] and render_fastly(context, template)
     context['elasticache'] and render_elasticache(context, template)
 
-    return template.to_json()
+    return template
+
+def render_data(context):
+    """returns the CloudFormation template for the given context as a dictionary.
+    equivalent to parsing the output of `render`, without serialising and parsing it"""
+    return _render_template(context).to_dict()
+
+def render(context):
+    "returns the CloudFormation template for the given context as JSON, formatted like Troposphere's `Template.to_json`"
+    return json.dumps(render_data(context), indent=4, sort_keys=True, separators=(',', ': '))
 
 def add_outputs(context, template):
     if R53_EXT_TITLE in template.resources.keys():
@@ -1046,20 +1052,29 @@ def _is_domain_2nd_level(hostname):
     return hostname.count(".") == 1
 
 def overridden_component(context, component, index, allowed, interesting=None):
-    "two-level merging of overrides into one of context's components"
+    """two-level merging of overrides into one of context's components.
+    only the component and the values being overridden are copied, everything else is shared with `context`"""
     if not interesting:
         interesting = allowed
     overrides = context[component].get('overrides', {}).get(index, {})
     for element in overrides:
         ensure(element in allowed, "`%s` override is not allowed for `%s` clusters" % (element, component))
-    overridden_context = deepcopy(context)
-    overridden_context[component].pop('overrides', None)
+    overridden = copy.copy(context[component])
+    overridden.pop('overrides', None)
     for key, value in overrides.items():
         if key not in interesting:
             continue
-        assert key in overridden_context[component], "Can't override `%s` as it's not already a key in `%s`" % (key, overridden_context[component].keys())
-        if isinstance(overridden_context[component][key], dict):
-            overridden_context[component][key].update(value)
+        assert key in overridden, "Can't override `%s` as it's not already a key in `%s`" % (key, overridden.keys())
+        if isinstance(overridden[key], dict):
+            overridden[key] = copy.copy(overridden[key])
+            overridden[key].update(value)
         else:
-            overridden_context[component][key] = value
-    return overridden_context[component]
+            overridden[key] = value
+    return overridden
+
+def overridden_context(context, component, index, allowed, interesting=None):
+    """returns a view of the context for a single node (or cluster) with the overrides of one of its components applied.
+    see `overridden_component`. the view shares its values with `context` and must not be modified"""
+    view = copy.copy(context)
+    view[component] = overridden_component(context, component, index, allowed, interesting)
+    return view
@@ -10,6 +10,7 @@ from more_itertools import unique_everseen
 import logging
 from kids.cache import cache as cached
 import tempfile, shutil, copy
+from multiprocessing.pool import ThreadPool
 
 LOG = logging.getLogger(__name__)
 
@@ -31,6 +32,19 @@ def deepcopy(x):
     # return pickle.loads(pickle.dumps(x, -1))
     return copy.deepcopy(x) # very very slow
 
+def pmap(func, lst, max_workers=10):
+    """like `lmap` but calls `func` on each item of `lst` concurrently using a pool of threads.
+    order of results is preserved. intended for network bound work, like S3 or AWS API calls."""
+    items = list(lst)
+    if not items:
+        return []
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
 def isint(v):
     return str(v).lstrip('-+').isdigit()
 
@@ -269,6 +283,20 @@ def listfiles(path, ext_list=None):
         path_list = filter(lambda path: os.path.splitext(path)[1] in ext_list, path_list)
     return sorted(filter(os.path.isfile, path_list))
 
+_READ_FILE_CACHE = {}
+
+def read_file(path):
+    """returns the contents of the file at `path`.
+    the contents are kept in memory and the file is only read again once its modification time or size changes"""
+    stat = os.stat(path)
+    version = (stat.st_mtime, stat.st_size)
+    cached_version, contents = _READ_FILE_CACHE.get(path, (None, None))
+    if cached_version != version:
+        with open(path, 'r') as fp:
+            contents = fp.read()
+        _READ_FILE_CACHE[path] = (version, contents)
+    return contents
+
 def utcnow():
     now = datetime.now()
     return now.replace(tzinfo=pytz.UTC)
@@ -280,7 +308,8 @@ def ymd(dt=None, fmt="%Y-%m-%d"):
     return dt.strftime(fmt)
 
 def mkdir_p(path):
-    os.system("mkdir -p %s" % path)
+    if not os.path.isdir(path):
+        os.system("mkdir -p %s" % path)
     ensure(os.path.isdir(path), "directory couldn't be created: %s" % path)
     ensure(os.access(path, os.W_OK | os.X_OK), "directory isn't writable: %s" % path)
     return path
@@ -1,11 +1,9 @@
-from buildercore.bvars import encode_bvars, read_from_current_host
-from buildercore.command import remote_sudo, upload
-from io import StringIO
+from buildercore.bvars import encode_bvars
 from decorators import requires_aws_stack
 from buildercore.config import BOOTSTRAP_USER
 from buildercore.core import stack_all_ec2_nodes, current_node_id
 from buildercore.context_handler import load_context
-from buildercore import utils as core_utils, trop, keypair
+from buildercore import utils as core_utils, trop, keypair, nodestate
 from buildercore.utils import ensure
 from pprint import pprint
 import utils
@@ -35,17 +33,21 @@ def switch_revision(stackname, revision=None, concurrency=None):
 @requires_aws_stack
 def read(stackname):
     "returns the unencoded build variables found on given instance"
-    return stack_all_ec2_nodes(stackname, lambda: pprint(read_from_current_host()), username=BOOTSTRAP_USER)
+    return stack_all_ec2_nodes(stackname, lambda: pprint(_read_build_vars()), username=BOOTSTRAP_USER)
 
 @requires_aws_stack
 def valid(stackname):
     return stack_all_ec2_nodes(stackname, lambda: pprint(_retrieve_build_vars()), username=BOOTSTRAP_USER)
 
+def _read_build_vars():
+    "returns the buildvars of the current instance or None if it has none, see `nodestate.snapshot`"
+    return nodestate.snapshot(['build-vars'])['build-vars']
+
 def _retrieve_build_vars():
-    """wrapper around `read_from_current_host` with integrity checks. returns buildvars for the current instance.
+    """wrapper around `_read_build_vars` with integrity checks. returns buildvars for the current instance.
     raises AssertionError on bad data."""
     try:
-        buildvars = read_from_current_host()
+        buildvars = _read_build_vars()
         LOG.debug('build vars: %s', buildvars)
 
         # buildvars exist
@@ -87,7 +89,8 @@ def fix(stackname):
 def force(stackname, field, value):
     "replace a specific key with a new value in the buildvars for all ec2 instances in stack"
     def _force_single_ec2_node():
-        buildvars = read_from_current_host()
+        buildvars = _read_build_vars()
+        ensure(buildvars is not None, 'build vars not found. use `./bldr buildvars.fix` to attempt to fix this.')
 
         new_vars = buildvars.copy()
         new_vars[field] = value
@@ -102,10 +105,8 @@ def _update_remote_bvars(stackname, buildvars):
     #ensure(core_utils.hasallkeys(buildvars, ['revision']), "buildvars missing key 'revision'")
 
     encoded = encode_bvars(buildvars)
-    fid = core_utils.ymd(fmt='%Y%m%d%H%M%S')
-    # make a backup
-    remote_sudo('if [ -f /etc/build-vars.json.b64 ]; then cp /etc/build-vars.json.b64 /tmp/build-vars.json.b64.%s; fi;' % fid)
-    upload(StringIO(encoded), "/etc/build-vars.json.b64", use_sudo=True)
+    # the existing file is backed up to /tmp/
+    nodestate.write_files([(nodestate.BUILD_VARS_PATH, encoded)], backup=True)
     LOG.info("%r updated", stackname)
 
 #
@@ -1,16 +1,16 @@
-import os
+import os, json
 from distutils.util import strtobool as _strtobool  # pylint: disable=import-error,no-name-in-module
 from pprint import pformat
 import backoff
 from buildercore.command import local, remote, remote_sudo, upload, download, settings, remote_file_exists, CommandException, NetworkError
 import utils, buildvars
-from decorators import requires_project, requires_aws_stack, echo_output, setdefault, timeit
+from decorators import requires_project, requires_aws_stack, setdefault, timeit
 from buildercore import core, cfngen, utils as core_utils, bootstrap, project, checks, lifecycle as core_lifecycle, context_handler
 # potentially remove to go through buildercore.bootstrap?
-from buildercore import cloudformation, terraform
+from buildercore import cloudformation, terraform, inventory
 from buildercore.concurrency import concurrency_for
 from buildercore.core import stack_conn, stack_pem, stack_all_ec2_nodes, tags2dict
-from buildercore.decorators import PredicateException
+from buildercore.decorators import PredicateException, echo_output
 from buildercore.config import DEPLOY_USER, BOOTSTRAP_USER, USER_PRIVATE_KEY
 from buildercore.utils import lmap, ensure
 
@@ -110,6 +110,46 @@ def update_infrastructure(stackname, skip=None, start=['ec2']):
     if context.get('s3', {}) and not 's3' in skip:
         bootstrap.update_stack(stackname, service_list=['s3'])
 
+def _report_changes(summarise_fn, selector, concurrency, **kwargs):
+    """calls `summarise_fn` with the active stacks matching `selector` (all of them by default) and `concurrency`.
+    prints and returns the summaries, see `utils.select_stacks`"""
+    region = utils.find_region()
+    stack_list_fn = lambda: inventory.active_stack_names(region)
+    stackname_list = utils.select_stacks(selector, stack_list_fn) if selector else stack_list_fn()
+    summaries = summarise_fn(stackname_list, int(concurrency), **kwargs)
+    print(json.dumps(summaries, indent=4))
+    return summaries
+
+def infrastructure_changes(selector=None, concurrency=4, incremental=False):
+    """Reports the CloudFormation changes `update_infrastructure` would make to each active stack, without making them.
+
+    `selector` restricts the stacks checked, for example `selector=journal\\,*--prod`. See `BLDR_STACKS`.
+
+    `incremental=true` only rebuilds the parts of each context whose project data has changed since the report was
+    last run on this machine. Faster across many stacks, but a change to the project data it doesn't track is missed.
+
+    Prints a JSON list with the titles of the resources, outputs and parameters that would be created ('plus'),
+    updated ('edit') and deleted ('minus') for each stack. Terraform templates are not compared."""
+    return _report_changes(cfngen.stacks_delta_summary, selector, concurrency, incremental=strtobool(incremental))
+
+def terraform_changes(selector=None, concurrency=4):
+    """Reports the Terraform changes `update_infrastructure` would make to each active stack, without making them.
+
+    `selector` restricts the stacks checked, for example `selector=journal--*`. See `BLDR_STACKS`.
+
+    Stacks are planned concurrently, each in its own directory under `.cfn/terraform/`. Prints a JSON list with the
+    resources that would be created ('plus'), updated ('edit', with the changed attributes) and deleted ('minus')
+    for each stack."""
+    return _report_changes(cfngen.stacks_terraform_plan, selector, concurrency)
+
+@requires_aws_stack
+@echo_output
+def template_size(stackname):
+    """Reports the size of the stack's CloudFormation template, as rendered and as sent to CloudFormation.
+
+    Templates larger than the limit on inline templates are uploaded to the builder bucket when the stack is created or updated."""
+    return cloudformation.template_size(stackname)
+
 @requires_project
 def generate_stack_from_input(pname, instance_id=None, alt_config=None):
     """creates a new CloudFormation file for the given project."""
@@ -0,0 +1,438 @@
+"""Keeps a builder process resident so `./bldr` invocations don't pay for starting up.
+
+The daemon imports every task module, loads the project map and lists the stacks once, then listens on a Unix
+socket. Each request is handled by a forked child process that inherits this warm state, including the boto3
+clients, and runs the task with its stdin, stdout and stderr connected to the client, see `client`.
+
+    ./bldr daemon.start   # runs in the foreground. use another terminal, tmux, a process supervisor, etc
+    ./bldr ... < input    # tasks run without a terminal are now sent to the daemon
+    ./bldr daemon.stop
+
+Tasks run from a terminal are not sent to the daemon, it can't give them one to prompt the user or open a shell
+with. SIGINT (Ctrl-C) and SIGTERM received by the client are relayed to the task.
+
+SSH connections are not kept warm: they are opened by the task in the child and closed when it finishes.
+
+The daemon only serves the user that started it. Configuration read from the environment when modules are
+imported (credentials, CUSTOM_SSH_KEY, etc) is fixed when the daemon starts. Set BLDR_DAEMON=0 to bypass it."""
+
+# this module is imported by `taskrunner` for every `./bldr` invocation to find a running daemon.
+# the client must stay light, so the modules the daemon itself needs are only imported once it is started.
+import os, sys, json, socket, select, time, errno, importlib, traceback, signal
+from contextlib import contextmanager
+from buildercore.utils import ensure
+import taskrunner
+import logging
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_PATH = os.path.join(os.getcwd(), '.cfn', 'bldr.sock')
+
+# follows the output of a task and precedes its return code
+EXIT_MARKER = b'\x00bldr-daemon-exit:'
+
+# precedes the process id of the task, sent before any of its output
+PID_MARKER = b'\x00bldr-daemon-pid:'
+
+# stack listings older than this, in seconds, are refreshed before the next task is run
+STACK_REFRESH_INTERVAL = 60
+
+#
+# client
+#
+
+def _connect(socket_path):
+    "returns a socket connected to the daemon listening on `socket_path` or None if no daemon is listening"
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return sock
+    except socket.error:
+        # a socket left behind by a daemon that was killed
+        sock.close()
+        return None
+
+def _partial_marker_length(data):
+    "returns the length of the longest end of `data` that is the start of `EXIT_MARKER`"
+    for length in range(min(len(data), len(EXIT_MARKER) - 1), 0, -1):
+        if data.endswith(EXIT_MARKER[:length]):
+            return length
+    return 0
+
+def _response(sock, write, forward_stdin=False, pending=b''):
+    """writes the output of a request to `write` as it arrives, optionally sending our stdin to the daemon.
+    `pending` is output already read from `sock`. returns the return code of the request"""
+    readers = [sock]
+    if forward_stdin:
+        try:
+            stdin_fd = sys.stdin.fileno()
+            readers.append(stdin_fd)
+        except (AttributeError, ValueError):
+            # stdin is closed or has been replaced with something that isn't a file
+            pass
+    while True:
+        try:
+            readable, _, _ = select.select(readers, [], [])
+        except select.error as err:
+            # python 2 doesn't retry calls interrupted by a signal, see `_relay_signals`
+            if err.args[0] == errno.EINTR:
+                continue
+            raise
+        if len(readers) > 1 and stdin_fd in readable:
+            data = os.read(stdin_fd, 4096)
+            if data:
+                sock.sendall(data)
+            else:
+                sock.shutdown(socket.SHUT_WR)
+                readers.remove(stdin_fd)
+        if sock in readable:
+            chunk = sock.recv(4096)
+            data = pending + chunk
+            if EXIT_MARKER in data:
+                output, rc = data.split(EXIT_MARKER, 1)
+                write(output)
+                # the return code is short and sent in a single write, but may still be split across reads
+                while not rc.endswith(b'\n'):
+                    chunk = sock.recv(64)
+                    if not chunk:
+                        break
+                    rc += chunk
+                return int(rc.strip() or 1)
+            if not chunk:
+                write(data)
+                write(b"builder daemon closed the connection unexpectedly\n")
+                return 1
+            # hold back the start of the marker, if that's how the data ends.
+            # anything else is written immediately, the task may be waiting for input after it
+            split = len(data) - _partial_marker_length(data)
+            write(data[:split])
+            pending = data[split:]
+
+def _read_task_pid(sock):
+    """reads the process id the daemon sends before running a task.
+    returns a pair of (pid, output), where `output` is anything else that was read, like a bad request message"""
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(1)
+        if not chunk:
+            break
+        data += chunk
+    if data.startswith(PID_MARKER):
+        return int(data[len(PID_MARKER):]), b''
+    return None, data
+
+@contextmanager
+def _relay_signals(pid):
+    """sends the SIGINT and SIGTERM this process receives to the process group of the task `pid`.
+    Ctrl-C cancels the task in the daemon just as it would if the task was run by this process"""
+    def relay(signum, _):
+        try:
+            os.killpg(pid, signum)
+        except OSError:
+            # the task has already finished
+            pass
+    previous = {signum: signal.signal(signum, relay) for signum in [signal.SIGINT, signal.SIGTERM]}
+    try:
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+def send_request(request, socket_path=SOCKET_PATH, task=False):
+    """sends the `request` to the daemon, writing its output to stdout.
+    a `task` request also sends our stdin to the daemon and relays our signals to the task.
+    returns the return code of the request or None if no daemon is listening"""
+    sock = _connect(socket_path)
+    if not sock:
+        return None
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def write(data):
+        stdout.write(data)
+        stdout.flush()
+    try:
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        if not task:
+            return _response(sock, write)
+        pid, pending = _read_task_pid(sock)
+        if pid is None:
+            return _response(sock, write, pending=pending)
+        with _relay_signals(pid):
+            return _response(sock, write, forward_stdin=True)
+    finally:
+        sock.close()
+
+def server_status(socket_path=SOCKET_PATH):
+    "returns a map of information about the daemon listening on `socket_path` or None if no daemon is listening"
+    sock = _connect(socket_path)
+    if not sock:
+        return None
+    output = []
+    try:
+        sock.sendall(json.dumps({'control': 'status'}).encode() + b'\n')
+        _response(sock, output.append)
+    except socket.error:
+        # the daemon is stopping
+        return None
+    finally:
+        sock.close()
+    return json.loads(b''.join(output).decode())
+
+def _interactive():
+    "returns True if our stdin is a terminal"
+    try:
+        return sys.stdin.isatty()
+    except (AttributeError, ValueError):
+        # stdin is closed or has been replaced with something that isn't a file
+        return False
+
+def client(command_string, socket_path=SOCKET_PATH):
+    """executes the command in the builder daemon, if one is running, with our environment and standard streams.
+    returns the return code of the command or None if it must be executed by this process.
+
+    the daemon's own tasks and anything run from a terminal are never sent to the daemon.
+    it can't give a task a terminal to prompt the user or open a shell with."""
+    if command_string.startswith('daemon.') or _interactive():
+        return None
+    request = {
+        'command': command_string,
+        'env': dict(os.environ),
+    }
+    return send_request(request, socket_path, task=True)
+
+#
+# server
+#
+
+def stack_caches():
+    "cached functions whose results depend on the stacks that exist. cleared whenever stacks are refreshed"
+    from buildercore import core, bootstrap
+    import master
+    return [
+        core._aws_stacks,
+        bootstrap.master_data,
+        master._cached_master_ip,
+    ]
+
+def project_caches():
+    "cached functions whose results depend on the project files. cleared whenever a project file changes"
+    from buildercore import config, project
+    from buildercore.project import files as project_files
+    return [
+        config.app,
+        project.project_map,
+        project_files.all_projects,
+    ]
+
+def project_files_mtime():
+    "returns the most recent modification time of the project files, or None if there are none"
+    from buildercore import config
+    paths = [path for protocol, _, path in config.app()['project-locations'] if protocol == 'file']
+    mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+    return max(mtimes) if mtimes else None
+
+def refresh_projects():
+    "discards the project data and loads it again"
+    from buildercore import project
+    for fn in project_caches():
+        fn.cache_clear()
+    project.project_map()
+
+def refresh_stacks():
+    "discards the stack listings and lists the stacks again"
+    from buildercore import core
+    for fn in stack_caches():
+        fn.cache_clear()
+    try:
+        region = core.find_region()
+        core.active_aws_stacks(region)
+        core.steady_aws_stacks(region)
+    except Exception as err:
+        # no credentials, no network, multiple regions, etc. tasks will list the stacks themselves
+        LOG.warning("failed to list stacks: %s", err)
+
+def warm():
+    "imports every task module and loads the data most tasks need"
+    for task_map in taskrunner.generate_task_list(show_debug_tasks=True):
+        importlib.import_module(task_map['path'].rsplit('.', 1)[0])
+    refresh_projects()
+    refresh_stacks()
+
+def _read_request(conn):
+    "reads the single line of JSON sent by the client"
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        ensure(chunk, "client disconnected before sending a request")
+        data += chunk
+    return json.loads(data.decode())
+
+def _respond(conn, rc, message=None):
+    "sends a message and return code to the client and closes the connection"
+    try:
+        if message:
+            conn.sendall(message.encode() + b'\n')
+        conn.sendall(EXIT_MARKER + str(rc).encode() + b'\n')
+    finally:
+        conn.close()
+
+def _fork():
+    """forks a child process that keeps the daemon's boto3 clients.
+    their pooled connections are closed first, a connection can't be shared by two processes"""
+    from buildercore import core
+    core.close_boto_pools()
+    pid = os.fork()
+    if pid == 0:
+        core.adopt_boto_conns()
+    return pid
+
+def _run_request(conn, request):
+    "executed in the forked child. runs the requested command with the client's environment and standard streams"
+    rc = 1
+    try:
+        os.environ.clear()
+        os.environ.update(request['env'])
+        # the task must not be sent back to the daemon
+        os.environ['BLDR_DAEMON'] = '0'
+        # the client relays the signals it receives to this process group, see `_relay_signals`
+        os.setpgrp()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        conn.sendall(PID_MARKER + str(os.getpid()).encode() + b'\n')
+        for fd in [0, 1, 2]:
+            os.dup2(conn.fileno(), fd)
+        rc = taskrunner.main([request['command']])
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _respond(conn, rc)
+        finally:
+            # the child must never return to the daemon's loop, whatever happens
+            os._exit(rc)
+
+def _reap_children(children):
+    "removes finished child processes from the set of `children`. returns the number of children reaped"
+    reaped = 0
+    for pid in list(children):
+        try:
+            finished_pid, _ = os.waitpid(pid, os.WNOHANG)
+        except OSError as err:
+            if err.errno != errno.ECHILD:
+                raise
+            finished_pid = pid
+        if finished_pid:
+            children.discard(pid)
+            reaped += 1
+    return reaped
+
+def _listen(socket_path):
+    "returns a socket listening on `socket_path`, readable and writable by the current user only"
+    ensure(server_status(socket_path) is None, "a daemon is already listening on %r" % socket_path)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path) # stale, left behind by a daemon that was killed
+    if not os.path.exists(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    server.settimeout(1)
+    return server
+
+def serve(socket_path=SOCKET_PATH, warm_caches=True):
+    "listens for requests on `socket_path` until a 'stop' request is received"
+    # importing `buildercore.config` also configures logging
+    importlib.import_module('buildercore.config')
+    if warm_caches:
+        warm()
+    server = _listen(socket_path)
+    LOG.info("builder daemon listening on %s", socket_path)
+
+    children = set()
+    stacks_refreshed = time.time()
+    stacks_stale = False
+    projects_mtime = project_files_mtime() if warm_caches else None
+    try:
+        while True:
+            # tasks may have created, updated or destroyed stacks
+            if _reap_children(children):
+                stacks_stale = True
+
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+
+            try:
+                request = _read_request(conn)
+            except Exception as err:
+                LOG.warning("bad request: %s", err)
+                _respond(conn, 1, "bad request: %s" % err)
+                continue
+
+            control = request.get('control')
+            if control == 'status':
+                _respond(conn, 0, json.dumps({'pid': os.getpid(), 'running-tasks': len(children)}))
+                continue
+            if control == 'stop':
+                _respond(conn, 0, "stopping builder daemon")
+                break
+
+            if warm_caches and project_files_mtime() != projects_mtime:
+                LOG.info("project files changed, reloading")
+                refresh_projects()
+                projects_mtime = project_files_mtime()
+
+            # stacks are only listed again when a task is about to be run, never while the daemon is idle
+            if warm_caches and (stacks_stale or time.time() - stacks_refreshed > STACK_REFRESH_INTERVAL):
+                refresh_stacks()
+                stacks_refreshed = time.time()
+                stacks_stale = False
+
+            LOG.info("running %r", request.get('command'))
+            pid = _fork()
+            if pid == 0:
+                server.close()
+                _run_request(conn, request) # never returns
+            conn.close()
+            children.add(pid)
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # running tasks are left to finish
+        _reap_children(children)
+        LOG.info("builder daemon stopped, %s tasks still running", len(children))
+
+#
+# tasks
+#
+
+def start():
+    "starts the builder daemon in the foreground. `./bldr` sends tasks to it while it is running"
+    serve()
+
+def stop():
+    "stops the builder daemon. running tasks are left to finish"
+    if server_status() is None:
+        print("builder daemon is not running")
+        return
+    send_request({'control': 'stop'})
+
+def status():
+    "reports whether the builder daemon is running"
+    status_map = server_status()
+    if status_map is None:
+        print("builder daemon is not running")
+    else:
+        print("builder daemon running with pid %(pid)s, %(running-tasks)s tasks running" % status_map)
+    return status_map
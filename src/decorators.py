@@ -1,10 +1,9 @@
 import os
 from os.path import join
 import utils
-from buildercore import core, project, config
-from buildercore.utils import first, remove_ordereddict, errcho, lfilter, lmap, isstr
+from buildercore import core, project, config, inventory
+from buildercore.utils import first, lfilter, lmap
 from functools import wraps
-from pprint import pformat
 import logging
 
 LOG = logging.getLogger(__name__)
@@ -46,6 +45,14 @@ def requires_filtered_project(filterfn=None):
 # pylint: disable=invalid-name
 requires_project = requires_filtered_project(None)
 
+def _inventory_stacks(region, status, stackname=None):
+    """returns a list of (stackname, status, data) triples from the local inventory of stacks.
+    the inventory is refreshed if the given `stackname` isn't present, it may have been created since"""
+    stack_list = inventory.stacks(region, status)
+    if stackname and stackname not in lmap(first, stack_list):
+        stack_list = inventory.stacks(region, status, max_age=0)
+    return stack_list
+
 def requires_aws_project_stack(*plist):
     if not plist:
         plist = [utils._pick("project", project.project_list(), default_file=deffile('.project'))]
@@ -54,7 +61,7 @@ def requires_aws_project_stack(*plist):
         @wraps(func)
         def _wrapper(stackname=None, *args, **kwargs):
             region = utils.find_region(stackname)
-            asl = core.active_stack_names(region)
+            asl = core.stack_names(_inventory_stacks(region, core.ACTIVE_CFN_STATUS, stackname))
             if not asl:
                 print('\nno AWS stacks exist, cannot continue.')
                 return
@@ -74,11 +81,10 @@ def requires_aws_stack(func):
     @wraps(func)
     def call(*args, **kwargs):
         stackname = first(args) or os.environ.get('INSTANCE')
-        region = utils.find_region(stackname)
         if stackname:
             args = args[1:]
             return func(stackname, *args, **kwargs)
-        asl = core.active_stack_names(region)
+        asl = inventory.active_stack_names(utils.find_region())
         if not asl:
             raise RuntimeError('\nno AWS stacks *in an active state* exist, cannot continue.')
         if not stackname or stackname not in asl:
@@ -103,15 +109,3 @@ def requires_steady_stack(func):
         return func(stackname, *args[1:], **kwargs)
     return call
 
-def echo_output(func):
-    "pretty-prints the return value of the task(s) being run to stdout"
-    @wraps(func)
-    def _wrapper(*args, **kwargs):
-        res = func(*args, **kwargs)
-        errcho('output:') # printing to stderr avoids corrupting structured data
-        if isstr(res):
-            print(res)
-        else:
-            print(pformat(remove_ordereddict(res)))
-        return res
-    return _wrapper
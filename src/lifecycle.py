@@ -1,5 +1,6 @@
 from buildercore import lifecycle
-from decorators import requires_aws_stack, timeit, echo_output
+from decorators import requires_aws_stack, timeit
+from buildercore.decorators import echo_output
 
 @requires_aws_stack
 @timeit
@@ -6,8 +6,9 @@ import os, time
 import buildvars, utils
 from buildercore.command import remote_sudo, local
 from buildercore import core, bootstrap, config, keypair, project, cfngen, context_handler
-from buildercore.utils import lmap, exsubdict, mkidx
-from decorators import echo_output, requires_aws_stack
+from buildercore.utils import lmap, exsubdict, mkidx, ensure
+from decorators import requires_aws_stack
+from buildercore.decorators import echo_output
 from kids.cache import cache as cached
 import logging
 
@@ -69,7 +70,9 @@ def server_access():
 @cached
 def _cached_master_ip(master_stackname):
     "provides a small time saving when remastering many minions"
-    return core.stack_data(master_stackname)[0]['PrivateIpAddress']
+    master_ip = core.stack_node_ip(master_stackname)
+    ensure(master_ip, "master server %r has no running instance" % master_stackname)
+    return master_ip
 
 @requires_aws_stack
 def remaster(stackname, new_master_stackname):
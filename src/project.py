@@ -2,7 +2,8 @@ import os
 from buildercore.command import local, settings
 from buildercore import project, utils as core_utils, core, cfngen, config
 from buildercore.utils import ensure
-from decorators import requires_project, echo_output
+from decorators import requires_project
+from buildercore.decorators import echo_output
 import utils
 
 @requires_project
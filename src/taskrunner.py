@@ -1,8 +1,11 @@
-import sys, os, traceback
-import cfn, lifecycle, masterless, vault, aws, metrics, tasks, master, askmaster, buildvars, project, deploy
-from buildercore import command
-from decorators import echo_output
+import sys, os, traceback, ast, importlib, time
+from multiprocessing import Process, Queue
 from functools import reduce
+from buildercore.decorators import echo_output
+
+# task modules are only imported when one of their tasks is executed.
+# importing them pulls in boto3, troposphere, fabric, etc, which is slow and unnecessary for listing tasks or trivial tasks.
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
 
 @echo_output
 def ping():
@@ -20,106 +23,144 @@ def echo(msg, *args, **kwargs):
 UNQUALIFIED_TASK_LIST = [
     ping, echo,
 
-    cfn.destroy,
-    cfn.ensure_destroyed,
-    cfn.update,
-    cfn.update_infrastructure,
-    cfn.launch,
-    cfn.ssh,
-    cfn.owner_ssh,
-    cfn.download_file,
-    cfn.upload_file,
-    cfn.cmd,
-
-    deploy.switch_revision_update_instance,
-
-    lifecycle.start,
-    lifecycle.stop,
-    lifecycle.restart,
-    lifecycle.stop_if_running_for,
-    lifecycle.update_dns,
+    'cfn.destroy',
+    'cfn.ensure_destroyed',
+    'cfn.update',
+    'cfn.update_infrastructure',
+    'cfn.infrastructure_changes',
+    'cfn.terraform_changes',
+    'cfn.template_size',
+    'cfn.launch',
+    'cfn.ssh',
+    'cfn.owner_ssh',
+    'cfn.download_file',
+    'cfn.upload_file',
+    'cfn.cmd',
+
+    'deploy.switch_revision_update_instance',
+
+    'lifecycle.start',
+    'lifecycle.stop',
+    'lifecycle.restart',
+    'lifecycle.stop_if_running_for',
+    'lifecycle.update_dns',
 ]
 
 # these are 'qualified' tasks where the full path to the function must be used
 # for example: './bldr buildvars.switch_revision'
 TASK_LIST = [
-    metrics.regenerate_results, # todo: remove
-
-    tasks.create_ami,
-    tasks.repair_cfn_info,
-    tasks.repair_context,
-    tasks.remove_minion_key,
-    tasks.restart_all_running_ec2,
-
-    master.update,
-
-    askmaster.fail2ban_running,
-    askmaster.installed_linux_kernel,
-    askmaster.linux_distro,
-    askmaster.update_kernel,
-
-    buildvars.switch_revision,
-
-    project.data,
-    project.context,
-    project.new,
-
-    masterless.launch,
-    masterless.set_versions,
-
-    vault.login,
-    vault.logout,
-    vault.policies_update,
-    vault.token_lookup,
-    vault.token_list_accessors,
-    vault.token_lookup_accessor,
-    vault.token_create,
-    vault.token_revoke,
+    'metrics.regenerate_results', # todo: remove
+
+    'daemon.start',
+    'daemon.stop',
+    'daemon.status',
+
+    'tasks.create_ami',
+    'tasks.repair_cfn_info',
+    'tasks.repair_context',
+    'tasks.sync_contexts',
+    'tasks.refresh_inventory',
+    'tasks.remove_minion_key',
+    'tasks.restart_all_running_ec2',
+
+    'master.update',
+
+    'askmaster.fail2ban_running',
+    'askmaster.installed_linux_kernel',
+    'askmaster.linux_distro',
+    'askmaster.update_kernel',
+
+    'buildvars.switch_revision',
+
+    'project.data',
+    'project.context',
+    'project.new',
+
+    'masterless.launch',
+    'masterless.set_versions',
+
+    'vault.login',
+    'vault.logout',
+    'vault.policies_update',
+    'vault.token_lookup',
+    'vault.token_list_accessors',
+    'vault.token_lookup_accessor',
+    'vault.token_create',
+    'vault.token_revoke',
 ]
 
 # 'debug' tasks are those that are available when the environment variable BLDR_ROLE is set to 'admin'
 # this list of debug tasks don't require the full path to be used
 # for example: 'BLDR_ROLE=admin ./bldr highstate' will execute the 'highstate' task
 UNQUALIFIED_DEBUG_TASK_LIST = [
-    cfn.highstate,
-    cfn.pillar,
-    cfn.aws_stack_list,
+    'cfn.highstate',
+    'cfn.pillar',
+    'cfn.aws_stack_list',
 ]
 
 # same as above, but the task name must be fully written out
 # for example: 'BLDR_ROLE=admin ./bldr master.download_keypair'
 DEBUG_TASK_LIST = [
-    aws.rds_snapshots,
-    aws.detailed_stack_list,
+    'aws.rds_snapshots',
+    'aws.detailed_stack_list',
 
-    tasks.diff_builder_config,
+    'tasks.diff_builder_config',
 
-    deploy.load_balancer_status,
-    deploy.load_balancer_register_all,
+    'deploy.load_balancer_status',
+    'deploy.load_balancer_register_all',
 
-    master.write_missing_keypairs_to_s3,
-    master.download_keypair,
-    master.server_access,
-    master.remaster,
-    master.update_salt,
-    master.update_salt_master,
-    master.remaster_all,
+    'master.write_missing_keypairs_to_s3',
+    'master.download_keypair',
+    'master.server_access',
+    'master.remaster',
+    'master.update_salt',
+    'master.update_salt_master',
+    'master.remaster_all',
 
-    buildvars.read,
-    buildvars.valid,
-    buildvars.fix,
-    buildvars.force,
+    'buildvars.read',
+    'buildvars.valid',
+    'buildvars.fix',
+    'buildvars.force',
 
-    project.clone_project_formulas,
-    project.clone_all_project_formulas,
+    'project.clone_project_formulas',
+    'project.clone_all_project_formulas',
 ]
 
+_DOCSTRINGS = {}
+
+def task_docstrings(module_name):
+    """returns a map of function names to docstrings for the given task module.
+    the module's source is parsed rather than imported."""
+    if module_name not in _DOCSTRINGS:
+        with open(os.path.join(SRC_PATH, module_name + ".py"), 'r') as fh:
+            tree = ast.parse(fh.read())
+        _DOCSTRINGS[module_name] = {
+            node.name: ast.get_docstring(node, clean=False)
+            for node in tree.body if isinstance(node, ast.FunctionDef)
+        }
+    return _DOCSTRINGS[module_name]
+
+def lazy_task(module_name, task_name):
+    "returns a function that imports the module of a task and calls the task only when it is itself called"
+    def _wrapper(*args, **kwargs):
+        task = getattr(importlib.import_module(module_name), task_name)
+        return task(*args, **kwargs)
+    _wrapper.__name__ = task_name
+    return _wrapper
+
 def mk_task_map(task, qualified=True):
-    """returns a map of information about the given task function.
+    """returns a map of information about the given task function or task path (e.g. 'cfn.launch').
     when `qualified` is `False`, the path to the task is truncated to just the task name"""
-    path = "%s.%s" % (task.__module__.split('.')[-1], task.__name__)
-    unqualified_path = task.__name__
-    description = (task.__doc__ or '').strip().replace('\n', ' ')
+    if callable(task):
+        path = "%s.%s" % (task.__module__.split('.')[-1], task.__name__)
+        unqualified_path = task.__name__
+        docstring = task.__doc__
+    else:
+        path = task
+        module_name, unqualified_path = task.rsplit('.', 1)
+        docstring = task_docstrings(module_name).get(unqualified_path)
+        task = lazy_task(module_name, unqualified_path)
+    description = (docstring or '').strip().replace('\n', ' ')
     return {
         "name": path if qualified else unqualified_path,
         "path": path,
@@ -228,11 +269,98 @@ def exec_task(task_str, task_map_list):
         print('exception while executing task %r: %s\n' % (task_name, str(e)))
         print(traceback.format_exc())
         return_map['rc'] = 2 # arbitrary
+        return_map['error'] = str(e)
         return return_map
 
     finally:
-        # close any outstanding network connections
-        command.network_disconnect_all()
+        # trivial tasks never import these modules, no need to import them now
+        if 'buildercore.command' in sys.modules:
+            # close any outstanding network connections
+            sys.modules['buildercore.command'].network_disconnect_all()
+        if 'buildercore.instrumentation' in sys.modules:
+            # summarise the AWS API calls made by the task at DEBUG. BLDR_AWS_STATS=json writes them to stderr as JSON
+            sys.modules['buildercore.instrumentation'].report(as_json=os.environ.get("BLDR_AWS_STATS") == "json")
+
+# --- multi-stack execution
+
+def stack_task_str(task_str, stackname):
+    "returns the given task string with `stackname` as the task's first argument"
+    if ':' in task_str:
+        task_name, argstr = task_str.split(':', 1)
+        return "%s:%s,%s" % (task_name, stackname, argstr)
+    return "%s:%s" % (task_str, stackname)
+
+def _summarise_result(stackname, return_map):
+    "the parts of a task's `return_map` that are safe to pass between processes. the task's result may not be picklable"
+    return {
+        'stackname': stackname,
+        'rc': return_map['rc'],
+        'error': return_map.get('error'),
+    }
+
+def _exec_stack_task_worker(task_str, stackname, show_debug_tasks, queue):
+    "executed in another process. runs the task against a single stack and puts a summary of the result on the queue"
+    try:
+        return_map = exec_task(stack_task_str(task_str, stackname), generate_task_list(show_debug_tasks))
+        queue.put(_summarise_result(stackname, return_map))
+    except BaseException as e:
+        queue.put({'stackname': stackname, 'rc': 2, 'error': str(e)})
+
+def exec_task_on_stacks(task_str, stack_list, concurrency=1, show_debug_tasks=False):
+    """executes the task in `task_str` against each stack in `stack_list`, passing the stackname as the first argument.
+    when `concurrency` is 1 the stacks are processed serially within this process.
+    otherwise up to `concurrency` child processes are forked, each inheriting the loaded task modules, project data, etc.
+    returns a list of results, one per stack, in the order of `stack_list`."""
+    if concurrency < 1:
+        raise ValueError("concurrency must be a positive integer, not %r" % concurrency)
+
+    if concurrency == 1:
+        task_map_list = generate_task_list(show_debug_tasks)
+        return [_summarise_result(stackname, exec_task(stack_task_str(task_str, stackname), task_map_list))
+                for stackname in stack_list]
+
+    results_q = Queue()
+    results = {}
+    pending = list(stack_list)
+    running = {}
+    while pending or running:
+        while pending and len(running) < concurrency:
+            stackname = pending.pop(0)
+            p = Process(name=stackname, target=_exec_stack_task_worker,
+                        args=(task_str, stackname, show_debug_tasks, results_q))
+            p.start()
+            running[stackname] = p
+
+        # results are read as they arrive. a child process may not exit until its queued data has been consumed
+        while not results_q.empty():
+            result = results_q.get()
+            results[result['stackname']] = result
+
+        for stackname, p in list(running.items()):
+            if not p.is_alive():
+                p.join()
+                del running[stackname]
+        # introduces the slightest of delays so that we're not manically polling
+        time.sleep(0.1)
+
+    while not results_q.empty():
+        result = results_q.get()
+        results[result['stackname']] = result
+    results_q.close()
+
+    # a process that died without reporting (killed, segfault, etc) is a failure
+    default = lambda stackname: {'stackname': stackname, 'rc': 2, 'error': 'process exited without a result'}
+    return [results.get(stackname) or default(stackname) for stackname in stack_list]
+
+def print_stack_summary(results):
+    "prints a summary of the results of `exec_task_on_stacks`. failures are listed last"
+    failures = [result for result in results if result['rc'] != 0]
+    print("\n%s of %s stacks succeeded" % (len(results) - len(failures), len(results)))
+    for result in results:
+        if result['rc'] == 0:
+            print("    ok      %s" % result['stackname'])
+    for result in failures:
+        print("    failed  %s (rc %s) %s" % (result['stackname'], result['rc'], result['error'] or ''))
 
 def main(arg_list):
     show_debug_tasks = os.environ.get("BLDR_ROLE") == "admin"
@@ -266,6 +394,31 @@ def main(arg_list):
         # no explicit invocation of help gets you an error code
         return 0 if command_string else 1
 
+    # sent to the builder daemon if one is running, unless BLDR_DAEMON=0. see `daemon.client`
+    if os.environ.get("BLDR_DAEMON") != "0":
+        import daemon
+        rc = daemon.client(command_string)
+        if rc is not None:
+            return rc
+
+    # BLDR_STACKS=journal--*,@stacks.txt ./bldr buildvars.fix
+    # executes the task against every selected stack, see `utils.select_stacks`.
+    stack_selector = os.environ.get("BLDR_STACKS")
+    if stack_selector:
+        def active_stacks():
+            from buildercore import core, inventory
+            return inventory.active_stack_names(core.find_region())
+        import utils
+        stack_list = utils.select_stacks(stack_selector, active_stacks)
+        if not stack_list:
+            print("no stacks matching %r" % stack_selector)
+            return 1
+        # BLDR_CONCURRENCY=4 processes up to four stacks at a time
+        concurrency = int(os.environ.get("BLDR_CONCURRENCY") or 1)
+        results = exec_task_on_stacks(command_string, stack_list, concurrency, show_debug_tasks)
+        print_stack_summary(results)
+        return max(result['rc'] for result in results)
+
     task_result = exec_task(command_string, task_map_list)
     return task_result['rc']
 
@@ -4,7 +4,7 @@ If you find certain 'types' of tasks accumulating, they might be
 better off in their own module. This module really is for stuff
 that has no home."""
 import os
-from buildercore import core, bootstrap, bakery, lifecycle
+from buildercore import core, bootstrap, bakery, lifecycle, context_handler, inventory
 from buildercore.command import local
 from utils import confirm, errcho, get_input
 from decorators import requires_aws_stack
@@ -54,6 +54,15 @@ def repair_context(stackname):
     # triggers the workaround of downloading it from EC2 and persisting it
     load_context(stackname)
 
+def sync_contexts():
+    "downloads all new and changed contexts from S3 into the local context directory"
+    updated = context_handler.sync_all()
+    print("%s contexts updated" % len(updated))
+
+def refresh_inventory():
+    "refreshes the local inventory of stacks and instances used to find and pick stacks"
+    inventory.refresh(core.find_region(), max_age=0)
+
 @requires_aws_stack
 def remove_minion_key(stackname):
     bootstrap.remove_minion_key(stackname)
@@ -189,3 +189,128 @@ class Primitives(base.BaseCase):
             ],
         }
         self.concurrency.wait_deregistered_all('dummy1-ElasticL-ABCDEFGHI', nodes_params)
+
+class Waves(base.BaseCase):
+    def setUp(self):
+        patcher = patch('buildercore.bluegreen.boto_client')
+        self.addCleanup(patcher.stop)
+        elb_conn_factory = patcher.start()
+        self.conn = MagicMock()
+        elb_conn_factory.return_value = self.conn
+        self.nodes_params = {
+            'nodes': {'i-1000000%s' % n: n for n in range(1, 6)},
+            'public_ips': {'i-1000000%s' % n: '127.0.0.%s' % n for n in range(1, 6)},
+            'stackname': 'dummy1--test',
+        }
+
+    def test_divide_in_waves(self):
+        concurrency = bluegreen.WaveConcurrency('us-east-1', wave_size=2)
+        waves = concurrency.divide_in_waves(self.nodes_params)
+        self.assertEqual([sorted(wave['nodes'].values()) for wave in waves], [[1, 2], [3, 4], [5]])
+        self.assertEqual(waves[2]['public_ips'], {'i-10000005': '127.0.0.5'})
+        self.assertEqual(waves[2]['stackname'], 'dummy1--test')
+
+    def test_divide_in_waves_default_size(self):
+        concurrency = bluegreen.WaveConcurrency('us-east-1')
+        waves = concurrency.divide_in_waves(self.nodes_params)
+        self.assertEqual(len(waves), 5)
+
+    def test_divide_in_waves_never_makes_a_single_wave_of_all_nodes(self):
+        for wave_size in [3, 5, 10]:
+            concurrency = bluegreen.WaveConcurrency('us-east-1', wave_size=wave_size)
+            waves = concurrency.divide_in_waves(self.nodes_params)
+            self.assertEqual([sorted(wave['nodes'].values()) for wave in waves], [[1, 2], [3, 4], [5]])
+
+    def test_invalid_wave_size(self):
+        self.assertRaises(ValueError, bluegreen.WaveConcurrency, 'us-east-1', wave_size=0)
+
+    def test_wait_registered_and_deregistered_all(self):
+        concurrency = bluegreen.WaveConcurrency('us-east-1', wave_size=2)
+        registering, deregistering, _ = concurrency.divide_in_waves(self.nodes_params)
+        self.conn.describe_instance_health.return_value = {
+            'InstanceStates': [
+                {'InstanceId': 'i-10000001', 'State': 'InService'},
+                {'InstanceId': 'i-10000002', 'State': 'InService'},
+                {'InstanceId': 'i-10000003', 'State': 'OutOfService'},
+                {'InstanceId': 'i-10000004', 'State': 'OutOfService'},
+            ],
+        }
+        with patch('buildercore.bluegreen.call_while', side_effect=try_only_once):
+            concurrency.wait_registered_and_deregistered_all('dummy1-ElasticL-ABCDEFGHI', registering, deregistering)
+
+        self.conn.describe_instance_health.return_value['InstanceStates'][3]['State'] = 'InService'
+        with patch('buildercore.bluegreen.call_while', side_effect=try_only_once):
+            self.assertRaises(
+                RuntimeError,
+                concurrency.wait_registered_and_deregistered_all,
+                'dummy1-ElasticL-ABCDEFGHI', registering, deregistering
+            )
+
+    @patch('buildercore.bluegreen.read_output', return_value='dummy1-ElasticL-ABCDEFGHI')
+    @patch('buildercore.bluegreen.parallel_work')
+    def test_each_wave_is_worked_on_while_detached(self, parallel_work, _):
+        concurrency = bluegreen.WaveConcurrency('us-east-1', wave_size=2)
+        calls = []
+
+        def recorder(method):
+            return lambda *args: calls.append((method, args[1:]))
+        for method in ['wait_all_in_service', 'register', 'deregister', 'wait_deregistered_all',
+                       'wait_registered_all', 'wait_registered_and_deregistered_all']:
+            setattr(concurrency, method, MagicMock(side_effect=recorder(method)))
+        parallel_work.side_effect = lambda work, wave: calls.append(('work', (wave,)))
+
+        concurrency(None, self.nodes_params)
+
+        node_numbers = lambda args: [sorted(arg['nodes'].values()) for arg in args]
+        self.assertEqual([(method, node_numbers(args)) for method, args in calls], [
+            ('wait_all_in_service', []),
+            ('deregister', [[1, 2]]),
+            ('wait_deregistered_all', [[1, 2]]),
+            ('work', [[1, 2]]),
+            ('register', [[1, 2]]),
+            ('deregister', [[3, 4]]),
+            ('wait_registered_and_deregistered_all', [[1, 2], [3, 4]]),
+            ('work', [[3, 4]]),
+            ('register', [[3, 4]]),
+            ('deregister', [[5]]),
+            ('wait_registered_and_deregistered_all', [[3, 4], [5]]),
+            ('work', [[5]]),
+            ('register', [[5]]),
+            ('wait_registered_all', [[1, 2, 3, 4, 5]]),
+        ])
+
+    @patch('buildercore.bluegreen.read_output', return_value='dummy1-ElasticL-ABCDEFGHI')
+    @patch('buildercore.bluegreen.parallel_work')
+    def test_waves_of_half_the_nodes_do_not_overlap(self, parallel_work, _):
+        "the next wave is only drained once the current one is healthy, otherwise no node would be serving"
+        nodes_params = {
+            'nodes': {'i-1000000%s' % n: n for n in range(1, 5)},
+            'public_ips': {'i-1000000%s' % n: '127.0.0.%s' % n for n in range(1, 5)},
+            'stackname': 'dummy1--test',
+        }
+        concurrency = bluegreen.WaveConcurrency('us-east-1', wave_size=4)
+        calls = []
+
+        def recorder(method):
+            return lambda *args: calls.append((method, args[1:]))
+        for method in ['wait_all_in_service', 'register', 'deregister', 'wait_deregistered_all',
+                       'wait_registered_all', 'wait_registered_and_deregistered_all']:
+            setattr(concurrency, method, MagicMock(side_effect=recorder(method)))
+        parallel_work.side_effect = lambda work, wave: calls.append(('work', (wave,)))
+
+        concurrency(None, nodes_params)
+
+        node_numbers = lambda args: [sorted(arg['nodes'].values()) for arg in args]
+        self.assertEqual([(method, node_numbers(args)) for method, args in calls], [
+            ('wait_all_in_service', []),
+            ('deregister', [[1, 2]]),
+            ('wait_deregistered_all', [[1, 2]]),
+            ('work', [[1, 2]]),
+            ('register', [[1, 2]]),
+            ('wait_registered_all', [[1, 2]]),
+            ('deregister', [[3, 4]]),
+            ('wait_deregistered_all', [[3, 4]]),
+            ('work', [[3, 4]]),
+            ('register', [[3, 4]]),
+            ('wait_registered_all', [[1, 2, 3, 4]]),
+        ])
@@ -111,3 +111,33 @@ pillar_roots:
 
         cleaned = bootstrap.remove_topics_from_sqs_policy(original, ['arn:aws:sns:us-east-1:512686554592:bus-articles--end2end'])
         self.assertIsNone(cleaned)
+
+    def test_update_ec2_stack_looks_up_stack_information_once(self):
+        "the CloudFormation outputs and master server address are shared by every node of a stack"
+        stackname = 'dummy1--test'
+        context = {
+            'project_name': 'dummy1',
+            'project': {'salt': '2017.7.0', 'formula-repo': 'https://github.com/elifesciences/dummy1-formula'},
+            'aws': {'region': 'us-east-1'},
+            'ec2': {'masterless': False, 'cluster-size': 3},
+        }
+        info = {'stack_name': stackname, 'stack_id': 'arn:...', 'outputs': {}}
+        node_state = {'build-vars': {}, 'cfn-info-md5': None}
+
+        def three_nodes(stackname, workfn, **kwargs):
+            return [workfn() for _ in range(3)]
+
+        with mock.patch('buildercore.core.stack_is', return_value=True), \
+                mock.patch('buildercore.bootstrap.stack_all_ec2_nodes', side_effect=three_nodes), \
+                mock.patch('buildercore.bootstrap.template_info', return_value=info) as template_info, \
+                mock.patch('buildercore.bootstrap.master', return_value='10.0.0.1') as master, \
+                mock.patch('buildercore.bootstrap.write_environment_info') as write_environment_info, \
+                mock.patch('buildercore.nodestate.snapshot', return_value=node_state) as snapshot, \
+                mock.patch('buildercore.bootstrap.run_script') as run_script:
+            bootstrap.update_ec2_stack(stackname, context)
+
+        self.assertEqual(template_info.call_count, 1)
+        self.assertEqual(master.call_count, 1)
+        snapshot.assert_called_with(['build-vars', 'cfn-info-md5'])
+        self.assertEqual(write_environment_info.call_args_list, [mock.call(stackname, overwrite=True, info=info, node_state=node_state)] * 3)
+        run_script.assert_any_call('bootstrap.sh', '2017.7.0', stackname, 'false', '10.0.0.1', grain_project='dummy1')
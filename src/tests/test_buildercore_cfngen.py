@@ -1,6 +1,9 @@
+import re, json
 import pytest
+from mock import patch
 from . import base
-from buildercore import core, cfngen, context_handler, cloudformation
+from buildercore import core, cfngen, context_handler, cloudformation, project, terraform, utils
+from buildercore.utils import lmap, deepcopy
 
 import logging
 LOG = logging.getLogger(__name__)
@@ -33,6 +36,64 @@ class TestBuildContext(base.BaseCase):
         self.assertEqual(context['alt-config'], 'my-custom-adhoc-instance')
         self.assertEqual(context['ec2']['ami'], 'ami-111111')
 
+    def _recorded_context(self, stackname, **changes):
+        """regenerates the context of `stackname` incrementally, so the inputs of its wranglers are recorded,
+        then changes it as if those were its results"""
+        tempdir, killer = utils.tempdir()
+        self.addCleanup(killer)
+        context_dir = patch('buildercore.config.CONTEXT_DIR', tempdir)
+        context_dir.start()
+        self.addCleanup(context_dir.stop)
+        pname = core.parse_stackname(stackname)[0]
+        context = cfngen._regenerate_context(stackname, cfngen.build_context(pname, stackname=stackname), incremental=True)
+        inputs = cfngen.read_wrangler_inputs(stackname, context)
+        self.assertTrue(inputs)
+        context.update(changes)
+        cfngen.write_wrangler_inputs(stackname, context, inputs)
+        return context
+
+    def test_incremental_rebuild_reuses_unchanged_results(self):
+        stackname = 'dummy2--test'
+        existing_context = self._recorded_context(stackname, vault={'reused': True})
+        context = cfngen._regenerate_context(stackname, existing_context, incremental=True)
+        self.assertEqual(context['vault'], {'reused': True})
+        self.assertNotIn('wrangler-inputs', context)
+
+    def test_incremental_rebuild_reruns_wranglers_whose_project_data_changed(self):
+        stackname = 'dummy2--test'
+        existing_context = self._recorded_context(stackname, vault={'reused': True}, s3={'reused': True})
+        pdata = deepcopy(project.project_data('dummy2'))
+        pdata['aws']['vault'] = {'address': 'https://vault.example.org'}
+        with patch('buildercore.project.project_data', return_value=pdata):
+            context = cfngen._regenerate_context(stackname, existing_context, incremental=True)
+        self.assertEqual(context['vault'], {'address': 'https://vault.example.org'})
+        self.assertEqual(context['s3'], {'reused': True})
+
+    def test_incremental_rebuild_of_a_changed_context_is_a_full_rebuild(self):
+        "a context changed since its inputs were recorded, by `master.remaster` for example, is rebuilt entirely"
+        stackname = 'dummy2--test'
+        existing_context = self._recorded_context(stackname, vault={'reused': True})
+        existing_context['ec2']['master_ip'] = '10.0.0.2'
+        context = cfngen._regenerate_context(stackname, existing_context, incremental=True)
+        self.assertNotEqual(context['vault'], {'reused': True})
+
+    def test_full_rebuild_ignores_existing_results(self):
+        stackname = 'dummy2--test'
+        existing_context = self._recorded_context(stackname, vault={'reused': True})
+        context = cfngen._regenerate_context(stackname, existing_context)
+        self.assertNotEqual(context['vault'], {'reused': True})
+
+class TestTitleClassifier(base.BaseCase):
+    def test_titles_are_classified_like_their_patterns(self):
+        "the combined pattern matches a title exactly when one of the individual patterns does"
+        titles = ['CloudFrontCDN', 'EC2Instance', 'EC2Instance1', 'ExtDNS', 'ExtDNS1', 'ExtDNS2', 'IntDNS', 'CnameDNS1',
+                  'CnameDNSx', 'FastlyDNS1', 'FastlyDNS', 'MyBucket', 'MyBucketPolicy', 'MyBucketName', 'SomeQueue',
+                  'Queue', 'SomeTopic', 'AttachedDB', 'AttachedDBParameterGroup', 'KeyName', 'AZ1', 'RDSHost',
+                  'StackSecurityGroup', 'VPCSecurityGroup', 'ElastiCacheHost1', 'Unknown']
+        for title in titles:
+            self.assertEqual(any(re.match(p, title) for p in cfngen.UPDATABLE_TITLE_PATTERNS), cfngen._title_is_updatable(title), title)
+            self.assertEqual(any(re.match(p, title) for p in cfngen.REMOVABLE_TITLE_PATTERNS), cfngen._title_is_removable(title), title)
+
 class TestUpdates(base.BaseCase):
     def test_empty_template_delta(self):
         context = self._base_context()
@@ -168,6 +229,66 @@ class TestUpdates(base.BaseCase):
         self.assertEqual(list(delta_minus['Resources'].keys()), ['CnameDNS1'])
         self.assertEqual(list(delta_minus['Outputs'].keys()), [])
 
+    def test_stack_delta_summary(self):
+        "the delta of a stack is summarised without downloading or writing anything"
+        context = self._base_context('dummy2', in_memory=True)
+        old_template = json.loads(cloudformation.render_template(context))
+        del old_template['Resources']['CnameDNS1']
+        with patch('buildercore.context_handler.load_context', return_value=context), \
+                patch('buildercore.cfngen._current_cloudformation_template', return_value=old_template), \
+                patch('buildercore.cloudformation.write_template') as write_template:
+            summary = cfngen.stack_delta_summary(context['stackname'])
+        self.assertFalse(write_template.called)
+        self.assertEqual(summary['stackname'], context['stackname'])
+        self.assertTrue(summary['changed'])
+        self.assertEqual(summary['error'], None)
+        self.assertEqual(summary['plus'], {'Resources': ['CnameDNS1'], 'Outputs': [], 'Parameters': []})
+        self.assertEqual(summary['minus'], {'Resources': [], 'Outputs': [], 'Parameters': []})
+
+    def test_stack_delta_summary_reports_errors(self):
+        with patch('buildercore.context_handler.load_context', side_effect=ValueError("no context")):
+            summary = cfngen.stack_delta_summary('dummy1--missing')
+        self.assertEqual(summary, {'stackname': 'dummy1--missing', 'changed': None, 'error': "no context"})
+
+    def test_stacks_delta_summary_in_parallel(self):
+        "results are returned in the order of the given stacks, whichever process finishes first"
+        stackname_list = ['dummy1--a', 'dummy1--b', 'dummy1--c']
+        summary = lambda stackname, incremental=False: {'stackname': stackname, 'changed': False, 'error': None}
+        with patch('buildercore.cfngen.stack_delta_summary', side_effect=summary):
+            results = cfngen.stacks_delta_summary(stackname_list, concurrency=2)
+        self.assertEqual(results, lmap(summary, stackname_list))
+
+    def test_stack_terraform_plan(self):
+        context = self._base_context('dummy1', in_memory=True)
+        delta = terraform.TerraformDelta('Plan output: ...', {}, {'fastly_service_v1.fastly-cdn': {'name': {'before': 'a', 'after': 'b'}}}, {})
+        with patch('buildercore.context_handler.load_context', return_value=context), \
+                patch('buildercore.terraform.generate_delta', return_value=delta):
+            summary = cfngen.stack_terraform_plan(context['stackname'])
+        self.assertEqual(summary, {
+            'stackname': context['stackname'],
+            'changed': True,
+            'plus': {},
+            'edit': {'fastly_service_v1.fastly-cdn': {'name': {'before': 'a', 'after': 'b'}}},
+            'minus': {},
+            'error': None,
+        })
+
+    def test_stack_terraform_plan_without_managed_services(self):
+        context = self._base_context('dummy1', in_memory=True)
+        with patch('buildercore.context_handler.load_context', return_value=context), \
+                patch('buildercore.terraform.plan') as plan:
+            summary = cfngen.stack_terraform_plan(context['stackname'])
+        self.assertFalse(plan.called)
+        self.assertFalse(summary['changed'])
+        self.assertEqual(summary['error'], None)
+
+    def test_stacks_terraform_plan_in_parallel(self):
+        stackname_list = ['dummy1--a', 'dummy1--b', 'dummy1--c']
+        summary = lambda stackname: {'stackname': stackname, 'changed': False, 'error': None}
+        with patch('buildercore.cfngen.stack_terraform_plan', side_effect=summary):
+            results = cfngen.stacks_terraform_plan(stackname_list, concurrency=2)
+        self.assertEqual(results, lmap(summary, stackname_list))
+
     def _base_context(self, project_name='dummy1', in_memory=False, existing_context=None):
         environment_name = base.generate_environment_name()
         stackname = '%s--%s' % (project_name, environment_name)
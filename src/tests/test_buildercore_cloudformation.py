@@ -1,3 +1,4 @@
+import json
 from buildercore import cloudformation
 from . import base
 from mock import patch, MagicMock
@@ -38,6 +39,88 @@ class StackInformation(base.BaseCase):
             'dummy1--t-ElasticL-19CB72BN8E36S'
         )
 
+class DownloadTemplate(base.BaseCase):
+    def setUp(self):
+        self.stackname = 'dummy1--%s' % base.generate_environment_name()
+
+    def tearDown(self):
+        cloudformation._delete_stack_file(self.stackname)
+
+    def _stack(self, last_updated):
+        stack = MagicMock()
+        stack.meta.data = {'CreationTime': '2020-01-01 00:00:00+00:00', 'LastUpdatedTime': last_updated}
+        return stack
+
+    @patch('buildercore.cloudformation.current_template')
+    @patch('buildercore.cloudformation.core.describe_stack')
+    def test_template_only_downloaded_when_stack_updated(self, describe_stack, current_template):
+        current_template.return_value = {'Resources': {'A': 1}}
+        describe_stack.return_value = self._stack('2020-02-01 00:00:00+00:00')
+        cloudformation.download_template(self.stackname)
+        cloudformation.download_template(self.stackname)
+        self.assertEqual(current_template.call_count, 1)
+        self.assertEqual(cloudformation.read_template(self.stackname), {'Resources': {'A': 1}})
+
+        current_template.return_value = {'Resources': {'A': 1, 'B': 2}}
+        describe_stack.return_value = self._stack('2020-03-01 00:00:00+00:00')
+        cloudformation.download_template(self.stackname)
+        self.assertEqual(current_template.call_count, 2)
+        self.assertEqual(cloudformation.read_template(self.stackname), {'Resources': {'A': 1, 'B': 2}})
+
+    @patch('buildercore.cloudformation.current_template')
+    @patch('buildercore.cloudformation.core.describe_stack')
+    def test_template_written_locally_is_downloaded_again(self, describe_stack, current_template):
+        current_template.return_value = {'Resources': {'A': 1}}
+        describe_stack.return_value = self._stack('2020-02-01 00:00:00+00:00')
+        cloudformation.download_template(self.stackname)
+        cloudformation.write_template(self.stackname, '{"Resources": {}}')
+        self.assertEqual(cloudformation.downloaded_version(self.stackname), None)
+        cloudformation.download_template(self.stackname)
+        self.assertEqual(current_template.call_count, 2)
+        self.assertEqual(cloudformation.read_template(self.stackname), {'Resources': {'A': 1}})
+
+class TemplateSubmission(base.BaseCase):
+    def test_small_templates_are_minified_and_sent_inline(self):
+        template = '{\n    "Resources": {\n        "A": {"Type": "AWS::SNS::Topic"}\n    }\n}'
+        self.assertEqual(
+            cloudformation.template_argument('dummy1--test', template),
+            {'TemplateBody': '{"Resources":{"A":{"Type":"AWS::SNS::Topic"}}}'}
+        )
+
+    @patch('buildercore.cloudformation.s3.write')
+    def test_large_templates_are_uploaded(self, write):
+        template = {'Resources': {'A': {'Type': 'AWS::SNS::Topic'}}}
+        with patch('buildercore.config.TEMPLATE_BODY_MAX_SIZE', 10):
+            argument = cloudformation.template_argument('dummy1--test', template)
+        write.assert_called_once_with('templates/dummy1--test.json', '{"Resources":{"A":{"Type":"AWS::SNS::Topic"}}}', overwrite=True)
+        self.assertEqual(argument, {'TemplateURL': 'https://elife-builder.s3.amazonaws.com/templates/dummy1--test.json'})
+
+    @patch('buildercore.cloudformation.s3.delete')
+    @patch('buildercore.cloudformation.s3.write')
+    @patch('buildercore.core.boto_conn')
+    def test_large_validated_templates_are_uploaded_and_deleted(self, boto_conn, write, delete):
+        template = json.dumps({'Resources': {'A': {'Type': 'AWS::SNS::Topic'}}})
+        boto_conn.return_value.validate_template.side_effect = [{}, ValueError("invalid")]
+        with patch('buildercore.config.TEMPLATE_BODY_MAX_SIZE', 10):
+            cloudformation.validate_template('dummy1', template)
+            self.assertRaises(ValueError, cloudformation.validate_template, 'dummy1', template)
+        keys = [args[0] for args, _ in write.call_args_list]
+        self.assertEqual(2, len(set(keys)))
+        self.assertTrue(all(key.startswith('templates/dummy1--validation--') for key in keys))
+        self.assertEqual(keys, [args[0] for args, _ in delete.call_args_list])
+
+    def test_template_size(self):
+        stackname = 'dummy1--%s' % base.generate_environment_name()
+        cloudformation.write_template(stackname, '{"Resources": {"A": {"Type": "AWS::SNS::Topic"}}}')
+        try:
+            report = cloudformation.template_size(stackname)
+        finally:
+            cloudformation._delete_stack_file(stackname)
+        self.assertEqual(report['resources'], 1)
+        self.assertEqual(report['minified-size'], len('{"Resources":{"A":{"Type":"AWS::SNS::Topic"}}}'))
+        self.assertTrue(report['size'] > report['minified-size'])
+        self.assertTrue(report['inline'])
+
 class StackUpdate(base.BaseCase):
     def test_no_updates(self):
         cloudformation.update_template('dummy1--test', cloudformation.CloudFormationDelta())
@@ -1,4 +1,6 @@
+import json, os
 from os import remove
+from mock import patch, MagicMock
 from . import base
 from buildercore import cfngen, context_handler
 
@@ -20,3 +22,113 @@ class TestBuildercoreContext(base.BaseCase):
     def _read_file(self, path):
         with open(path) as f:
             return f.read()
+
+class TestContextCache(base.BaseCase):
+    def setUp(self):
+        self.stackname = 'dummy1--%s' % base.generate_environment_name()
+        self.addCleanup(context_handler.delete_context_locally, self.stackname)
+
+    def _remote(self, etag, context):
+        "returns a fake `s3.download_if_changed` serving `context` with the given `etag`"
+        def download_if_changed(key, output_path, local_etag=None):
+            if local_etag != etag:
+                with open(output_path, 'w') as fh:
+                    json.dump(context, fh)
+            return etag
+        return download_if_changed
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    def test_load_context_checks_s3_once_per_process(self, download_if_changed):
+        download_if_changed.side_effect = self._remote('"abc"', {'foo': 'bar'})
+        self.assertEqual({'foo': 'bar'}, context_handler.load_context(self.stackname))
+        self.assertEqual({'foo': 'bar'}, context_handler.load_context(self.stackname))
+        self.assertEqual(1, download_if_changed.call_count)
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    def test_load_context_returns_a_copy(self, download_if_changed):
+        download_if_changed.side_effect = self._remote('"abc"', {'foo': 'bar'})
+        context_handler.load_context(self.stackname)['foo'] = 'baz'
+        self.assertEqual({'foo': 'bar'}, context_handler.load_context(self.stackname))
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    def test_load_context_revalidates_local_copy_with_its_etag(self, download_if_changed):
+        download_if_changed.side_effect = self._remote('"abc"', {'foo': 'bar'})
+        context_handler.load_context(self.stackname)
+        context_handler.clear_context_cache(self.stackname)
+        context_handler.load_context(self.stackname)
+        self.assertEqual('"abc"', download_if_changed.call_args[0][2])
+
+    @patch('buildercore.context_handler.s3.download_if_changed', return_value=None)
+    def test_load_missing_context(self, download_if_changed):
+        self.assertRaises(context_handler.MissingContextFile, context_handler.load_context, self.stackname)
+
+    @patch('buildercore.context_handler.s3.write', return_value='"def"')
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    def test_write_context_invalidates_cache(self, download_if_changed, _):
+        download_if_changed.side_effect = self._remote('"abc"', {'foo': 'bar'})
+        context_handler.load_context(self.stackname)
+        context_handler.write_context(self.stackname, {'foo': 'baz'})
+        download_if_changed.side_effect = self._remote('"def"', {'foo': 'baz'})
+        self.assertEqual({'foo': 'baz'}, context_handler.load_context(self.stackname))
+        self.assertEqual('"def"', download_if_changed.call_args[0][2])
+
+class TestSyncAll(base.BaseCase):
+    def setUp(self):
+        self.stacknames = ['dummy1--%s' % base.generate_environment_name() for _ in range(3)]
+        for stackname in self.stacknames:
+            self.addCleanup(context_handler.delete_context_locally, stackname)
+
+    def _object(self, stackname, etag):
+        obj = MagicMock()
+        obj.key = context_handler.s3_context_key(stackname)
+        obj.e_tag = etag
+        return obj
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    @patch('buildercore.context_handler.s3.listing')
+    def test_sync_all_downloads_only_changed_contexts(self, listing, download_if_changed):
+        unchanged, changed, new = self.stacknames
+        context_handler.write_context_locally(unchanged, '{}')
+        context_handler._write_etag(unchanged, '"1"')
+        context_handler.write_context_locally(changed, '{}')
+        context_handler._write_etag(changed, '"1"')
+        listing.return_value = [
+            self._object(unchanged, '"1"'),
+            self._object(changed, '"2"'),
+            self._object(new, '"3"'),
+        ]
+        download_if_changed.side_effect = lambda key, path, etag: {
+            context_handler.s3_context_key(changed): '"2"',
+            context_handler.s3_context_key(new): '"3"',
+        }[key]
+
+        self.assertEqual(sorted([changed, new]), context_handler.sync_all())
+        self.assertEqual(2, download_if_changed.call_count)
+        self.assertEqual('"2"', context_handler._read_etag(changed))
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    @patch('buildercore.context_handler.s3.listing')
+    def test_synced_contexts_are_not_revalidated(self, listing, download_if_changed):
+        stackname = self.stacknames[0]
+        context_handler.write_context_locally(stackname, '{"foo": "bar"}')
+        context_handler._write_etag(stackname, '"1"')
+        listing.return_value = [self._object(stackname, '"1"')]
+
+        context_handler.sync_all()
+        self.assertEqual({'foo': 'bar'}, context_handler.load_context(stackname))
+        self.assertFalse(download_if_changed.called)
+
+    @patch('buildercore.context_handler.s3.download_if_changed')
+    @patch('buildercore.context_handler.s3.listing')
+    def test_sync_all_deletes_contexts_removed_from_s3(self, listing, download_if_changed):
+        downloaded, never_uploaded, _ = self.stacknames
+        context_handler.write_context_locally(downloaded, '{}')
+        context_handler._write_etag(downloaded, '"1"')
+        context_handler.write_context_locally(never_uploaded, '{}')
+        listing.return_value = []
+
+        self.assertEqual([downloaded], context_handler.sync_all())
+        self.assertFalse(os.path.exists(context_handler.local_context_file(downloaded)))
+        self.assertFalse(os.path.exists(context_handler.local_etag_file(downloaded)))
+        self.assertTrue(os.path.exists(context_handler.local_context_file(never_uploaded)))
+        self.assertFalse(download_if_changed.called)
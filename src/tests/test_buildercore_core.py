@@ -2,7 +2,8 @@ from functools import partial
 import json
 from os.path import join
 from . import base
-from buildercore import core, utils, project
+from buildercore import core, utils, project, context_handler
+from botocore.stub import Stubber
 from unittest import skip
 from mock import patch
 
@@ -185,6 +186,90 @@ class Errors(base.BaseCase):
             core.stack_all_ec2_nodes, 'dummy1--test', lambda: True
         )
 
+class BotoConns(base.BaseCase):
+    def setUp(self):
+        core.clear_boto_conns()
+        self.addCleanup(core.clear_boto_conns)
+
+    def test_clients_are_reused(self):
+        client = core.boto_client('sqs', 'us-east-1')
+        self.assertIs(client, core.boto_client('sqs', 'us-east-1'))
+        self.assertIsNot(client, core.boto_client('sqs', 'eu-west-1'))
+        self.assertIsNot(client, core.boto_client('sns', 'us-east-1'))
+
+    def test_clients_are_configured(self):
+        client = core.boto_client('sqs', 'us-east-1')
+        self.assertEqual(25, client.meta.config.max_pool_connections)
+
+    def test_clients_are_shared_between_threads(self):
+        client = core.boto_client('sqs', 'us-east-1')
+        self.assertEqual([client, client], utils.pmap(lambda _: core.boto_client('sqs', 'us-east-1'), [1, 2]))
+
+    def test_resources_are_reused_within_a_thread(self):
+        resource = core.boto_resource('sqs', 'us-east-1')
+        self.assertIs(resource, core.boto_resource('sqs', 'us-east-1'))
+        self.assertIsNot(resource, utils.pmap(lambda _: core.boto_resource('sqs', 'us-east-1'), [1])[0])
+
+    def test_conns_are_discarded_after_fork(self):
+        client = core.boto_client('sqs', 'us-east-1')
+        with patch('os.getpid', return_value=-1):
+            self.assertIsNot(client, core.boto_client('sqs', 'us-east-1'))
+
+    def test_conns_are_adopted_after_fork(self):
+        "a child forked once the pools are closed keeps the clients and resources of its parent"
+        client = core.boto_client('sqs', 'us-east-1')
+        resource = core.boto_resource('sqs', 'us-east-1')
+        core.close_boto_pools()
+        with patch('os.getpid', return_value=-1):
+            core.adopt_boto_conns()
+            self.assertIs(client, core.boto_client('sqs', 'us-east-1'))
+            self.assertIs(resource, core.boto_resource('sqs', 'us-east-1'))
+
+class StackRegion(base.BaseCase):
+    def setUp(self):
+        core.clear_boto_conns()
+        core._STACK_REGIONS.clear()
+        self.addCleanup(core.clear_boto_conns)
+        self.addCleanup(core._STACK_REGIONS.clear)
+        temp_dir, rm_temp_dir = utils.tempdir()
+        self.addCleanup(rm_temp_dir)
+        patcher = patch('buildercore.config.INVENTORY_PATH', join(temp_dir, 'inventory.sqlite3'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_project_region(self):
+        self.assertEqual("us-east-1", core.find_region('dummy1--prod'))
+
+    def test_context_region(self):
+        "the region recorded in a stack's context is preferred to the region in its project data"
+        stackname = 'dummy1--%s' % base.generate_environment_name()
+        context_handler.write_context_locally(stackname, json.dumps({'aws': {'region': 'eu-central-1'}}))
+        self.addCleanup(context_handler.delete_context_locally, stackname)
+        self.assertEqual("eu-central-1", core.find_region(stackname))
+
+    @patch('buildercore.core.configured_regions', return_value=['us-east-1', 'eu-central-1'])
+    def test_live_region(self, configured_regions):
+        "stacks are looked for in all regions at once when there are many and the result remembered"
+        stubbers = {}
+        for region in configured_regions.return_value:
+            stubbers[region] = Stubber(core.boto_client('cloudformation', region))
+            stubbers[region].activate()
+            self.addCleanup(stubbers[region].deactivate)
+        stubbers['us-east-1'].add_client_error('describe_stacks', 'ValidationError', 'Stack with id dummy1--prod does not exist')
+        stubbers['eu-central-1'].add_response('describe_stacks', {'Stacks': []})
+
+        self.assertEqual("eu-central-1", core.find_region('dummy1--prod'))
+        core._STACK_REGIONS.clear()
+        self.assertEqual("eu-central-1", core.find_region('dummy1--prod'))
+        for stubber in stubbers.values():
+            stubber.assert_no_pending_responses()
+
+        # the stack is destroyed. stacks that can't be found are in their project's region
+        core.forget_stack_region('dummy1--prod')
+        stubbers['us-east-1'].add_client_error('describe_stacks', 'ValidationError', 'Stack with id dummy1--prod does not exist')
+        stubbers['eu-central-1'].add_client_error('describe_stacks', 'ValidationError', 'Stack with id dummy1--prod does not exist')
+        self.assertEqual("us-east-1", core.find_region('dummy1--prod'))
+
 class TestCoreNewProjectData(base.BaseCase):
     def setUp(self):
         self.dummy1_config = join(self.fixtures_dir, 'dummy1-project.json')
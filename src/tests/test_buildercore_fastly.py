@@ -83,3 +83,28 @@ sub vcl_fetch {
             fastly.FastlyCustomVCLGenerationError,
             lambda: snippet.insert_include(original_main_vcl),
         )
+
+    def test_builder_assembles_many_inclusions_like_successive_insertions(self):
+        main_vcl = fastly.FastlyVCL.from_string("""
+sub vcl_recv {
+  #FASTLY recv
+}
+
+sub vcl_fetch {
+  #FASTLY fetch
+}
+""")
+        inclusions = [
+            fastly.FastlyVCLInclusion(name='first', type='recv', hook='after'),
+            fastly.FastlyVCLInclusion(name='second', type='recv', hook='after'),
+            fastly.FastlyVCLInclusion(name='third', type='recv', hook='before'),
+            fastly.FastlyVCLInclusion(name='fourth', type='fetch', hook='before'),
+            fastly.FastlyVCLInclusion(name='fifth', type='recv', hook='before'),
+        ]
+        expected_main_vcl = main_vcl
+        builder = fastly.FastlyVCLBuilder(main_vcl)
+        for inclusion in inclusions:
+            expected_main_vcl = inclusion.insert_include(expected_main_vcl)
+            inclusion.insert_include(builder)
+        self.assertEqual(builder.build(), expected_main_vcl)
+        self.assertEqual(str(builder.build()).count('include "'), 5)
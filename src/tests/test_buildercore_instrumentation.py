@@ -0,0 +1,62 @@
+import json
+from botocore.stub import Stubber
+from mock import MagicMock
+from . import base
+from buildercore import core, instrumentation
+
+class TestInstrumentation(base.BaseCase):
+    def setUp(self):
+        core.clear_boto_conns()
+        instrumentation.reset()
+        self.addCleanup(core.clear_boto_conns)
+        self.addCleanup(instrumentation.reset)
+
+    def test_calls_are_counted(self):
+        client = core.boto_client('sqs', 'us-east-1')
+        with Stubber(client) as stubber:
+            stubber.add_response('list_queues', {'QueueUrls': []})
+            stubber.add_response('list_queues', {'QueueUrls': []})
+            stubber.add_client_error('list_queues', service_error_code='AWS.SimpleQueueService.NonExistentQueue', http_status_code=400)
+            client.list_queues()
+            client.list_queues()
+            self.assertRaises(Exception, client.list_queues)
+
+        stats = instrumentation.stats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual('sqs.ListQueues', stats[0]['operation'])
+        self.assertEqual(3, stats[0]['calls'])
+        self.assertEqual(1, stats[0]['errors'])
+        self.assertEqual(3, sum(stats[0]['histogram']))
+
+    def test_not_modified_is_not_an_error(self):
+        model = MagicMock()
+        model.name = 'GetObject'
+        model.service_model.endpoint_prefix = 's3'
+        for status_code in [200, 304, 404]:
+            instrumentation._after_call(model, {}, {}, http_response=MagicMock(status_code=status_code))
+        stats = instrumentation.stats()
+        self.assertEqual(3, stats[0]['calls'])
+        self.assertEqual(1, stats[0]['errors'])
+
+    def test_throttles_are_counted(self):
+        model = MagicMock()
+        model.name = 'DescribeInstances'
+        model.service_model.endpoint_prefix = 'ec2'
+        response = (MagicMock(), {'Error': {'Code': 'RequestLimitExceeded'}})
+        self.assertIsNone(instrumentation._needs_retry(response=response, operation=model))
+        instrumentation._needs_retry(response=(MagicMock(), {}), operation=model)
+        self.assertEqual(1, instrumentation.stats()[0]['throttles'])
+
+    def test_latency_buckets(self):
+        self.assertEqual(0, instrumentation._bucket(0.01))
+        self.assertEqual(3, instrumentation._bucket(1))
+        self.assertEqual(len(instrumentation.LATENCY_BUCKETS), instrumentation._bucket(60))
+
+    def test_summary(self):
+        self.assertIsNone(instrumentation.summary())
+        client = core.boto_client('sqs', 'us-east-1')
+        with Stubber(client) as stubber:
+            stubber.add_response('list_queues', {'QueueUrls': []})
+            client.list_queues()
+        self.assertIn('sqs.ListQueues', instrumentation.summary())
+        self.assertEqual(1, json.loads(instrumentation.summary_json())['operations'][0]['calls'])
@@ -0,0 +1,107 @@
+import os
+from datetime import datetime
+from botocore.stub import Stubber
+from mock import patch
+from . import base
+from buildercore import core, inventory, utils
+
+def stack_summary(stackname, status='CREATE_COMPLETE', updated=None):
+    summary = {
+        'StackId': 'arn:aws:cloudformation:us-east-1:512686554592:stack/%s/1' % stackname,
+        'StackName': stackname,
+        'StackStatus': status,
+        'CreationTime': datetime(2020, 1, 1),
+    }
+    if updated:
+        summary['LastUpdatedTime'] = updated
+    return summary
+
+def instance(instance_id, stackname, node, state='running', ip='10.0.0.1'):
+    return {
+        'InstanceId': instance_id,
+        'State': {'Code': 16, 'Name': state},
+        'PrivateIpAddress': ip,
+        'Tags': [
+            {'Key': 'aws:cloudformation:stack-name', 'Value': stackname},
+            {'Key': 'Node', 'Value': str(node)},
+        ],
+    }
+
+def instance_status(instance_id, state='running'):
+    return {'InstanceId': instance_id, 'InstanceState': {'Code': 16, 'Name': state}}
+
+class TestInventory(base.BaseCase):
+    region = 'us-east-1'
+
+    def setUp(self):
+        core.clear_boto_conns()
+        self.addCleanup(core.clear_boto_conns)
+        temp_dir, rm_temp_dir = utils.tempdir()
+        self.addCleanup(rm_temp_dir)
+        self.path = os.path.join(temp_dir, 'inventory.sqlite3')
+        self.cfn = Stubber(core.boto_client('cloudformation', self.region))
+        self.ec2 = Stubber(core.boto_client('ec2', self.region))
+        self.cfn.activate()
+        self.ec2.activate()
+        self.addCleanup(self.cfn.deactivate)
+        self.addCleanup(self.ec2.deactivate)
+
+    def expect_refresh(self, summaries, statuses, described=None):
+        self.cfn.add_response('list_stacks', {'StackSummaries': summaries})
+        self.ec2.add_response('describe_instance_status', {'InstanceStatuses': statuses})
+        if described:
+            self.ec2.add_response('describe_instances', {'Reservations': [{'Instances': described}]},
+                                  {'InstanceIds': sorted(i['InstanceId'] for i in described)})
+
+    def test_queries(self):
+        self.expect_refresh(
+            [stack_summary('journal--prod'), stack_summary('lax--prod'), stack_summary('lax--ci', 'UPDATE_IN_PROGRESS'),
+             stack_summary('lax--old', 'DELETE_COMPLETE')],
+            [instance_status('i-1'), instance_status('i-2')],
+            [instance('i-2', 'journal--prod', 2, ip='10.0.0.2'), instance('i-1', 'journal--prod', 1)])
+
+        self.assertEqual(['journal--prod', 'lax--prod'], inventory.active_stack_names(self.region, path=self.path))
+        # the inventory isn't refreshed again until it's older than `max_age`
+        self.assertEqual(['lax--ci', 'lax--prod'], [triple[0] for triple in inventory.project_stacks('lax', self.region, path=self.path)])
+        self.assertEqual(['i-1', 'i-2'], [data['InstanceId'] for data in inventory.stack_instances('journal--prod', self.region, path=self.path)])
+        self.assertEqual('10.0.0.2', inventory.node_ip('journal--prod', 2, self.region, path=self.path))
+        self.assertEqual(None, inventory.node_ip('journal--prod', 3, self.region, path=self.path))
+        self.cfn.assert_no_pending_responses()
+        self.ec2.assert_no_pending_responses()
+
+    def test_incremental_refresh(self):
+        self.expect_refresh(
+            [stack_summary('journal--prod'), stack_summary('lax--prod')],
+            [instance_status('i-1'), instance_status('i-2')],
+            [instance('i-1', 'journal--prod', 1), instance('i-2', 'lax--prod', 1)])
+        self.assertTrue(inventory.refresh(self.region, path=self.path))
+        self.assertFalse(inventory.refresh(self.region, path=self.path))
+
+        # lax--prod is updated, journal--prod is destroyed and only the restarted instance is described again
+        self.expect_refresh(
+            [stack_summary('lax--prod', 'UPDATE_COMPLETE', datetime(2020, 2, 1))],
+            [instance_status('i-2', 'stopped')],
+            [instance('i-2', 'lax--prod', 1, state='stopped')])
+        with inventory.connect(self.path) as conn:
+            self.assertEqual(['journal--prod', 'lax--prod'], inventory.refresh_stacks(conn, self.region))
+            self.assertEqual(['i-2', 'i-1'], inventory.refresh_instances(conn, self.region))
+
+        self.assertEqual(['lax--prod'], inventory.active_stack_names(self.region, path=self.path))
+        self.assertEqual([], inventory.stack_instances('lax--prod', self.region, path=self.path))
+        self.assertEqual(['i-2'], [data['InstanceId'] for data in inventory.stack_instances('lax--prod', self.region, state='running|stopped', path=self.path)])
+        self.cfn.assert_no_pending_responses()
+        self.ec2.assert_no_pending_responses()
+
+    def test_core_queries(self):
+        "`core` answers questions about projects and nodes from the inventory"
+        self.expect_refresh(
+            [stack_summary('dummy1--prod'), stack_summary('dummy2--prod')],
+            [instance_status('i-1'), instance_status('i-2')],
+            [instance('i-2', 'dummy1--prod', 2, ip='10.0.0.2'), instance('i-1', 'dummy1--prod', 1)])
+        with patch('buildercore.config.INVENTORY_PATH', self.path), \
+                patch('buildercore.core.find_region', return_value=self.region):
+            self.assertEqual(['dummy1--prod'], core.stack_names(core.active_aws_project_stacks('dummy1')))
+            self.assertEqual('10.0.0.2', core.stack_node_ip('dummy1--prod', 2))
+            self.assertEqual('10.0.0.1', core.stack_node_ip('dummy1--prod'))
+        self.cfn.assert_no_pending_responses()
+        self.ec2.assert_no_pending_responses()
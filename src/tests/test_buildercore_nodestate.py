@@ -0,0 +1,104 @@
+import base64, os, stat, subprocess
+from . import base
+from buildercore import nodestate, bootstrap, utils
+from buildercore.bvars import encode_bvars
+import mock
+
+class TestBuildercoreNodestate(base.BaseCase):
+    def test_parse_snapshot(self):
+        build_vars = {'stackname': 'dummy1--test', 'revision': 'abc123'}
+        lines = [
+            '[sudo] password for elife:',
+            'builder-node-state build-vars %s' % encode_bvars(build_vars),
+            'builder-node-state cfn-info 0cc175b9c0f1b6a831c399e269772661',
+        ]
+        self.assertEqual(nodestate.parse_snapshot(lines), {
+            'build-vars': build_vars,
+            'cfn-info-md5': '0cc175b9c0f1b6a831c399e269772661',
+        })
+
+    def test_parse_snapshot_of_an_empty_node(self):
+        lines = [
+            'builder-node-state build-vars ',
+            'builder-node-state cfn-info ',
+        ]
+        self.assertEqual(nodestate.parse_snapshot(lines), {
+            'build-vars': None,
+            'cfn-info-md5': None,
+        })
+
+    def test_parse_snapshot_with_bad_build_vars(self):
+        "build vars that can't be decoded are treated as missing"
+        for bad_build_vars in ['not-base64!', encode_bvars({'foo': 'bar'})[:-4], 'bm90IGpzb24=']:
+            lines = [
+                'builder-node-state build-vars %s' % bad_build_vars,
+                'builder-node-state cfn-info 0cc175b9c0f1b6a831c399e269772661',
+            ]
+            state = nodestate.parse_snapshot(lines)
+            self.assertEqual(state['build-vars'], None)
+            self.assertEqual(state['cfn-info-md5'], '0cc175b9c0f1b6a831c399e269772661')
+
+    def test_snapshot_script(self):
+        script = nodestate.snapshot_script(['cfn-info-md5'])
+        self.assertIn('md5sum /etc/cfn-info.json', script)
+        self.assertNotIn('/etc/build-vars.json.b64', script)
+        self.assertIn('/etc/build-vars.json.b64', nodestate.SNAPSHOT_SCRIPT)
+
+    def test_snapshot_is_a_single_remote_command(self):
+        result = {'stdout': ['builder-node-state cfn-info 0cc175b9c0f1b6a831c399e269772661\r']}
+        with mock.patch('buildercore.nodestate.remote_sudo', return_value=result) as remote_sudo:
+            state = nodestate.snapshot()
+        self.assertEqual(state['cfn-info-md5'], '0cc175b9c0f1b6a831c399e269772661')
+        self.assertEqual(remote_sudo.call_count, 1)
+        command = remote_sudo.call_args[0][0]
+        encoded_script = command.split(' ')[1]
+        self.assertEqual(base64.b64decode(encoded_script).decode('utf-8'), nodestate.SNAPSHOT_SCRIPT)
+
+    def test_write_files_script(self):
+        "files are replaced, keeping their permissions, and backed up"
+        tempdir, killer = utils.tempdir()
+        self.addCleanup(killer)
+        existing = os.path.join(tempdir, 'existing.json')
+        new = os.path.join(tempdir, 'new.json')
+        with open(existing, 'w') as fp:
+            fp.write('old')
+        os.chmod(existing, 0o600)
+        suffix = base.generate_environment_name()
+        backup = '/tmp/existing.json.%s' % suffix
+        self.addCleanup(lambda: os.path.exists(backup) and os.unlink(backup))
+
+        script = nodestate.write_files_script([(existing, 'new "contents"\n'), (new, '{}')], backup=True, suffix=suffix)
+        subprocess.check_call(['bash', '-c', script])
+
+        with open(existing, 'r') as fp:
+            self.assertEqual(fp.read(), 'new "contents"\n')
+        self.assertEqual(stat.S_IMODE(os.stat(existing).st_mode), 0o600)
+        with open(new, 'r') as fp:
+            self.assertEqual(fp.read(), '{}')
+        with open(backup, 'r') as fp:
+            self.assertEqual(fp.read(), 'old')
+        self.assertEqual(sorted(os.listdir(tempdir)), ['existing.json', 'new.json'])
+
+    def test_unchanged_environment_info_is_not_written(self):
+        info = {'stack_name': 'dummy1--test', 'stack_id': 'arn:...', 'outputs': {}}
+        node_state = {'build-vars': {}, 'cfn-info-md5': nodestate.md5(utils.json_dumps(info))}
+        with mock.patch('buildercore.nodestate.write_files') as write_files:
+            bootstrap.write_environment_info('dummy1--test', overwrite=True, info=info, node_state=node_state)
+            self.assertFalse(write_files.called)
+            bootstrap.write_environment_info('dummy1--test', overwrite=True, info=dict(info, outputs={'foo': 'bar'}), node_state=node_state)
+            self.assertTrue(write_files.called)
+
+    def test_environment_info_is_only_read_when_necessary(self):
+        info = {'stack_name': 'dummy1--test', 'stack_id': 'arn:...', 'outputs': {}}
+        missing = {'build-vars': None, 'cfn-info-md5': None}
+        with mock.patch('buildercore.nodestate.write_files') as write_files:
+            with mock.patch('buildercore.nodestate.snapshot', return_value=missing) as snapshot:
+                # overwriting, the node isn't read
+                bootstrap.write_environment_info('dummy1--test', overwrite=True, info=info)
+                self.assertFalse(snapshot.called)
+                self.assertEqual(write_files.call_count, 1)
+
+                # not overwriting, only the checksum of the existing file is read
+                bootstrap.write_environment_info('dummy1--test', info=info)
+                snapshot.assert_called_once_with(['cfn-info-md5'])
+                self.assertEqual(write_files.call_count, 2)
@@ -1,5 +1,7 @@
 """Tests concerning S3 interaction."""
-import os
+import io, os
+from mock import patch, MagicMock
+from botocore.exceptions import ClientError
 from . import base
 from buildercore import s3, utils
 
@@ -61,3 +63,63 @@ class TestReadWrite(base.BaseCase):
         s3.download(key, expected_output)
         self.assertTrue(os.path.exists(expected_output))
         self.assertEqual(open(expected_output, 'r').read(), expected_contents)
+
+class TestRequests(base.BaseCase):
+    "ensures operations use as few S3 requests as possible"
+    def setUp(self):
+        patcher = patch('buildercore.s3._client')
+        self.addCleanup(patcher.stop)
+        self.client = MagicMock()
+        patcher.start().return_value = self.client
+
+    def test_overwrite_skips_existence_check(self):
+        self.client.put_object.return_value = {'ETag': '"abc"'}
+        self.assertEqual('"abc"', s3.write("test/foo", "asdf", overwrite=True))
+        self.assertFalse(self.client.head_object.called)
+
+    def test_write_checks_existence(self):
+        self.assertRaises(KeyError, s3.write, "test/foo", "asdf")
+        self.assertFalse(self.client.put_object.called)
+
+    def test_delete_is_a_single_request(self):
+        s3.delete("test/foo")
+        self.client.delete_object.assert_called_once_with(Bucket=s3.config.BUILDER_BUCKET, Key="test/foo")
+        self.assertFalse(self.client.head_object.called)
+
+    def test_delete_protected_key(self):
+        self.assertRaises(ValueError, s3.delete, "private/foo")
+        self.assertFalse(self.client.delete_object.called)
+
+    def test_delete_many_in_batches(self):
+        self.client.delete_objects.return_value = {}
+        keys = ["test/foo-%s" % i for i in range(2500)]
+        s3.delete_many(keys)
+        batches = [call[1]['Delete']['Objects'] for call in self.client.delete_objects.call_args_list]
+        self.assertEqual([1000, 1000, 500], [len(batch) for batch in batches])
+        self.assertEqual({'Key': 'test/foo-2499'}, batches[-1][-1])
+
+    def test_delete_many_errors(self):
+        self.client.delete_objects.return_value = {'Errors': [{'Key': 'test/foo', 'Code': 'AccessDenied'}]}
+        self.assertRaises(AssertionError, s3.delete_many, ["test/foo"])
+
+    def test_download_missing_key(self):
+        self.client.download_file.side_effect = ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        self.assertRaises(AssertionError, s3.download, "test/foo", "/tmp/does-not-exist", overwrite=True)
+
+    def test_large_write_returns_etag(self):
+        "multipart uploads return the ETag of the object like any other write"
+        self.client.head_object.return_value = {'ETag': '"abc-2"'}
+        large = io.BytesIO(b'x' * s3.TRANSFER_CONFIG.multipart_threshold)
+        self.assertEqual('"abc-2"', s3.write("test/foo", large, overwrite=True))
+        self.assertTrue(self.client.upload_fileobj.called)
+        self.assertFalse(self.client.put_object.called)
+
+    def test_write_many(self):
+        self.client.put_object.return_value = {'ETag': '"abc"'}
+        self.assertEqual(['"abc"', '"abc"'], s3.write_many([("test/foo", "foo"), ("test/bar", "bar")], overwrite=True))
+        self.assertEqual(2, self.client.put_object.call_count)
+
+    def test_download_many(self):
+        pairs = [("test/foo", "/tmp/foo"), ("test/bar", "/tmp/bar")]
+        self.assertEqual(["/tmp/foo", "/tmp/bar"], s3.download_many(pairs, overwrite=True))
+        self.assertEqual(2, self.client.download_file.call_count)
@@ -221,6 +221,30 @@ class TestBuildercoreTerraform(base.BaseCase):
         for _, configuration in self._load_terraform_file(stackname, 'providers').get('provider').items():
             self.assertIn('version', configuration)
 
+    @patch('buildercore.terraform.Terraform')
+    def test_init_is_skipped_when_configuration_is_unchanged(self, Terraform):
+        terraform_binary = MagicMock()
+        Terraform.return_value = terraform_binary
+        stackname = 'project-with-fastly-minimal--%s' % self.environment
+        context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
+        terraform.init(stackname, context)
+        self._fake_terraform_init(stackname)
+        terraform.init(stackname, context)
+        terraform_binary.init.assert_called_once()
+
+    @patch('buildercore.terraform.Terraform')
+    def test_init_is_repeated_when_providers_change(self, Terraform):
+        terraform_binary = MagicMock()
+        Terraform.return_value = terraform_binary
+        stackname = 'project-with-fastly-minimal--%s' % self.environment
+        context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
+        terraform.init(stackname, context)
+        self._fake_terraform_init(stackname)
+        with open(join(terraform.TERRAFORM_DIR, stackname, 'generated.tf.json'), 'w') as fp:
+            fp.write(json.dumps({'data': {'google_project': {'example': {}}}}))
+        terraform.init(stackname, context)
+        self.assertEqual(terraform_binary.init.call_count, 2)
+
     @patch('buildercore.terraform.Terraform')
     def test_fastly_provider_reads_api_key_from_vault(self, Terraform):
         terraform_binary = MagicMock()
@@ -245,12 +269,78 @@ class TestBuildercoreTerraform(base.BaseCase):
         terraform_binary = MagicMock()
         Terraform.return_value = terraform_binary
         terraform_binary.plan.return_value = (0, 'Plan output: ...', '')
+        terraform_binary.cmd.return_value = (0, json.dumps({'resource_changes': []}), '')
         stackname = 'project-with-fastly-minimal--%s' % self.environment
         context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
         terraform.init(stackname, context)
         delta = terraform.generate_delta(context)
+        self.assertEqual(delta, terraform.TerraformDelta('Plan output: ...', {}, {}, {}))
+        terraform_binary.plan.assert_called_once()
+        self.assertFalse(delta.non_empty)
+
+    @patch('buildercore.terraform.Terraform')
+    def test_delta_without_json_plan(self, Terraform):
+        terraform_binary = MagicMock()
+        Terraform.return_value = terraform_binary
+        terraform_binary.plan.return_value = (0, 'Plan output: ...', '')
+        terraform_binary.cmd.return_value = (1, '', 'flag provided but not defined: -json')
+        stackname = 'project-with-fastly-minimal--%s' % self.environment
+        context = cfngen.build_context('project-with-fastly-minimal', stackname=stackname)
+        delta = terraform.generate_delta(context)
         self.assertEqual(delta, terraform.TerraformDelta('Plan output: ...'))
 
+    def test_delta_from_plan(self):
+        plan = {
+            'resource_changes': [
+                {
+                    'address': 'fastly_service_v1.fastly-cdn',
+                    'change': {
+                        'actions': ['update'],
+                        'before': {'name': 'old', 'default_ttl': 3600},
+                        'after': {'name': 'new', 'default_ttl': 3600},
+                        'after_unknown': {},
+                    },
+                },
+                {
+                    'address': 'google_bigquery_dataset.my_dataset',
+                    'change': {
+                        'actions': ['create'],
+                        'before': None,
+                        'after': {'dataset_id': 'my_dataset'},
+                        'after_unknown': {'id': True},
+                    },
+                },
+                {
+                    'address': 'google_bigquery_table.old_table',
+                    'change': {
+                        'actions': ['delete'],
+                        'before': {'table_id': 'old_table'},
+                        'after': None,
+                    },
+                },
+                {
+                    'address': 'google_storage_bucket.unchanged',
+                    'change': {
+                        'actions': ['no-op'],
+                        'before': {'name': 'unchanged'},
+                        'after': {'name': 'unchanged'},
+                    },
+                },
+            ],
+        }
+        delta = terraform.TerraformDelta.from_plan('Plan output: ...', plan)
+        self.assertEqual(delta.plus, {
+            'google_bigquery_dataset.my_dataset': {'dataset_id': 'my_dataset', 'id': terraform.UNKNOWN_VALUE},
+        })
+        self.assertEqual(delta.edit, {
+            'fastly_service_v1.fastly-cdn': {'name': {'before': 'old', 'after': 'new'}},
+        })
+        self.assertEqual(delta.minus, {
+            'google_bigquery_table.old_table': {'table_id': 'old_table'},
+        })
+        self.assertTrue(delta.non_empty)
+        self.assertEqual(str(delta), 'Plan output: ...')
+
     def test_fastly_template_minimal(self):
         extra = {
             'stackname': 'project-with-fastly-minimal--%s' % self.environment,
@@ -727,6 +817,17 @@ class TestBuildercoreTerraform(base.BaseCase):
             },
         })
 
+    def test_bigquery_local_schemas_are_only_copied_when_changed(self):
+        extra = {
+            'stackname': 'project-with-bigquery--%s' % self.environment,
+        }
+        context = cfngen.build_context('project-with-bigquery', **extra)
+        with patch('buildercore.terraform.shutil.copyfile', wraps=shutil.copyfile) as copyfile:
+            terraform.render(context)
+            self.assertEqual(copyfile.call_count, 1)
+            terraform.render(context)
+            self.assertEqual(copyfile.call_count, 1)
+
     def test_bigquery_remote_paths(self):
         "remote paths require terraform to fetch and load the files, which requires another entry in the 'data' list"
         pname = 'project-with-bigquery-remote-schemas'
@@ -1418,6 +1519,13 @@ class TestBuildercoreTerraform(base.BaseCase):
         https://stackoverflow.com/a/16373377/91590"""
         return yaml.safe_load(terraform_template)
 
+    def _fake_terraform_init(self, stackname):
+        "creates the files a successful `terraform init` would leave behind"
+        terraform_dir = join(terraform.TERRAFORM_DIR, stackname, '.terraform')
+        os.makedirs(join(terraform_dir, 'plugins'))
+        with open(join(terraform_dir, 'terraform.tfstate'), 'w') as fp:
+            fp.write('{}')
+
     def _load_terraform_file(self, stackname, filename):
         with open(join(terraform.TERRAFORM_DIR, stackname, '%s.tf.json' % filename), 'r') as fp:
             return self._parse_template(fp.read())
@@ -3,8 +3,10 @@ import json  # , yaml
 import os
 from os.path import join
 import unittest
+import pytest
 from . import base
-from buildercore import cfngen, trop
+from buildercore import cfngen, trop, core, project
+from buildercore.utils import deepcopy
 
 class TestBuildercoreTrop(base.BaseCase):
     def setUp(self):
@@ -1246,6 +1248,37 @@ class TestOverriddenComponent(unittest.TestCase):
             trop.overridden_component(context, 'ec2', 2, ['ext'])
         )
 
+    def test_overrides_do_not_modify_the_context(self):
+        "node views share values with the context, overriding a value in one must not change it for the others"
+        context = {
+            'stackname': 'dummy1--test',
+            'project': {
+                'formula-repo': 'https://github.com/example/dummy1-formula',
+            },
+            'ec2': {
+                'cluster-size': 2,
+                'type': 't2.small',
+                'ext': {
+                    'size': 30,
+                },
+                'overrides': {
+                    2: {
+                        'type': 't2.large',
+                        'ext': {
+                            'size': 100,
+                        }
+                    }
+                }
+            }
+        }
+        original = deepcopy(context)
+        node_context = trop.overridden_context(context, 'ec2', 2, ['type', 'ext'])
+        self.assertEqual(node_context['ec2']['type'], 't2.large')
+        self.assertEqual(node_context['ec2']['ext'], {'size': 100})
+        self.assertNotIn('overrides', node_context['ec2'])
+        trop.build_vars(node_context, 2)
+        self.assertEqual(context, original)
+
     def test_rds_deletion_policy_snapshot(self):
         "default rds deletion policy is 'Snapshot'"
         extra = {
@@ -1391,6 +1424,26 @@ class TestIngress(base.BaseCase):
     def _dump_to_list_of_rules(self, ingress):
         return [r.to_dict() for r in trop.convert_ports_dict_to_troposphere(ingress)]
 
+def _project_configurations():
+    "every fixture project and each of its alternative configurations"
+    return [(pname, altconfig)
+            for pname in base.test_projects()
+            for altconfig in [None] + sorted(project.project_data(pname).get('aws-alt', {}).keys())]
+
+class TestRenderConformance():
+    "the dictionary returned by `trop.render_data` is exactly the template Troposphere renders"
+    @pytest.mark.parametrize("project_name,altconfig", _project_configurations())
+    def test_render_matches_troposphere(self, project_name, altconfig):
+        context = cfngen.build_context(project_name, stackname=core.mk_stackname(project_name, 'test'), **{'alt-config': altconfig})
+        expected = trop._render_template(deepcopy(context)).to_json()
+        self.assert_identical(expected, trop.render(deepcopy(context)))
+        self.assert_identical(json.loads(expected), trop.render_data(deepcopy(context)))
+
+    def assert_identical(self, expected, actual):
+        # `==` alone would consider 1 and 1.0 or True and 1 equal, JSON wouldn't
+        assert expected == actual
+        assert json.dumps(expected, sort_keys=True) == json.dumps(actual, sort_keys=True)
+
 def _parse_json(dump):
     """Parses dump into a dictionary, using strings rather than unicode strings
 
@@ -1,4 +1,5 @@
 from . import base
+import os
 from functools import partial
 from buildercore import utils
 from mock import patch, MagicMock
@@ -165,6 +166,18 @@ class Simple(base.BaseCase):
             pass
         self.assertRaises(CustomException, utils.ensure, False, "Error message", CustomException)
 
+    def test_pmap(self):
+        self.assertEqual([], utils.pmap(lambda x: x * 2, []))
+        self.assertEqual([2, 4, 6], utils.pmap(lambda x: x * 2, [1, 2, 3]))
+        self.assertEqual([2, 4, 6], utils.pmap(lambda x: x * 2, iter([1, 2, 3]), max_workers=2))
+
+    def test_pmap_propagates_errors(self):
+        def fn(x):
+            if x == 2:
+                raise ValueError("two")
+            return x
+        self.assertRaises(ValueError, utils.pmap, fn, [1, 2, 3])
+
     def test_nested_dictmap(self):
         "nested_dictmap transforms a dictionary recursively as expected"
         vals = {'foo': 'pants', 'bar': 'party'}
@@ -196,3 +209,15 @@ class Simple(base.BaseCase):
         ]
         for given, expected, func in cases:
             self.assertEqual(expected, utils.nested_dictmap(func, given))
+
+    def test_read_file_is_read_again_once_modified(self):
+        tempdir, killer = utils.tempdir()
+        self.addCleanup(killer)
+        path = os.path.join(tempdir, 'file.txt')
+        with open(path, 'w') as fp:
+            fp.write('foo')
+        self.assertEqual(utils.read_file(path), 'foo')
+        self.assertEqual(utils.read_file(path), 'foo')
+        with open(path, 'w') as fp:
+            fp.write('foobar')
+        self.assertEqual(utils.read_file(path), 'foobar')
@@ -0,0 +1,88 @@
+import os, sys, time, signal
+import subprocess
+from . import base
+from buildercore import utils
+import taskrunner as tr
+import daemon
+
+class Daemon(base.BaseCase):
+    def setUp(self):
+        # the daemon and its clients find the socket relative to their working directory
+        self.temp_dir, rm_temp_dir = utils.tempdir()
+        self.addCleanup(rm_temp_dir)
+        self.socket_path = os.path.join(self.temp_dir, '.cfn', 'bldr.sock')
+        self.env = dict(os.environ, PYTHONPATH=tr.SRC_PATH)
+
+    def start_daemon(self):
+        script = "; ".join([
+            "import sys, time, daemon, taskrunner",
+            # a task that runs until it is interrupted
+            "exec('def sleep():\\n    print(\"sleeping\")\\n    sys.stdout.flush()\\n    time.sleep(60)')",
+            "taskrunner.UNQUALIFIED_TASK_LIST.append(sleep)",
+            "daemon.serve(%r, warm_caches=False)" % self.socket_path,
+        ])
+        # gevent replaces `subprocess.Popen` when it is imported, don't bind to it early
+        proc = subprocess.Popen([sys.executable, '-c', script], cwd=self.temp_dir, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.addCleanup(proc.kill)
+        for _ in range(100):
+            if daemon.server_status(self.socket_path):
+                return proc
+            time.sleep(0.1)
+        self.fail("daemon failed to start")
+
+    def bldr(self, command, **env):
+        taskrunner_path = os.path.join(tr.SRC_PATH, 'taskrunner.py')
+        return subprocess.check_output([sys.executable, taskrunner_path, command], cwd=self.temp_dir,
+                            env=dict(self.env, **env), stdin=open(os.devnull, 'r')).decode()
+
+    def test_partial_marker_length(self):
+        "only the end of the output that may be the start of the exit marker is held back"
+        cases = [
+            (b"", 0),
+            (b"sleeping\n", 0),
+            (b"sleeping\n\x00", 1),
+            (b"sleeping\n\x00bldr-daemon", 12),
+            (b"sleeping\n\x00bldr-daemon-exit", 17),
+        ]
+        for data, expected in cases:
+            self.assertEqual(expected, daemon._partial_marker_length(data))
+
+    def test_no_daemon(self):
+        self.assertEqual(None, daemon.server_status(self.socket_path))
+        self.assertEqual(None, daemon.client("ping", self.socket_path))
+
+    def test_tasks_are_sent_to_daemon(self):
+        proc = self.start_daemon()
+        self.assertEqual(0, daemon.server_status(self.socket_path)['running-tasks'])
+
+        self.assertIn("received: hello", self.bldr("echo:hello"))
+        self.assertIn("received: bypassed", self.bldr("echo:bypassed", BLDR_DAEMON="0"))
+
+        daemon.send_request({'control': 'stop'}, self.socket_path)
+        proc.wait()
+        self.assertEqual(None, daemon.server_status(self.socket_path))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+        log = proc.stderr.read().decode()
+        self.assertIn("running 'echo:hello'", log)
+        self.assertNotIn("echo:bypassed", log)
+
+    def test_interrupted_task_is_cancelled(self):
+        "SIGINT received by the client interrupts the task running in the daemon"
+        self.start_daemon()
+        taskrunner_path = os.path.join(tr.SRC_PATH, 'taskrunner.py')
+        client = subprocess.Popen([sys.executable, taskrunner_path, "sleep"], cwd=self.temp_dir, env=self.env,
+                                  stdin=open(os.devnull, 'r'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.addCleanup(lambda: client.poll() is None and client.kill())
+        self.assertEqual(b"sleeping", client.stdout.readline().strip())
+        self.assertEqual(1, daemon.server_status(self.socket_path)['running-tasks'])
+
+        client.send_signal(signal.SIGINT)
+        self.assertIn(b"Stopped.", client.stdout.read())
+        self.assertEqual(1, client.wait())
+        for _ in range(50):
+            if daemon.server_status(self.socket_path)['running-tasks'] == 0:
+                return
+            time.sleep(0.1)
+        self.fail("task is still running")
@@ -25,9 +25,9 @@ class TestDecorators(base.BaseCase):
         with open('/tmp/.active-stack') as f:
             self.assertEqual(f.read(), 'lax--ci')
 
-    @patch('buildercore.core.active_stack_names', return_value=['dummy1--ci'])
+    @patch('buildercore.inventory.stacks', return_value=[('dummy1--ci', 'CREATE_COMPLETE', {})])
     @patch('utils.get_input', return_value='1')
-    def test_requires_aws_project_stack(self, get_input, active_stack_names):
+    def test_requires_aws_project_stack(self, get_input, stacks):
         @decorators.requires_aws_project_stack('dummy1')
         def some_task(stackname):
             self.assertEqual('dummy1--ci', stackname)
@@ -35,7 +35,7 @@ class TestDecorators(base.BaseCase):
 
         self.assertEqual(some_task('dummy1--ci'), 'result')
 
-    @patch('buildercore.core.active_stack_names', return_value=['dummy1--ci', 'dummy1--end2end'])
+    @patch('buildercore.inventory.active_stack_names', return_value=['dummy1--ci', 'dummy1--end2end'])
     @patch('utils.get_input', return_value='2')
     def test_requires_aws_stack(self, get_input, active_stack_names):
         @decorators.requires_aws_stack
@@ -1,4 +1,5 @@
-import sys
+import sys, os, json, importlib
+from subprocess import check_output
 from . import base
 try:
     from StringIO import StringIO
@@ -127,3 +128,63 @@ class TaskRunner(base.BaseCase):
             'task_args': ['hello, world'],
             'task_kwargs': {}}
         self.assertEqual(expected, result_map)
+
+    def test_lazy_tasks_are_imported_when_called(self):
+        task_map = tr.mk_task_map('taskrunner.echo')
+        self.assertEqual('taskrunner.echo', task_map['name'])
+        self.assertEqual('received: zulu', capture_stdout(lambda: task_map['fn']('zulu'))['result'])
+
+    def test_task_descriptions_match_docstrings(self):
+        "the descriptions of lazily loaded tasks are read from their source and match those of the imported task"
+        for task_map in tr.generate_task_list(show_debug_tasks=True):
+            module_name, task_name = task_map['path'].rsplit('.', 1)
+            if module_name == 'taskrunner':
+                continue
+            task = getattr(importlib.import_module(module_name), task_name)
+            self.assertEqual((task.__doc__ or '').strip().replace('\n', ' '), task_map['description'])
+
+    def test_task_modules_are_not_imported_for_trivial_tasks(self):
+        "listing tasks and running trivial tasks doesn't import the bulk of builder"
+        script = "; ".join([
+            "import sys, json",
+            "import taskrunner as tr",
+            "tr.generate_task_list(show_debug_tasks=True)",
+            "tr.main(['ping'])",
+            "print(json.dumps(sorted(sys.modules.keys())))",
+        ])
+        stdout = check_output([sys.executable, '-c', script], cwd=tr.SRC_PATH, stderr=open(os.devnull, 'w'),
+                              env=dict(os.environ, BLDR_DAEMON='0'))
+        modules = json.loads(stdout.decode().splitlines()[-1])
+        for module in ['cfn', 'buildercore.core', 'buildercore.config', 'boto3', 'troposphere', 'fabric']:
+            self.assertNotIn(module, modules)
+
+class MultiStack(base.BaseCase):
+    def test_stack_task_str(self):
+        cases = [
+            ("buildvars.fix", "buildvars.fix:lax--prod"),
+            ("echo:msg,key=val", "echo:lax--prod,msg,key=val"),
+        ]
+        for task_str, expected in cases:
+            self.assertEqual(expected, tr.stack_task_str(task_str, 'lax--prod'))
+
+    def test_exec_task_on_stacks(self):
+        expected = [
+            {'stackname': 'journal--prod', 'rc': 0, 'error': None},
+            {'stackname': 'lax--prod', 'rc': 0, 'error': None},
+            {'stackname': 'pants', 'rc': 1, 'error': None},
+        ]
+        for concurrency in [1, 2]:
+            results = capture_stdout(lambda: tr.exec_task_on_stacks("echo", ['journal--prod', 'lax--prod'], concurrency))
+            self.assertEqual(expected[:2], results['result'])
+        results = capture_stdout(lambda: tr.exec_task_on_stacks("pants", ['pants'], 2))
+        self.assertEqual(expected[2:], results['result'])
+
+    def test_main_with_stack_selector(self):
+        os.environ['BLDR_STACKS'] = 'journal--prod,lax--prod'
+        try:
+            response = capture_stdout(lambda: tr.main(["echo:hello"]))
+        finally:
+            del os.environ['BLDR_STACKS']
+        self.assertEqual(SUCCESS_RC, response['result'])
+        self.assertIn("received: journal--prod with args: ('hello',)", response['stdout'])
+        self.assertIn("2 of 2 stacks succeeded", response['stdout'])
@@ -1,5 +1,7 @@
+import os
 from . import base
 from mock import patch, call
+from buildercore import utils as core_utils
 import utils
 
 class TestUtils(base.BaseCase):
@@ -70,3 +72,27 @@ class TestUtils(base.BaseCase):
         rows = [AnObject('lax', 'ci'), AnObject('bot', 'end2end')]
         keys = ['project', 'instance_id']
         self.assertEqual("lax, ci\nbot, end2end", utils.table(rows, keys))
+
+    def test_select_stacks(self):
+        stack_list = ['journal--end2end', 'journal--prod', 'lax--prod', 'observer--prod']
+        cases = [
+            ("journal", ['journal--end2end', 'journal--prod']),
+            ("*--prod", ['journal--prod', 'lax--prod', 'observer--prod']),
+            ("lax,journal--end2end", ['lax--prod', 'journal--end2end']),
+            ("journal--prod,*--prod", ['journal--prod', 'lax--prod', 'observer--prod']),
+            ("unknown", []),
+        ]
+        for selector, expected in cases:
+            self.assertEqual(expected, utils.select_stacks(selector, lambda: stack_list))
+
+    def test_select_stacks_from_file(self):
+        temp_dir, rm_temp_dir = core_utils.tempdir()
+        self.addCleanup(rm_temp_dir)
+        path = os.path.join(temp_dir, 'stacks.txt')
+        with open(path, 'w') as fh:
+            fh.write("# maintenance\njournal--prod\n\nlax--prod # the api\n")
+
+        def stack_list():
+            raise AssertionError("stack files and stacknames don't require a list of stacks")
+        self.assertEqual(['journal--prod', 'lax--prod', 'elife-bot--prod'],
+                         utils.select_stacks("@%s,elife-bot--prod" % path, stack_list))
@@ -1,5 +1,5 @@
 import logging
-import os, sys
+import os, sys, fnmatch
 from buildercore import config
 from buildercore.utils import second, last, gtpy2
 from buildercore.command import local
@@ -134,3 +134,44 @@ def find_region(stackname=None):
     except core.MultipleRegionsError as e:
         print("many possible regions found!")
         return _pick('region', e.regions())
+
+def _read_stack_file(path):
+    "returns the stacknames listed in the given file, one per line. blank lines and #comments are ignored"
+    with open(path, 'r') as fh:
+        lines = [line.split('#', 1)[0].strip() for line in fh]
+    return [line for line in lines if line]
+
+def select_stacks(selector, stack_list_fn):
+    """returns an ordered, de-duplicated list of stacknames matching the given comma-separated `selector`.
+    each part of the selector can be:
+
+    * '@path/to/file', a file listing stacknames, one per line
+    * a glob, for example 'journal--*' or '*--prod'
+    * a project name, for example 'journal', the same as the glob 'journal--*'
+    * a stackname, for example 'journal--prod'
+
+    `stack_list_fn` returns the list of stacks globs are matched against and is only called if necessary."""
+    cache = {}
+
+    def stack_list():
+        if 'stacks' not in cache:
+            cache['stacks'] = stack_list_fn()
+        return cache['stacks']
+
+    results = []
+    for part in selector.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if part.startswith('@'):
+            matches = _read_stack_file(part[1:])
+        elif any(char in part for char in '*?['):
+            matches = fnmatch.filter(stack_list(), part)
+        elif '--' in part:
+            matches = [part]
+        else:
+            matches = fnmatch.filter(stack_list(), part + '--*')
+        for stackname in matches:
+            if stackname not in results:
+                results.append(stackname)
+    return results